@@ -0,0 +1,149 @@
+"""Micro-benchmark of the viewport pruning in fetch_page_accessibility_tree
+
+Builds synthetic trees shaped like the output of Accessibility.getFullAXTree, with a matching DOM snapshot, bounds
+every node once, and then times only the pruning: prune_to_viewport against the original implementation, which
+spliced each removed node out of its parent's childIds with list.index and list.insert. Both results are checked
+to be identical.
+
+The "wide" shape puts most nodes in a few long lists (search results, tables, feeds), where the splicing is
+quadratic in the list length; the "random" shape has small fan-outs.
+
+    python benchmarks/bench_ax_pruning.py --sizes 1000 5000 20000 --shape wide
+"""
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils_webarena import IN_VIEWPORT_RATIO_THRESHOLD, fetch_page_accessibility_tree, \
+    get_element_in_viewport_ratio, make_browser_info, prune_to_viewport
+
+VIEWPORT = {"pageXOffset": 0, "pageYOffset": 0, "screenWidth": 1024, "screenHeight": 768, "outerWidth": 1024,
+            "devicePixelRatio": 1.0}
+
+
+def synthetic_page(size, seed=0, shape="random"):
+    """
+    getFullAXTree-shaped nodes and a DOM snapshot laying them out on a page about ten viewports tall
+
+    Args:
+        size (int): Number of accessibility nodes.
+        seed (int): Random seed.
+        shape (str): "random" or "wide" (most nodes in a few long lists).
+
+    Returns:
+        tuple: (nodes, snapshot) as returned by Chrome.
+    """
+    rnd = random.Random(seed)
+    nodes = [{"nodeId": "1", "role": {"value": "RootWebArea"}, "name": {"value": "page"}, "childIds": [],
+              "backendDOMNodeId": 1}]
+    backend_node_ids = [1]
+    bounds = [[0, 0, 1024, 768 * 10]]
+    layout_node_index = [0]
+    for i in range(2, size + 1):
+        if shape == "wide":
+            if i <= 5:
+                parent = nodes[0]  # four lists
+            elif i % 2:
+                parent = nodes[1 + i % 4]  # an item of one of the lists
+            else:
+                parent = nodes[-1]  # a link inside the previous item
+        else:
+            # mostly shallow and wide, with some long wrapper chains, like real pages
+            parent = nodes[-1] if rnd.random() < 0.3 else nodes[rnd.randrange(len(nodes))]
+        parent["childIds"].append(str(i))
+        node = {"nodeId": str(i), "parentId": parent["nodeId"],
+                "role": {"value": rnd.choice(["generic", "link", "StaticText", "button", "listitem"])},
+                "name": {"value": f"node {i}"}, "childIds": []}
+        if rnd.random() < 0.9:
+            node["backendDOMNodeId"] = i
+            backend_node_ids.append(i)
+            if rnd.random() < 0.9:
+                layout_node_index.append(len(backend_node_ids) - 1)
+                bounds.append([rnd.uniform(0, 1000), rnd.uniform(0, 768 * 10), rnd.uniform(0, 200),
+                               rnd.uniform(0, 40)])
+        nodes.append(node)
+    snapshot = {"documents": [{"nodes": {"backendNodeId": backend_node_ids},
+                               "layout": {"nodeIndex": layout_node_index, "bounds": bounds}}], "strings": []}
+    return nodes, snapshot
+
+
+def original_pruning(accessibility_tree, info):
+    """Viewport pruning as it was before, given nodes whose union_bound is already set"""
+    nodeid_to_cursor = {node["nodeId"]: cursor for cursor, node in enumerate(accessibility_tree)}
+
+    def remove_node_in_graph(node):
+        nodeid = node["nodeId"]
+        node_cursor = nodeid_to_cursor[nodeid]
+        parent_nodeid = node["parentId"]
+        children_nodeids = node["childIds"]
+        parent_cursor = nodeid_to_cursor[parent_nodeid]
+        index = accessibility_tree[parent_cursor]["childIds"].index(nodeid)
+        accessibility_tree[parent_cursor]["childIds"].pop(index)
+        for child_nodeid in children_nodeids:
+            accessibility_tree[parent_cursor]["childIds"].insert(index, child_nodeid)
+            index += 1
+        for child_nodeid in children_nodeids:
+            accessibility_tree[nodeid_to_cursor[child_nodeid]]["parentId"] = parent_nodeid
+        accessibility_tree[node_cursor]["parentId"] = "[REMOVED]"
+
+    config = info["config"]
+    for node in accessibility_tree:
+        if not node["union_bound"]:
+            remove_node_in_graph(node)
+            continue
+        [x, y, width, height] = node["union_bound"]
+        if width == 0 or height == 0:
+            remove_node_in_graph(node)
+            continue
+        if get_element_in_viewport_ratio(elem_left_bound=float(x), elem_top_bound=float(y), width=float(width),
+                                         height=float(height), config=config) < IN_VIEWPORT_RATIO_THRESHOLD:
+            remove_node_in_graph(node)
+
+    return [node for node in accessibility_tree if node.get("parentId", "Root") != "[REMOVED]"]
+
+
+def best_of(function, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the accessibility tree viewport pruning")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 5000, 10000, 20000, 40000])
+    parser.add_argument("--shape", type=str, default="wide", choices=["wide", "random"])
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.shape} trees")
+    print(f"{'nodes':>8} {'kept':>8} {'original ms':>12} {'current ms':>12} {'speedup':>8}")
+    for size in args.sizes:
+        nodes, snapshot = synthetic_page(size, shape=args.shape)
+        info = make_browser_info(snapshot, VIEWPORT)
+        config = info["config"]
+
+        # Bounds as the current code computes them; the original fetched them one by one from the browser.
+        # Only the pruning below is timed.
+        bounded = fetch_page_accessibility_tree(info, None, current_viewport_only=False, nodes=nodes)
+        expected = original_pruning(copy.deepcopy(bounded), info)
+        pruned = prune_to_viewport(copy.deepcopy(bounded), config)
+        assert [(n["nodeId"], n["childIds"]) for n in pruned] == [(n["nodeId"], n["childIds"]) for n in expected]
+
+        # the copies are made outside the timed region
+        copies = [copy.deepcopy(bounded) for _ in range(args.rounds)]
+        original_ms = best_of(lambda: original_pruning(copies.pop(), info), args.rounds)
+        copies = [copy.deepcopy(bounded) for _ in range(args.rounds)]
+        current_ms = best_of(lambda: prune_to_viewport(copies.pop(), config), args.rounds)
+        print(f"{size:>8} {len(pruned):>8} {original_ms:>12.1f} {current_ms:>12.1f} {original_ms / current_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
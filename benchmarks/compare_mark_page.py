@@ -0,0 +1,282 @@
+"""Compare the Set-of-Mark labels of the original and the current marking script
+
+Loads each page in Chrome, marks it with the original script (one querySelectorAll pass, a WebDriver call per
+element attribute) and with get_web_element_rect, and checks that both find the same elements in the same order
+with the same text, tag, type and aria-label descriptions. Prints the mean time of each.
+
+    python benchmarks/compare_mark_page.py                       # benchmarks/fixtures/marking.html
+    python benchmarks/compare_mark_page.py file:///path/to/saved_page.html https://www.example.com
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import pathlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import get_web_element_rect, remove_som_overlays
+
+FIXTURE = pathlib.Path(__file__).resolve().parent / "fixtures" / "marking.html"
+
+
+# The original implementation, kept verbatim as the reference
+def original_get_web_element_rect(browser, fix_color=True):
+    if fix_color:
+        selected_function = "getFixedColor"
+        # color_you_like = '#5210da'
+    else:
+        selected_function = "getRandomColor"
+
+    js_script = """
+        let labels = [];
+
+        function markPage() {
+            var bodyRect = document.body.getBoundingClientRect();
+
+            var items = Array.prototype.slice.call(
+                document.querySelectorAll('*')
+            ).map(function(element) {
+                var vw = Math.max(document.documentElement.clientWidth || 0, window.innerWidth || 0);
+                var vh = Math.max(document.documentElement.clientHeight || 0, window.innerHeight || 0);
+                
+                var rects = [...element.getClientRects()].filter(bb => {
+                var center_x = bb.left + bb.width / 2;
+                var center_y = bb.top + bb.height / 2;
+                var elAtCenter = document.elementFromPoint(center_x, center_y);
+
+                return elAtCenter === element || element.contains(elAtCenter) 
+                }).map(bb => {
+                const rect = {
+                    left: Math.max(0, bb.left),
+                    top: Math.max(0, bb.top),
+                    right: Math.min(vw, bb.right),
+                    bottom: Math.min(vh, bb.bottom)
+                };
+                return {
+                    ...rect,
+                    width: rect.right - rect.left,
+                    height: rect.bottom - rect.top
+                }
+                });
+
+                var area = rects.reduce((acc, rect) => acc + rect.width * rect.height, 0);
+
+                return {
+                element: element,
+                include: 
+                    (element.tagName === "INPUT" || element.tagName === "TEXTAREA" || element.tagName === "SELECT") ||
+                    (element.tagName === "BUTTON" || element.tagName === "A" || (element.onclick != null) || window.getComputedStyle(element).cursor == "pointer") ||
+                    (element.tagName === "IFRAME" || element.tagName === "VIDEO" || element.tagName === "LI" || element.tagName === "TD" || element.tagName === "OPTION")
+                ,
+                area,
+                rects,
+                text: element.textContent.trim().replace(/\s{2,}/g, ' ')
+                };
+            }).filter(item =>
+                item.include && (item.area >= 20)
+            );
+
+            // Only keep inner clickable items
+            // first delete button inner clickable items
+            const buttons = Array.from(document.querySelectorAll('button, a, input[type="button"], div[role="button"]'));
+
+            //items = items.filter(x => !buttons.some(y => y.contains(x.element) && !(x.element === y) ));
+            items = items.filter(x => !buttons.some(y => items.some(z => z.element === y) && y.contains(x.element) && !(x.element === y) ));
+            items = items.filter(x => 
+                !(x.element.parentNode && 
+                x.element.parentNode.tagName === 'SPAN' && 
+                x.element.parentNode.children.length === 1 && 
+                x.element.parentNode.getAttribute('role') &&
+                items.some(y => y.element === x.element.parentNode)));
+
+            items = items.filter(x => !items.some(y => x.element.contains(y.element) && !(x == y)))
+
+            // Function to generate random colors
+            function getRandomColor(index) {
+                var letters = '0123456789ABCDEF';
+                var color = '#';
+                for (var i = 0; i < 6; i++) {
+                color += letters[Math.floor(Math.random() * 16)];
+                }
+                return color;
+            }
+
+            function getFixedColor(index) {
+                var color = '#000000'
+                return color
+            }
+            //function getFixedColor(index){
+            //    var colors = ['#FF0000', '#00FF00', '#0000FF', '#000000']; // Red, Green, Blue, Black
+            //    return colors[index % 4];
+            //}
+            
+
+            // Lets create a floating border on top of these elements that will always be visible
+            items.forEach(function(item, index) {
+                item.rects.forEach((bbox) => {
+                newElement = document.createElement("div");
+                var borderColor = COLOR_FUNCTION(index);
+                newElement.style.outline = `2px dashed ${borderColor}`;
+                newElement.style.position = "fixed";
+                newElement.style.left = bbox.left + "px";
+                newElement.style.top = bbox.top + "px";
+                newElement.style.width = bbox.width + "px";
+                newElement.style.height = bbox.height + "px";
+                newElement.style.pointerEvents = "none";
+                newElement.style.boxSizing = "border-box";
+                newElement.style.zIndex = 2147483647;
+                // newElement.style.background = `${borderColor}80`;
+                
+                // Add floating label at the corner
+                var label = document.createElement("span");
+                label.textContent = index;
+                label.style.position = "absolute";
+                //label.style.top = "-19px";
+                label.style.top = Math.max(-19, -bbox.top) + "px";
+                //label.style.left = "0px";
+                label.style.left = Math.min(Math.floor(bbox.width / 5), 2) + "px";
+                label.style.background = borderColor;
+                label.style.color = "white";
+                label.style.padding = "2px 4px";
+                label.style.fontSize = "12px";
+                label.style.borderRadius = "2px";
+                newElement.appendChild(label);
+                
+                document.body.appendChild(newElement);
+                labels.push(newElement);
+                // item.element.setAttribute("-ai-label", label.textContent);
+                });
+            })
+
+            // For the first way
+            // return [labels, items.map(item => ({
+            //     rect: item.rects[0] // assuming there's at least one rect
+            // }))];
+
+            // For the second way
+            return [labels, items]
+        }
+        return markPage();""".replace("COLOR_FUNCTION", selected_function)
+    rects, items_raw = browser.execute_script(js_script)
+
+    # format_ele_text = [f"[{web_ele_id}]: \"{items_raw[web_ele_id]['text']}\";" for web_ele_id in range(len(items_raw)) if items_raw[web_ele_id]['text'] ]
+    format_ele_text = []
+    for web_ele_id in range(len(items_raw)):
+        label_text = items_raw[web_ele_id]['text']
+        ele_tag_name = items_raw[web_ele_id]['element'].tag_name
+        ele_type = items_raw[web_ele_id]['element'].get_attribute("type")
+        ele_aria_label = items_raw[web_ele_id]['element'].get_attribute("aria-label")
+        input_attr_types = ['text', 'search', 'password', 'email', 'tel']
+
+        if not label_text:
+            if (ele_tag_name.lower() == 'input' and ele_type in input_attr_types) or ele_tag_name.lower() == 'textarea' or (ele_tag_name.lower() == 'button' and ele_type in ['submit', 'button']):
+                if ele_aria_label:
+                    format_ele_text.append(f"[{web_ele_id}]: <{ele_tag_name}> \"{ele_aria_label}\";")
+                else:
+                    format_ele_text.append(f"[{web_ele_id}]: <{ele_tag_name}> \"{label_text}\";" )
+
+        elif label_text and len(label_text) < 200:
+            if not ("<img" in label_text and "src=" in label_text):
+                if ele_tag_name in ["button", "input", "textarea"]:
+                    if ele_aria_label and (ele_aria_label != label_text):
+                        format_ele_text.append(f"[{web_ele_id}]: <{ele_tag_name}> \"{label_text}\", \"{ele_aria_label}\";")
+                    else:
+                        format_ele_text.append(f"[{web_ele_id}]: <{ele_tag_name}> \"{label_text}\";")
+                else:
+                    if ele_aria_label and (ele_aria_label != label_text):
+                        format_ele_text.append(f"[{web_ele_id}]: \"{label_text}\", \"{ele_aria_label}\";")
+                    else:
+                        format_ele_text.append(f"[{web_ele_id}]: \"{label_text}\";")
+
+
+
+    format_ele_text = '\t'.join(format_ele_text)
+    return rects, [web_ele['element'] for web_ele in items_raw], format_ele_text
+
+
+def element_descriptions(elements):
+    """Text, tag, type and aria-label of each element, read the way the original did"""
+    return [(element.text, element.tag_name, element.get_attribute("type"), element.get_attribute("aria-label"))
+            for element in elements]
+
+
+def compare(driver, url, rounds):
+    """
+    Mark one page with both scripts
+
+    Returns:
+        dict: Number of elements found by each, whether the labels match, and the mean milliseconds of each.
+    """
+    driver.get(url)
+    time.sleep(1)
+
+    original_ms = current_ms = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        overlays, original_elements, original_text = original_get_web_element_rect(driver, fix_color=True)
+        original_ms += time.perf_counter() - start
+        driver.execute_script("arguments[0].forEach(overlay => overlay.remove());", overlays)
+
+        start = time.perf_counter()
+        _, current_elements, current_text = get_web_element_rect(driver, fix_color=True)
+        current_ms += time.perf_counter() - start
+        remove_som_overlays(driver)
+
+    result = {
+        "url": url,
+        "original_elements": len(original_elements),
+        "current_elements": len(current_elements),
+        "same_elements": original_elements == current_elements,
+        "same_text": original_text == current_text,
+        "original_ms": round(original_ms * 1000 / rounds, 1),
+        "current_ms": round(current_ms * 1000 / rounds, 1),
+    }
+    if not result["same_text"]:
+        original_lines, current_lines = original_text.split("\t"), current_text.split("\t")
+        index = next((i for i, (a, b) in enumerate(zip(original_lines, current_lines)) if a != b),
+                     min(len(original_lines), len(current_lines)))
+        result["first_difference"] = (original_lines[index:index + 1], current_lines[index:index + 1])
+    if not result["same_elements"]:
+        original_ids = {element.id for element in original_elements}
+        current_ids = {element.id for element in current_elements}
+        only_original = [element for element in original_elements if element.id not in current_ids]
+        only_current = [element for element in current_elements if element.id not in original_ids]
+        result["only_original"] = element_descriptions(only_original[:5])
+        result["only_current"] = element_descriptions(only_current[:5])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the original and the current Set-of-Mark labels")
+    parser.add_argument("urls", type=str, nargs="*", default=[FIXTURE.as_uri()],
+                        help="Pages to mark, e.g. file:///path/to/page.html")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--window_width", type=int, default=1024)
+    parser.add_argument("--window_height", type=int, default=768)
+    parser.add_argument("--no_headless", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    from selenium import webdriver
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--force-device-scale-factor=1")
+    options.add_argument(f"--window-size={args.window_width},{args.window_height}")
+    if not args.no_headless:
+        options.add_argument("--headless")
+    driver = webdriver.Chrome(options=options)
+    mismatches = 0
+    try:
+        for url in args.urls:
+            result = compare(driver, url, args.rounds)
+            mismatches += not (result["same_elements"] and result["same_text"])
+            print(result)
+    finally:
+        driver.quit()
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import json
+import time
+import base64
+import logging
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+
+class CDPError(Exception):
+    """Error returned by Chrome for a DevTools command"""
+
+
+class CDPChannel:
+    """CDP Channel - sends DevTools commands over the page's websocket instead of Selenium's HTTP endpoint,
+    so that independent commands can be pipelined"""
+
+    def __init__(self, driver, websocket_url: str, timeout: float = 30.0):
+        """
+        Initialize the channel; use CDPChannel.connect to create one
+
+        Args:
+            driver: Selenium Chrome driver, used when the websocket fails.
+            websocket_url (str): DevTools websocket of the page target.
+            timeout (float): Timeout of one command in seconds.
+        """
+        self.driver = driver
+        self.timeout = timeout
+        self.stats = {"commands": 0, "fallbacks": 0}
+        self._next_id = 0
+        self._pending: Dict[int, Future] = {}
+        # event method -> callables run on the reader thread with the event's params
+        self._handlers: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._ws = websocket.create_connection(websocket_url, timeout=timeout, suppress_origin=True,
+                                               enable_multithread=True)
+        # The timeout only bounds the handshake; an idle socket (long model calls) must not end the reader.
+        # Each command is bounded by future.result(timeout=...) instead.
+        self._ws.settimeout(None)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    @classmethod
+    def connect(cls, driver, timeout: float = 30.0) -> Optional["CDPChannel"]:
+        """
+        Open a channel to the driver's current window
+
+        Args:
+            driver: Selenium Chrome driver.
+            timeout (float): Timeout of one command in seconds.
+
+        Returns:
+            Optional[CDPChannel]: The channel, or None if websocket-client is not installed or Chrome's
+                DevTools endpoint cannot be reached; callers then keep using Selenium.
+        """
+        if websocket is None:
+            logging.warning("websocket-client is not installed, CDP commands go through Selenium")
+            return None
+        try:
+            address = driver.capabilities["goog:chromeOptions"]["debuggerAddress"]
+            # ChromeDriver window handles are DevTools target ids
+            target_id = driver.current_window_handle
+            with urllib.request.urlopen(f"http://{address}/json", timeout=timeout) as response:
+                targets = json.loads(response.read().decode("utf-8"))
+            websocket_url = next(target["webSocketDebuggerUrl"] for target in targets if target["id"] == target_id)
+            return cls(driver, websocket_url, timeout)
+        except Exception as e:
+            logging.warning(f"DevTools websocket unavailable, CDP commands go through Selenium: {e}")
+            return None
+
+    def _read(self) -> None:
+        """Resolve the pending commands with the responses read from the websocket"""
+        while not self._closed:
+            try:
+                message = json.loads(self._ws.recv())
+            except Exception as e:
+                self._fail_pending(e)
+                return
+            if "id" not in message:
+                self._dispatch(message.get("method"), message.get("params", {}))
+                continue
+            with self._lock:
+                future = self._pending.pop(message["id"], None)
+            if future is None:
+                continue
+            if "error" in message:
+                future.set_exception(CDPError(message["error"].get("message", str(message["error"]))))
+            else:
+                future.set_result(message.get("result", {}))
+
+    def _dispatch(self, method: str, params: Dict[str, Any]) -> None:
+        for handler in self._handlers.get(method, []):
+            try:
+                handler(params)
+            except Exception as e:
+                logging.warning(f"DevTools event handler for {method} failed: {e}")
+
+    def on(self, method: str, handler: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        Call handler with the params of every event of a method; it runs on the reader thread, so it must not
+        wait for command results (send() without waiting is fine)
+        """
+        self._handlers.setdefault(method, []).append(handler)
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def send(self, method: str, params: Optional[Dict[str, Any]] = None) -> Future:
+        """Send a command without waiting for its response"""
+        future = Future()
+        with self._lock:
+            # Checked under the lock: _fail_pending swaps the pending commands under it, and a command
+            # registered afterwards would only fail through its timeout
+            if self._closed:
+                future.set_exception(ConnectionError("DevTools websocket is closed"))
+                return future
+            self._next_id += 1
+            command_id = self._next_id
+            self._pending[command_id] = future
+        try:
+            self._ws.send(json.dumps({"id": command_id, "method": method, "params": params or {}}))
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(command_id, None)
+            future.set_exception(e)
+        self.stats["commands"] += 1
+        return future
+
+    def execute_many(self, commands: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Send independent commands back to back and wait for all of them
+
+        Args:
+            commands (List[Tuple[str, Dict[str, Any]]]): (method, params) pairs.
+
+        Returns:
+            List[Dict[str, Any]]: The results, in the order of the commands. Commands that failed on the
+                websocket are retried through Selenium; Chrome's own errors are raised.
+        """
+        futures = [self.send(method, params) for method, params in commands]
+        results = []
+        for (method, params), future in zip(commands, futures):
+            try:
+                results.append(future.result(timeout=self.timeout))
+            except CDPError:
+                raise
+            except Exception as e:
+                logging.warning(f"DevTools websocket failed on {method} ({e}), using Selenium")
+                self.stats["fallbacks"] += 1
+                results.append(self.driver.execute_cdp_cmd(method, params))
+        return results
+
+    def execute_cdp_cmd(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Same as the driver's execute_cdp_cmd"""
+        return self.execute_many([(method, params or {})])[0]
+
+    def evaluate(self, expression: str) -> Any:
+        """Value of a JavaScript expression in the page"""
+        result = self.execute_cdp_cmd("Runtime.evaluate", {"expression": expression, "returnByValue": True})
+        if "exceptionDetails" in result:
+            raise CDPError(result["exceptionDetails"].get("text", "JavaScript exception"))
+        return result["result"].get("value")
+
+    def capture_screenshot(self) -> bytes:
+        """Viewport screenshot as PNG bytes, like get_screenshot_as_png"""
+        return base64.b64decode(self.execute_cdp_cmd("Page.captureScreenshot", {"format": "png"})["data"])
+
+    def close(self) -> None:
+        """Close the websocket"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            self._ws.close()
+        except Exception:
+            pass
+        logging.info(f"DevTools websocket: {self.stats['commands']} commands, {self.stats['fallbacks']} fell back "
+                     f"to Selenium")
+
+
+def benchmark(url: str, rounds: int = 20, headless: bool = True) -> Dict[str, float]:
+    """
+    Compare the observation commands through Selenium and through the websocket on one page
+
+    Args:
+        url (str): Page to load, e.g. file:///path/to/fixture.html.
+        rounds (int): Number of observations per path.
+        headless (bool): Run Chrome headlessly.
+
+    Returns:
+        Dict[str, float]: Mean milliseconds per observation of each path.
+    """
+    from selenium import webdriver
+    from utils_webarena import fetch_browser_info, fetch_page_accessibility_tree, fetch_observation_data
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--force-device-scale-factor=1")
+    if headless:
+        options.add_argument("--headless")
+    driver = webdriver.Chrome(options=options)
+    try:
+        driver.get(url)
+        channel = CDPChannel.connect(driver)
+        if channel is None:
+            raise RuntimeError("DevTools websocket unavailable")
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            info = fetch_browser_info(driver)
+            fetch_page_accessibility_tree(info, driver, current_viewport_only=True)
+            driver.get_screenshot_as_png()
+        selenium_ms = (time.perf_counter() - start) * 1000 / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            info, nodes, _ = fetch_observation_data(channel, screenshot=True)
+            fetch_page_accessibility_tree(info, driver, current_viewport_only=True, nodes=nodes)
+        websocket_ms = (time.perf_counter() - start) * 1000 / rounds
+        channel.close()
+    finally:
+        driver.quit()
+    return {"selenium_ms": round(selenium_ms, 1), "websocket_ms": round(websocket_ms, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DevTools websocket against Selenium")
+    parser.add_argument("url", type=str, help="Fixture page, e.g. file:///path/to/page.html")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--no_headless", action="store_true")
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(benchmark(cli_args.url, cli_args.rounds, headless=not cli_args.no_headless))
@@ -0,0 +1,273 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from google.genai import types
+
+# Rough token cost of one attached screenshot, used only to estimate the size of a request
+IMAGE_TOKEN_ESTIMATE = 258 * 4
+# Rough number of characters per text token
+CHARS_PER_TOKEN = 4
+
+
+class ConversationHistory:
+    """Conversation History - Gemini-native turn history that keeps only recent screenshots and observations"""
+
+    def __init__(self,
+                 max_images: int = 1,
+                 max_observations: Optional[int] = None,
+                 token_budget: Optional[int] = None,
+                 text_only: bool = False):
+        """
+        Initialize the conversation history
+
+        Args:
+            max_images (int): Number of most recent screenshots sent with a request.
+            max_observations (Optional[int]): Number of most recent observations (screenshot text, accessibility
+                tree) sent in full; older ones are collapsed into a short placeholder. Defaults to max_images.
+            token_budget (Optional[int]): Estimated prompt tokens a request may use. The oldest exchanges after
+                the first one are dropped until the request fits. None means no limit.
+            text_only (bool): Whether observations are accessibility trees rather than screenshots.
+        """
+        self.max_images = max(0, max_images)
+        self.max_observations = max(1, max_observations if max_observations is not None else max_images)
+        self.token_budget = token_budget
+        self.text_only = text_only
+        self.turns: List[Dict[str, Any]] = []
+        self.last_stats: Dict[str, Any] = {}
+
+    @staticmethod
+    def make_user_turn(parts: List[Dict[str, Any]],
+                       observation_start: Optional[int] = None,
+                       keyframe: bool = False) -> Dict[str, Any]:
+        """
+        Build a user turn
+
+        Args:
+            parts (List[Dict[str, Any]]): Gemini parts; the first one is the text part.
+            observation_start (Optional[int]): Index in the text where the page observation begins. Text before it
+                (task, manual) is kept when the observation is collapsed. None if the turn has no observation.
+            keyframe (bool): Whether the turn carries a full observation that later turns only describe as diffs.
+                The observations of the latest keyframe and of the turns after it are never collapsed.
+
+        Returns:
+            Dict[str, Any]: The user turn.
+        """
+        return {"role": "user", "parts": parts, "observation_start": observation_start, "keyframe": keyframe}
+
+    def append(self, turn: Dict[str, Any]) -> None:
+        """Add a turn that was sent to (user) or received from (model) Gemini"""
+        self.turns.append(turn)
+
+    def append_model_text(self, text: str) -> None:
+        """Add a model reply"""
+        self.turns.append({"role": "model", "parts": [{"text": text}]})
+
+    def contents(self, pending: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Build the `contents` of the next request: the history plus the pending user turn, with old screenshots
+        removed, old observations collapsed and the oldest exchanges dropped to respect the token budget.
+
+        Args:
+            pending (Optional[Dict[str, Any]]): User turn about to be sent.
+
+        Returns:
+            List[Dict[str, Any]]: Gemini contents.
+        """
+        turns = self.turns + ([pending] if pending is not None else [])
+        keyframes = [i for i, turn in enumerate(turns) if turn.get("keyframe")]
+        latest_keyframe = keyframes[-1] if keyframes else len(turns)
+
+        images_left = self.max_images
+        observations_left = self.max_observations
+        view = []
+        for index in reversed(range(len(turns))):
+            turn = turns[index]
+            if turn["role"] != "user":
+                view.append({"role": turn["role"], "parts": turn["parts"]})
+                continue
+
+            has_observation = turn.get("observation_start") is not None
+            keep_observation = not has_observation or observations_left > 0
+            # Diffs are only readable together with the keyframe they build on
+            keep_text = keep_observation or index >= latest_keyframe
+            if has_observation:
+                observations_left -= 1
+
+            parts = []
+            for part in turn["parts"]:
+                if "inline_data" in part:
+                    if keep_observation and images_left > 0:
+                        parts.append(part)
+                elif "text" in part and not keep_text and not parts:
+                    parts.append({"text": self._collapse(part["text"], turn["observation_start"])})
+                else:
+                    parts.append(part)
+            if any("inline_data" in part for part in parts):
+                images_left -= 1
+            view.append({"role": "user", "parts": parts})
+        view.reverse()
+
+        dropped = 0
+        if self.token_budget:
+            # Keep the first exchange (task and manual) and the newest turn; drop whole exchanges in between
+            while estimate_tokens(view) > self.token_budget and len(view) > 3:
+                del view[2:4]
+                dropped += 2
+
+        self.last_stats = {
+            "turns": len(view),
+            "dropped_turns": dropped,
+            "images": sum(1 for turn in view for part in turn["parts"] if "inline_data" in part),
+            "estimated_tokens": estimate_tokens(view),
+        }
+        return view
+
+    def _collapse(self, text: str, observation_start: int) -> str:
+        """Replace the observation part of a user message with a short placeholder"""
+        observation = text[observation_start:]
+        if self.text_only:
+            content = "An accessibility tree"
+        else:
+            content = "A screenshot"
+        if "You downloaded a PDF file" in observation:
+            content += ", a PDF file" if not self.text_only else " and a PDF file"
+        if not self.text_only:
+            content += " and some texts"
+        placeholder = f"Observation: {content}. (Omitted in context.)"
+        prefix = text[:observation_start].strip()
+        return f"{prefix}\n{placeholder}" if prefix else placeholder
+
+
+
+def estimate_tokens(contents: List[Dict[str, Any]]) -> int:
+    """
+    Roughly estimate the prompt tokens of Gemini contents
+
+    Args:
+        contents (List[Dict[str, Any]]): Gemini contents.
+
+    Returns:
+        int: Estimated number of tokens.
+    """
+    tokens = 0
+    for turn in contents:
+        for part in turn["parts"]:
+            if "text" in part:
+                tokens += len(part["text"]) // CHARS_PER_TOKEN
+            elif "inline_data" in part:
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+class GeminiSession:
+    """Gemini Session - one agent conversation that sends the system instruction through the request config
+    and makes exactly one model call per step"""
+
+    def __init__(self, client, model: str, system_instruction: str, history: ConversationHistory):
+        """
+        Initialize the session
+
+        Args:
+            client: google.genai client (anything exposing `models.generate_content`).
+            model (str): Gemini model name.
+            system_instruction (str): System prompt, sent separately from the conversation turns.
+            history (ConversationHistory): History used to build the contents of each call.
+        """
+        self.client = client
+        self.model = model
+        self.system_instruction = system_instruction
+        self.history = history
+        self.num_calls = 0
+        # Name of the cached-content prefix (system instruction + task prefix), if one was registered
+        self.cached_content: Optional[str] = None
+        self.usage = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+    def cache_prefix(self, prefix_text: str, ttl_seconds: int = 3600) -> bool:
+        """
+        Register the system instruction plus a static task prefix (task, manual, guidelines) as cached content,
+        so that later calls only send the per-step messages
+
+        Args:
+            prefix_text (str): Text that would otherwise be sent at the start of the conversation.
+            ttl_seconds (int): Lifetime of the cache; it is deleted by close() when the task ends.
+
+        Returns:
+            bool: Whether the cache was created. On failure (e.g. the prefix is below the model's minimum cache
+                size) the session keeps sending the system instruction and the caller must send the prefix itself.
+        """
+        try:
+            cache = self.client.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=self.system_instruction,
+                    contents=[{"role": "user", "parts": [{"text": prefix_text}]}],
+                    ttl=f"{ttl_seconds}s"
+                )
+            )
+        except Exception as e:
+            logging.warning(f"Context cache unavailable, sending the full prompt instead: {e}")
+            return False
+        self.cached_content = cache.name
+        cached_tokens = getattr(getattr(cache, "usage_metadata", None), "total_token_count", None)
+        logging.info(f"Cached the task prefix as {cache.name} ({cached_tokens} tokens)")
+        return True
+
+    def close(self) -> None:
+        """Delete the cached-content prefix, if any, and log the token usage of the session"""
+        if self.usage["prompt_tokens"]:
+            logging.info(
+                f"Session usage: {self.num_calls} calls, {self.usage['prompt_tokens']} prompt tokens "
+                f"({self.usage['cached_tokens']} served from the context cache), "
+                f"{self.usage['completion_tokens']} completion tokens"
+            )
+        if self.cached_content is None:
+            return
+        try:
+            self.client.caches.delete(name=self.cached_content)
+        except Exception as e:
+            logging.warning(f"Failed to delete context cache {self.cached_content}: {e}")
+        self.cached_content = None
+
+    def _config(self) -> types.GenerateContentConfig:
+        """Request config of every call"""
+        if self.cached_content is not None:
+            # The system instruction is part of the cached content and must not be sent again
+            return types.GenerateContentConfig(cached_content=self.cached_content)
+        return types.GenerateContentConfig(system_instruction=self.system_instruction)
+
+    def _record_usage(self, response) -> None:
+        """Accumulate the token counts reported by the API"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        self.usage["prompt_tokens"] += usage.prompt_token_count or 0
+        self.usage["cached_tokens"] += usage.cached_content_token_count or 0
+        self.usage["completion_tokens"] += usage.candidates_token_count or 0
+
+    def send(self, parts: List[Dict[str, Any]], observation_start: Optional[int] = None, keyframe: bool = False):
+        """
+        Send one user message and record the exchange
+
+        The message is only added to the history once the call succeeds, so a retried step is not duplicated.
+
+        Args:
+            parts (List[Dict[str, Any]]): Gemini parts of the user message.
+            observation_start (Optional[int]): Index of the page observation in the text part, see
+                ConversationHistory.make_user_turn.
+            keyframe (bool): Whether the message carries a full observation, see ConversationHistory.make_user_turn.
+
+        Returns:
+            The Gemini response.
+        """
+        turn = ConversationHistory.make_user_turn(parts, observation_start, keyframe)
+        contents = self.history.contents(pending=turn)
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=self._config()
+        )
+        self.num_calls += 1
+        self._record_usage(response)
+        self.history.append(turn)
+        self.history.append_model_text(response.text)
+        return response
@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from google import genai
+from google.genai import types
+
+TRANSPORT_MODES = ('live', 'record', 'replay', 'stub')
+
+# Reply of the stub server: ends the task on the first step
+DEFAULT_STUB_REPLY = "Thought: This is a stub reply.\nAction: ANSWER; stub"
+
+# Parts of a prompt that change from run to run without changing the request
+VOLATILE_PATTERNS = [
+    (re.compile(r"Today is \d{4}-\d{2}-\d{2}"), "Today is <date>"),
+]
+
+# Inline base64 screenshots and PDFs are longer than this
+_BINARY_STRING_LENGTH = 4096
+
+
+def _canonical(value: Any) -> Any:
+    """JSON-serializable form of a request, without its volatile parts: binary data (screenshots differ by a few
+    pixels between runs) is reduced to a placeholder and dates are masked"""
+    if isinstance(value, (bytes, bytearray)):
+        return "<binary>"
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if hasattr(value, "model_dump"):
+        return _canonical(value.model_dump(exclude_none=True))
+    if isinstance(value, str):
+        if len(value) > _BINARY_STRING_LENGTH and " " not in value:
+            return "<binary>"
+        for pattern, replacement in VOLATILE_PATTERNS:
+            value = pattern.sub(replacement, value)
+    return value
+
+
+def request_key(model: str, contents: Any, config: Any = None) -> str:
+    """
+    Hash of a generate_content request, stable across runs of the same task
+
+    Args:
+        model (str): Model name.
+        contents (Any): Request contents.
+        config (Any): Request config.
+
+    Returns:
+        str: Hex digest identifying the request in a cassette. Images and dates do not take part in it; identical
+            keys replay their recordings in order.
+    """
+    payload = json.dumps({"model": model, "contents": _canonical(contents), "config": _canonical(config)},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_response(text: str, usage: Optional[Dict[str, int]] = None) -> types.GenerateContentResponse:
+    """Build a GenerateContentResponse carrying a text reply and optional token counts"""
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(**usage) if usage else None
+    )
+
+
+def _usage_dict(response) -> Optional[Dict[str, int]]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {name: getattr(usage, name) for name in
+            ("prompt_token_count", "cached_content_token_count", "candidates_token_count")
+            if getattr(usage, name, None) is not None}
+
+
+class CassetteMiss(Exception):
+    """Raised in replay when a request was not recorded"""
+
+
+class _UnavailableCaches:
+    """Context caching is not recorded; sessions fall back to sending the full prompt"""
+
+    def create(self, **kwargs):
+        raise RuntimeError("Context caching is not available with a replayed or stub transport")
+
+    def delete(self, **kwargs):
+        pass
+
+
+class _Models:
+    """`client.models` of a transport; delegates generate_content to the owning client"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model: str, contents: Any, config: Any = None):
+        start = time.perf_counter()
+        try:
+            return self._client._generate(model, contents, config)
+        finally:
+            self._client.stats["calls"] += 1
+            self._client.stats["seconds"] += time.perf_counter() - start
+
+
+class RecordingClient:
+    """Recording Client - forwards calls to a live client and appends every response to a JSONL cassette"""
+
+    def __init__(self, client, cassette_path: str):
+        """
+        Initialize the recording client
+
+        Args:
+            client: Live google.genai client.
+            cassette_path (str): JSONL file the responses are appended to. Several processes may append to it.
+        """
+        self.client = client
+        self.cassette_path = cassette_path
+        self.models = _Models(self)
+        self.caches = client.caches
+        self.stats = {"calls": 0, "seconds": 0.0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(cassette_path)), exist_ok=True)
+
+    def _generate(self, model, contents, config):
+        response = self.client.models.generate_content(model=model, contents=contents, config=config)
+        record = {"key": request_key(model, contents, config), "model": model,
+                  "text": response.text, "usage": _usage_dict(response)}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.cassette_path, "a", encoding="utf-8") as f:
+            f.write(line)
+        return response
+
+
+class ReplayClient:
+    """Replay Client - answers calls from a recorded JSONL cassette without network access"""
+
+    def __init__(self, cassette_path: str, strict: bool = True):
+        """
+        Initialize the replay client
+
+        Args:
+            cassette_path (str): JSONL cassette written by RecordingClient.
+            strict (bool): Raise CassetteMiss for a request that was not recorded. Otherwise the next unused
+                recording of the same model is returned with a warning, which keeps a replay going when a live
+                page renders slightly differently from the recorded run, at the cost of matching by call order.
+        """
+        self.cassette_path = cassette_path
+        self.strict = strict
+        self.models = _Models(self)
+        self.caches = _UnavailableCaches()
+        self.stats = {"calls": 0, "seconds": 0.0, "hits": 0, "misses": 0, "fallbacks": 0}
+        self._lock = threading.Lock()
+        self._records: List[Dict[str, Any]] = []
+        self._by_key: Dict[str, List[int]] = {}
+        self._used = set()
+        with open(cassette_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._by_key.setdefault(record["key"], []).append(len(self._records))
+                    self._records.append(record)
+
+    def _generate(self, model, contents, config):
+        key = request_key(model, contents, config)
+        with self._lock:
+            record = self._take(key, model)
+        if record is None:
+            raise CassetteMiss(f"No recorded response for request {key[:12]} ({model})")
+        return make_response(record["text"], record.get("usage"))
+
+    def _take(self, key: str, model: str) -> Optional[Dict[str, Any]]:
+        """Next recording of a request; identical requests replay their recordings in order"""
+        indices = self._by_key.get(key, [])
+        for index in indices:
+            if index not in self._used:
+                self._used.add(index)
+                self.stats["hits"] += 1
+                return self._records[index]
+        if indices:
+            # Replayed more often than recorded: repeat the last recording
+            self.stats["hits"] += 1
+            logging.warning(f"Request {key[:12]} was recorded {len(indices)} times, repeating its last recording")
+            return self._records[indices[-1]]
+        self.stats["misses"] += 1
+        if self.strict:
+            return None
+        for index, record in enumerate(self._records):
+            if index not in self._used and record["model"] == model:
+                self._used.add(index)
+                self.stats["fallbacks"] += 1
+                logging.warning(f"Request {key[:12]} was not recorded, replaying recording {index} instead")
+                return record
+        logging.warning(f"Request {key[:12]} was not recorded and no recording of {model} is left")
+        return None
+
+
+class StubClient:
+    """Stub Client - sends every call to a local stub server (see serve_stub)"""
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        """
+        Initialize the stub client
+
+        Args:
+            url (str): Address of the stub server, e.g. http://127.0.0.1:8765.
+            timeout (float): Timeout of one call in seconds.
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.models = _Models(self)
+        self.caches = _UnavailableCaches()
+        self.stats = {"calls": 0, "seconds": 0.0}
+
+    def _generate(self, model, contents, config):
+        body = json.dumps({"model": model, "key": request_key(model, contents, config),
+                           "contents": _canonical(contents)}, default=str).encode("utf-8")
+        request = urllib.request.Request(f"{self.url}/generate", data=body,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as reply:
+            payload = json.loads(reply.read().decode("utf-8"))
+        return make_response(payload["text"], payload.get("usage"))
+
+
+def create_client(api_key: str, mode: str = 'live', cassette_path: Optional[str] = None,
+                  stub_url: Optional[str] = None, strict: bool = True):
+    """
+    Create the Gemini client for a transport mode
+
+    Args:
+        api_key (str): Gemini API key, used by the live and record modes.
+        mode (str): One of 'live', 'record', 'replay' or 'stub'.
+        cassette_path (Optional[str]): JSONL cassette of the record and replay modes.
+        stub_url (Optional[str]): Stub server address of the stub mode.
+        strict (bool): Fail on unrecorded requests in replay, see ReplayClient.
+
+    Returns:
+        A client exposing `models.generate_content` and `caches`.
+    """
+    if mode == 'live':
+        return genai.Client(api_key=api_key)
+    if mode == 'record':
+        return RecordingClient(genai.Client(api_key=api_key), cassette_path)
+    if mode == 'replay':
+        return ReplayClient(cassette_path, strict=strict)
+    if mode == 'stub':
+        return StubClient(stub_url)
+    raise ValueError(f"Unknown LLM transport mode: {mode}")
+
+
+def make_stub_server(port: int = 8765, reply: str = DEFAULT_STUB_REPLY,
+                     cassette_path: Optional[str] = None) -> ThreadingHTTPServer:
+    """
+    Create a local stub server answering every request with a fixed reply, or with the recording of the request
+    when a cassette is given
+
+    Args:
+        port (int): Port to listen on (127.0.0.1), 0 for any free port.
+        reply (str): Reply to unrecorded requests.
+        cassette_path (Optional[str]): Optional JSONL cassette written by RecordingClient.
+
+    Returns:
+        ThreadingHTTPServer: The server, not yet serving.
+    """
+    recorded = {}
+    if cassette_path:
+        with open(cassette_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    recorded.setdefault(record["key"], record)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            record = recorded.get(request.get("key"))
+            payload = {"text": record["text"], "usage": record.get("usage")} if record else {"text": reply}
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+
+def serve_stub(port: int = 8765, reply: str = DEFAULT_STUB_REPLY, cassette_path: Optional[str] = None):
+    """Run the stub server of make_stub_server until interrupted"""
+    server = make_stub_server(port, reply, cassette_path)
+    logging.info(f"Stub LLM server listening on 127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub server for --llm_transport stub")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reply", type=str, default=DEFAULT_STUB_REPLY)
+    parser.add_argument("--cassette", type=str, default=None)
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve_stub(cli_args.port, cli_args.reply, cli_args.cassette)
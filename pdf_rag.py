@@ -1,6 +1,13 @@
 import os
 import re
+import json
+import time
 import base64
+import queue
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Optional, Tuple, Any, Protocol
 import pymupdf4llm
 import pdfplumber
@@ -160,13 +167,58 @@ class DocumentConverter:
         return result
 
 
+class ImageDescriptionCache:
+    """Image Description Cache - Persists image descriptions keyed by image content hash and description model"""
+
+    def __init__(self, cache_path: str):
+        """
+        Initialize the image description cache
+
+        Args:
+            cache_path (str): Path to the JSON cache file. It is created on the first save.
+        """
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self.entries: Dict[str, str] = {}
+        if os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(image_bytes: bytes, model: str) -> str:
+        """Cache key of an image described by a model"""
+        return f"{model}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached description for a key, or None"""
+        with self._lock:
+            return self.entries.get(key)
+
+    def put(self, key: str, description: str) -> None:
+        """Store a description in memory; call save() to persist it"""
+        with self._lock:
+            self.entries[key] = description
+
+    def save(self) -> None:
+        """Write the cache atomically"""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+
+
 class ImageProcessor:
     """Image Processor - Handles image extraction, description, and other operations"""
 
     def __init__(self,
                  gemini_client: genai,
                  logger: logging.Logger,
-                 description_model: str = "gemini-2.5-pro-preview-03-25"):
+                 description_model: str = "gemini-2.5-pro-preview-03-25",
+                 max_concurrency: int = 4,
+                 max_retries: int = 5,
+                 cache_path: Optional[str] = None):
         """
         Initialize the image processor
 
@@ -174,15 +226,32 @@ class ImageProcessor:
             gemini_client: Google Gemini client
             logger: Logging object
             description_model: Model used for image description
+            max_concurrency: Maximum number of description requests in flight at once
+            max_retries: Retries of a description request that hit a rate limit or a server error
+            cache_path: Path to the description cache. Defaults to a cache file in each output directory.
         """
         self.client = gemini_client
         self.description_model = description_model
         self.logger = logger
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.cache_path = cache_path
+        self._caches: Dict[str, ImageDescriptionCache] = {}
+
+    def _get_cache(self, output_dir: str) -> ImageDescriptionCache:
+        """Description cache used for images of output_dir"""
+        cache_path = self.cache_path or os.path.join(output_dir, "image_descriptions_cache.json")
+        if cache_path not in self._caches:
+            self._caches[cache_path] = ImageDescriptionCache(cache_path)
+        return self._caches[cache_path]
 
     def get_image_descriptions(self, output_dir: str, image_paths: List[str]) -> Dict[str, str]:
         """
         Get descriptions for multiple images
 
+        Identical images (e.g. a logo repeated on every page) are described once, images described
+        before are taken from the cache, and the remaining requests run concurrently.
+
         Args:
             output_dir: Directory to save output files. Defaults to "output".
             image_paths: List of image paths
@@ -190,14 +259,47 @@ class ImageProcessor:
         Returns:
             Dict[str, str]: Mapping from image paths to their descriptions
         """
+        cache = self._get_cache(output_dir)
         descriptions = {}
+        pending: Dict[str, List[str]] = {}  # cache key -> image paths with that content
+        pending_files: Dict[str, str] = {}  # cache key -> one file with that content
         for img_path in image_paths:
+            full_path = os.path.join(output_dir, img_path)
             try:
-                description = self.describe_image(os.path.join(output_dir, img_path))
-                descriptions[img_path] = description
+                with open(full_path, "rb") as image_file:
+                    key = ImageDescriptionCache.key(image_file.read(), self.description_model)
             except Exception as e:
                 self.logger.error(f"Error processing image {img_path}: {e}")
                 descriptions[img_path] = "Unable to describe image"
+                continue
+
+            cached = cache.get(key)
+            if cached is not None:
+                descriptions[img_path] = cached
+            else:
+                pending.setdefault(key, []).append(img_path)
+                pending_files.setdefault(key, full_path)
+
+        self.logger.info(
+            f"{len(image_paths) - sum(len(paths) for paths in pending.values())} image descriptions from cache, "
+            f"{len(pending)} distinct images to describe"
+        )
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor:
+            futures = {executor.submit(self._describe_with_retry, pending_files[key]): key for key in pending}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    description = future.result()
+                    cache.put(key, description)
+                except Exception as e:
+                    self.logger.error(f"Error processing image {pending[key][0]}: {e}")
+                    description = "Unable to describe image"
+                for img_path in pending[key]:
+                    descriptions[img_path] = description
+
+        if pending:
+            cache.save()
         return descriptions
 
     def describe_image(self, image_path: str) -> str:
@@ -211,25 +313,60 @@ class ImageProcessor:
             str: A brief image description generated by the Gemini model.
         """
         try:
-            with open(image_path, "rb") as image_file:
-                image_bytes = image_file.read()
-                
-            # Use the correct API structure for the installed version
-            response = self.client.models.generate_content(
-                model=self.description_model,
-                contents=[
-                    {"role": "user", "parts": [
-                        {"text": "Briefly describe this image:"},
-                        {"inline_data": {"mime_type": f"image/{self._get_image_type(image_path)}", "data": image_bytes}}
-                    ]}
-                ]
-            )
-            
-            return response.text
+            return self._request_description(image_path)
         except Exception as e:
             self.logger.error(f"Error describing image with Gemini: {e}")
             return f"Unable to describe image: {str(e)}"
 
+    def _describe_with_retry(self, image_path: str) -> str:
+        """
+        Describe an image, backing off exponentially on rate limits and transient server errors
+
+        Args:
+            image_path (str): Absolute path to the image file.
+
+        Returns:
+            str: The image description.
+
+        Raises:
+            Exception: The last error, once retries are exhausted or the error is not retryable.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._request_description(image_path)
+            except Exception as e:
+                if attempt == self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                self.logger.warning(f"Describing {image_path} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """Whether a Gemini error is a rate limit or a transient server error"""
+        if getattr(error, "code", None) in (429, 500, 502, 503, 504):
+            return True
+        message = str(error).lower()
+        return any(term in message for term in ("rate limit", "resource_exhausted", "resource exhausted", "unavailable"))
+
+    def _request_description(self, image_path: str) -> str:
+        """Send one description request for an image; errors are raised to the caller"""
+        with open(image_path, "rb") as image_file:
+            image_bytes = image_file.read()
+            
+        # Use the correct API structure for the installed version
+        response = self.client.models.generate_content(
+            model=self.description_model,
+            contents=[
+                {"role": "user", "parts": [
+                    {"text": "Briefly describe this image:"},
+                    {"inline_data": {"mime_type": f"image/{self._get_image_type(image_path)}", "data": image_bytes}}
+                ]}
+            ]
+        )
+        
+        return response.text
+
     def _get_image_type(self, image_path: str) -> str:
         """
         Get image type based on file extension
@@ -673,10 +810,13 @@ class RAGEngine:
         }
 
 
+DEFAULT_EMBEDDING_MODEL = "BAAI/bge-m3"
+
+
 def get_embeddings(**kwargs):
     """Get embeddings with default settings"""
     default_kwargs = {
-        "model_name": "BAAI/bge-m3",
+        "model_name": DEFAULT_EMBEDDING_MODEL,
         "model_kwargs": {"device": "cpu"},
         "encode_kwargs": {"normalize_embeddings": True}
     }
@@ -720,6 +860,386 @@ def get_vectorstore(embeddings, persist_directory):
         )
 
 
+class EmbeddingStage:
+    """Embedding Stage - Encodes texts in length-sorted batches with a bounded number of CPU threads"""
+
+    def __init__(self,
+                 logger: logging.Logger,
+                 batch_size: int = 32,
+                 num_threads: Optional[int] = None):
+        """
+        Initialize the embedding stage
+
+        Args:
+            logger (logging.Logger): Logging object
+            batch_size (int, optional): Number of texts encoded per forward pass. Defaults to 32.
+            num_threads (Optional[int]): Torch intra-op threads used for encoding. Defaults to torch's own choice.
+        """
+        self.logger = logger
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.total_chunks = 0
+        self.total_seconds = 0.0
+
+    def embed_batches(self, embeddings: EmbeddingModel, texts: List[str]):
+        """
+        Encode texts batch by batch. Texts are sorted by length first, so each batch holds texts of
+        similar length and little time is spent on padding. The thread count and batch size apply only
+        while the generator runs; the model is shared with searches, so both are restored afterwards.
+
+        Args:
+            embeddings (EmbeddingModel): Embedding model to encode with.
+            texts (List[str]): Texts to encode.
+
+        Yields:
+            Tuple[List[int], List[List[float]]]: Indices into texts and their vectors, one batch at a time.
+        """
+        torch = None
+        previous_threads = None
+        if self.num_threads:
+            try:
+                import torch
+                previous_threads = torch.get_num_threads()
+                torch.set_num_threads(self.num_threads)
+            except ImportError:
+                self.logger.warning("torch is not installed, ignoring the embedding thread count")
+
+        # Encode exactly the batches built here instead of letting the model re-split them
+        encode_kwargs = getattr(embeddings, "encode_kwargs", None)
+        if not isinstance(encode_kwargs, dict):
+            encode_kwargs = None
+        missing = object()
+        previous_batch_size = missing
+        if encode_kwargs is not None:
+            previous_batch_size = encode_kwargs.get("batch_size", missing)
+            encode_kwargs["batch_size"] = self.batch_size
+
+        try:
+            order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+            for start in range(0, len(order), self.batch_size):
+                indices = order[start:start + self.batch_size]
+                started = time.perf_counter()
+                vectors = embeddings.embed_documents([texts[i] for i in indices])
+                self.total_seconds += time.perf_counter() - started
+                self.total_chunks += len(indices)
+                yield indices, vectors
+        finally:
+            if previous_threads is not None:
+                torch.set_num_threads(previous_threads)
+            if encode_kwargs is not None:
+                if previous_batch_size is missing:
+                    encode_kwargs.pop("batch_size", None)
+                else:
+                    encode_kwargs["batch_size"] = previous_batch_size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get throughput statistics
+
+        Returns:
+            Dict[str, Any]: Chunks encoded so far, seconds spent encoding and chunks per second.
+        """
+        return {
+            "chunks": self.total_chunks,
+            "seconds": round(self.total_seconds, 2),
+            "chunks_per_sec": round(self.total_chunks / self.total_seconds, 2) if self.total_seconds else None,
+            "batch_size": self.batch_size,
+            "num_threads": self.num_threads
+        }
+
+
+class IndexManifest:
+    """Index Manifest - Records which documents are in the vector store, keyed by content hash and indexing settings"""
+
+    def __init__(self, manifest_path: str):
+        """
+        Initialize the index manifest
+
+        Args:
+            manifest_path (str): Path to the JSON manifest file. It is created on the first update.
+        """
+        self.manifest_path = manifest_path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.reload()
+
+    def reload(self) -> None:
+        """Re-read the manifest file, picking up documents recorded by other pipelines"""
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("documents", {})
+
+    def get(self, doc_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the manifest entry of a document
+
+        Args:
+            doc_key (str): Absolute path of the document.
+
+        Returns:
+            Optional[Dict[str, Any]]: The entry, or None if the document was never indexed.
+        """
+        return self.entries.get(doc_key)
+
+    def update(self, doc_key: str, entry: Dict[str, Any]) -> None:
+        """
+        Record a document as indexed and write the manifest
+
+        Args:
+            doc_key (str): Absolute path of the document.
+            entry (Dict[str, Any]): Content hash, settings key, chunk IDs and outputs of the document.
+        """
+        stat = os.stat(doc_key)
+        entry = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        self.entries[doc_key] = entry
+
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "documents": self.entries}, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def content_hash(self, path: str) -> str:
+        """
+        SHA-256 of a file's content. Files whose size and mtime match the manifest are not re-read.
+
+        Args:
+            path (str): Path to the file.
+
+        Returns:
+            str: Hex digest of the file content.
+        """
+        stat = os.stat(path)
+        entry = self.entries.get(os.path.abspath(path))
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return entry["content_hash"]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+def chunk_ids_for(doc_key: str, settings_key: str, chunks: List[Document]) -> List[str]:
+    """
+    Stable IDs for a document's chunks: the same chunk text and metadata always get the same ID
+
+    Args:
+        doc_key (str): Manifest key of the document.
+        settings_key (str): Hash of the indexing settings.
+        chunks (List[Document]): Chunks of the document.
+
+    Returns:
+        List[str]: One ID per chunk. Identical chunks are told apart by their occurrence count.
+    """
+    ids = []
+    seen: Dict[str, int] = {}
+    for chunk in chunks:
+        payload = json.dumps(
+            [doc_key, settings_key, chunk.metadata, chunk.page_content],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        base_id = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+        occurrence = seen.get(base_id, 0)
+        seen[base_id] = occurrence + 1
+        ids.append(base_id if occurrence == 0 else f"{base_id}-{occurrence}")
+    return ids
+
+
+def _model_memory_bytes(embeddings) -> Optional[int]:
+    """Size in bytes of the parameters of a HuggingFace embedding model, or None if unknown"""
+    model = getattr(embeddings, "_client", None) or getattr(embeddings, "client", None)
+    if model is None or not hasattr(model, "parameters"):
+        return None
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+class RetrievalService:
+    """Retrieval Service - Holds the embedding model, vector store and Gemini client shared by a whole run"""
+
+    def __init__(self,
+                 gemini_api_key: str,
+                 logger: logging.Logger,
+                 persist_directory: str = "./chroma_db",
+                 embedding_kwargs: Optional[Dict[str, Any]] = None,
+                 gemini_client=None,
+                 embeddings_service: Optional["RetrievalService"] = None):
+        """
+        Initialize the retrieval service. Nothing is loaded until it is first used.
+
+        Args:
+            gemini_api_key (str): Google Gemini API key
+            logger (logging.Logger): Logging object
+            persist_directory (str, optional): Path to directory for storing or retrieving vector database. Defaults to "./chroma_db".
+            embedding_kwargs (Optional[Dict[str, Any]]): Overrides passed to get_embeddings().
+            gemini_client (optional): Client to use instead of a live genai.Client, e.g. a recording or replaying
+                transport from llm_transport.
+            embeddings_service (Optional[RetrievalService]): Service whose embedding model is reused instead of
+                loading another copy, for a second vector store.
+        """
+        self.gemini_api_key = gemini_api_key
+        self.logger = logger
+        self.persist_directory = persist_directory
+        self.embedding_kwargs = embedding_kwargs or {}
+
+        self._lock = threading.RLock()
+        # Serializes writes to the vector store and the index manifest; searches never wait on it
+        self.index_lock = threading.Lock()
+        self._embeddings = None
+        self._vectordb = None
+        self._gemini_client = gemini_client
+        self._embeddings_service = embeddings_service
+        self.load_stats: Dict[str, Any] = {}
+
+    @property
+    def embedding_model_name(self) -> str:
+        """Name of the embedding model, known without loading it"""
+        if self._embeddings_service is not None:
+            return self._embeddings_service.embedding_model_name
+        return self.embedding_kwargs.get("model_name", DEFAULT_EMBEDDING_MODEL)
+
+    @property
+    def embeddings(self):
+        """Embedding model, loaded on first access"""
+        with self._lock:
+            if self._embeddings is None and self._embeddings_service is not None:
+                self._embeddings = self._embeddings_service.embeddings
+            if self._embeddings is None:
+                start = time.perf_counter()
+                self._embeddings = get_embeddings(**self.embedding_kwargs)
+                self.load_stats["embedding_load_seconds"] = round(time.perf_counter() - start, 2)
+                self.load_stats["embedding_model_bytes"] = _model_memory_bytes(self._embeddings)
+                model_bytes = self.load_stats["embedding_model_bytes"]
+                self.logger.info(
+                    f"Loaded embedding model {self._embeddings.model_name} in "
+                    f"{self.load_stats['embedding_load_seconds']}s"
+                    + (f" ({model_bytes / 1024 ** 3:.2f} GB)" if model_bytes else "")
+                )
+            return self._embeddings
+
+    @property
+    def vectordb(self) -> Chroma:
+        """Vector store, opened on first access"""
+        with self._lock:
+            if self._vectordb is None:
+                embeddings = self.embeddings
+                start = time.perf_counter()
+                self._vectordb = get_vectorstore(embeddings, self.persist_directory)
+                self.load_stats["vectorstore_load_seconds"] = round(time.perf_counter() - start, 2)
+                self.logger.info(
+                    f"Opened vector store at {self.persist_directory} in {self.load_stats['vectorstore_load_seconds']}s"
+                )
+            return self._vectordb
+
+    @property
+    def gemini_client(self) -> genai.Client:
+        """Gemini client, created on first access"""
+        with self._lock:
+            if self._gemini_client is None:
+                self._gemini_client = genai.Client(api_key=self.gemini_api_key)
+            return self._gemini_client
+
+    def search(self, query: str, k: int = 3, filter_dict: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Search the RAG database
+
+        Args:
+            query (str): Search query
+            k (int): Number of results to return
+            filter_dict (Optional[Dict[str, Any]]): Optional filters on metadata.
+
+        Returns:
+            List[Dict[str, Any]]: Search results
+        """
+        try:
+            results = self.vectordb.similarity_search(query, k=k, filter=filter_dict)
+            
+            # Format the results to ensure consistency
+            formatted_results = []
+            for doc in results:
+                formatted_results.append({
+                    "content": doc.page_content,
+                    "source": doc.metadata.get("source", "Unknown"),
+                    "page": doc.metadata.get("page", "N/A"),
+                    "section": doc.metadata.get("section", "N/A")
+                })
+            
+            # If no results found, return a default entry
+            if not formatted_results:
+                formatted_results = [{
+                    "content": "No content found matching the query.",
+                    "source": "None",
+                    "page": "N/A",
+                    "section": "N/A"
+                }]
+                
+            return formatted_results
+        except Exception as e:
+            self.logger.error(f"Error during search: {str(e)}")
+            # Return a default result in case of error
+            return [{
+                "content": f"Error searching content: {str(e)}",
+                "source": "Error",
+                "page": "N/A",
+                "section": "N/A"
+            }]
+
+    def index_pdf(self, pdf_path: str, output_dir: str = "output") -> Dict[str, Any]:
+        """
+        Index a single PDF into this service's vector store, e.g. a file downloaded during a task
+
+        Image descriptions are skipped to keep this fast. An unchanged PDF is not re-embedded. Conversion
+        runs without any lock; only the index writes are serialized, and searches keep running meanwhile.
+
+        Args:
+            pdf_path (str): Path to the PDF file.
+            output_dir (str, optional): Directory for the converted Markdown. Defaults to "output".
+
+        Returns:
+            Dict[str, Any]: The PDFEnhancementPipeline.process_pdf() result.
+        """
+        pipeline = PDFEnhancementPipeline(
+            gemini_api_key=self.gemini_api_key,
+            logger=self.logger,
+            persist_directory=self.persist_directory,
+            retrieval_service=self
+        )
+        return pipeline.process_pdf(pdf_path, output_dir=output_dir, add_image_descriptions=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get load statistics
+
+        Returns:
+            Dict[str, Any]: Load times in seconds and the embedding model size in bytes, for whatever has been loaded so far.
+        """
+        return dict(self.load_stats, persist_directory=self.persist_directory)
+
+
+_retrieval_services: Dict[str, RetrievalService] = {}
+_retrieval_services_lock = threading.Lock()
+
+
+def get_retrieval_service(gemini_api_key: str,
+                          logger: logging.Logger,
+                          persist_directory: str = "./chroma_db",
+                          gemini_client=None,
+                          embeddings_service: Optional[RetrievalService] = None) -> RetrievalService:
+    """Get the process-wide retrieval service for a persist directory, creating it on first use; pass
+    embeddings_service to share its embedding model"""
+    with _retrieval_services_lock:
+        key = os.path.abspath(persist_directory)
+        if key not in _retrieval_services:
+            _retrieval_services[key] = RetrievalService(
+                gemini_api_key=gemini_api_key,
+                logger=logger,
+                persist_directory=persist_directory,
+                gemini_client=gemini_client,
+                embeddings_service=embeddings_service
+            )
+        return _retrieval_services[key]
+
+
 class PDFEnhancementPipeline:
     """PDF Enhancement Pipeline - Combines various functional modules with a simple interface"""
 
@@ -727,7 +1247,12 @@ class PDFEnhancementPipeline:
                  gemini_api_key: str,
                  logger: logging.Logger,
                  persist_directory: str = "./chroma_db",
-                 image_description_model: str = "gemini-2.5-pro-preview-03-25"):
+                 image_description_model: str = "gemini-2.5-pro-preview-03-25",
+                 retrieval_service: Optional[RetrievalService] = None,
+                 chunk_size: int = 1000,
+                 chunk_overlap: int = 200,
+                 embedding_batch_size: int = 32,
+                 embedding_threads: Optional[int] = None):
         """
         Initialize the PDF enhancement pipeline
 
@@ -736,12 +1261,30 @@ class PDFEnhancementPipeline:
             logger (logging.Logger): Logging object
             persist_directory (str, optional): Path to directory for storing or retrieving vector database. Defaults to "./chroma_db".
             image_description_model (str, optional): Name of the Gemini model used for image description. Defaults to "gemini-2.5-pro-preview-03-25".
+            retrieval_service (Optional[RetrievalService]): Shared retrieval service. Defaults to the process-wide one for persist_directory.
+            chunk_size (int, optional): Maximum size of each indexed chunk. Defaults to 1000.
+            chunk_overlap (int, optional): Overlap between indexed chunks. Defaults to 200.
+            embedding_batch_size (int, optional): Number of chunks encoded per batch when indexing. Defaults to 32.
+            embedding_threads (Optional[int]): Torch intra-op threads used when indexing. Defaults to torch's own choice.
         """
         self.logger = logger
         self.persist_directory = persist_directory
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.manifest = IndexManifest(os.path.join(persist_directory, "index_manifest.json"))
+        self.embedding_stage = EmbeddingStage(
+            logger=logger,
+            batch_size=embedding_batch_size,
+            num_threads=embedding_threads
+        )
+        self.retrieval = retrieval_service or get_retrieval_service(
+            gemini_api_key=gemini_api_key,
+            logger=logger,
+            persist_directory=persist_directory
+        )
 
         # Initialize Gemini client
-        self.gemini_client = genai.Client(api_key=gemini_api_key)
+        self.gemini_client = self.retrieval.gemini_client
 
         # Initialize components
         self.doc_converter = DocumentConverter()
@@ -751,9 +1294,15 @@ class PDFEnhancementPipeline:
             description_model=image_description_model
         )
 
-        # Initialize embeddings and vectorstore
-        self.embeddings = get_embeddings()
-        self.vectordb = get_vectorstore(self.embeddings, persist_directory)
+    @property
+    def embeddings(self):
+        """Embedding model of the shared retrieval service"""
+        return self.retrieval.embeddings
+
+    @property
+    def vectordb(self) -> Chroma:
+        """Vector store of the shared retrieval service"""
+        return self.retrieval.vectordb
 
     def process_pdf(
             self,
@@ -771,6 +1320,9 @@ class PDFEnhancementPipeline:
         2. Optionally adds image descriptions to the Markdown.
         3. Optionally indexes the document for RAG (Retrieval-Augmented Generation).
 
+        A PDF whose content hash, chunker settings and embedding model match the index manifest
+        is skipped entirely; a changed PDF only has its new or modified chunks re-embedded.
+
         Args:
             pdf_path (str): Path to the PDF file.
             output_dir (str, optional): Directory to save output files. Defaults to "output".
@@ -787,6 +1339,108 @@ class PDFEnhancementPipeline:
                 - "enhanced_markdown_path" (Optional[str]): Path to enhanced Markdown file, if generated.
                 - "rag_stats" (Optional[Dict[str, Any]]): RAG index statistics, if indexing was performed.
         """
+        result, job = self._prepare_pdf(
+            pdf_path, output_dir, add_image_descriptions, index_for_rag, overwrite_enhanced_md
+        )
+        if job is not None:
+            self._commit_index_job(result, job)
+            self.logger.info(f"Embedding throughput: {self.embedding_stage.get_stats()}")
+
+        # Return the result dictionary with all generated information
+        return result
+
+    def process_pdfs(
+            self,
+            pdf_paths: List[str],
+            output_dir: str = "output",
+            add_image_descriptions: bool = True,
+            index_for_rag: bool = True,
+            overwrite_enhanced_md: bool = False,
+            prefetch: int = 2
+    ) -> List[Dict[str, Any]]:
+        """
+        Process many PDFs, streaming them from an extraction thread to the embedding stage.
+
+        While the chunks of one PDF are being encoded, the next PDFs are already being converted,
+        extracted and split, up to `prefetch` documents ahead.
+
+        Args:
+            pdf_paths (List[str]): Paths to the PDF files.
+            output_dir (str, optional): Directory to save output files. Defaults to "output".
+            add_image_descriptions (bool, optional): Whether to add descriptions to images. Defaults to True.
+            index_for_rag (bool, optional): Whether to index the documents for RAG. Defaults to True.
+            overwrite_enhanced_md (bool, optional): Whether to overwrite existing enhanced Markdown files. Defaults to False.
+            prefetch (int, optional): Number of prepared documents that may wait for the embedding stage. Defaults to 2.
+
+        Returns:
+            List[Dict[str, Any]]: One process_pdf() result per PDF, in input order.
+        """
+        prepared = queue.Queue(maxsize=max(1, prefetch))
+
+        def produce():
+            for pdf_path in pdf_paths:
+                try:
+                    prepared.put(self._prepare_pdf(
+                        pdf_path, output_dir, add_image_descriptions, index_for_rag, overwrite_enhanced_md
+                    ))
+                except Exception as e:
+                    self.logger.error(f"Error processing {pdf_path}: {str(e)}")
+                    prepared.put(({"original_pdf": pdf_path, "output_directory": output_dir, "error": str(e)}, None))
+            prepared.put(None)
+
+        producer = threading.Thread(target=produce, name="pdf-extraction", daemon=True)
+        producer.start()
+
+        results = []
+        while True:
+            item = prepared.get()
+            if item is None:
+                break
+            result, job = item
+            if job is not None:
+                self._commit_index_job(result, job)
+            results.append(result)
+        producer.join()
+
+        self.logger.info(f"Processed {len(results)} PDFs. Embedding throughput: {self.embedding_stage.get_stats()}")
+        return results
+
+    def _prepare_pdf(
+            self,
+            pdf_path: str,
+            output_dir: str,
+            add_image_descriptions: bool,
+            index_for_rag: bool,
+            overwrite_enhanced_md: bool
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Convert, describe, extract and chunk a PDF; everything in process_pdf() except embedding
+
+        Returns:
+            Tuple[Dict[str, Any], Optional[Dict[str, Any]]]: The process_pdf() result so far, and the
+                index job for _commit_index_job(), or None if there is nothing to index.
+        """
+        doc_key = os.path.abspath(pdf_path)
+        content_hash = self.manifest.content_hash(pdf_path)
+        settings_key = self._index_settings_key()
+        entry = self.manifest.get(doc_key)
+
+        # Nothing to do if the PDF and the indexing settings are unchanged and the outputs still exist
+        if (entry and entry["content_hash"] == content_hash and entry["settings_key"] == settings_key
+                and entry["output_directory"] == output_dir and not overwrite_enhanced_md
+                and all(os.path.exists(path) for path in entry["outputs"])):
+            if (not add_image_descriptions or entry["result"].get("enhanced_markdown_path")
+                    or not entry["result"]["image_count"]):
+                self.logger.info(f"{pdf_path} is unchanged since it was last indexed, skipping.")
+                result = dict(entry["result"])
+                if index_for_rag:
+                    result["rag_stats"] = {
+                        "skipped": True,
+                        "total_chunks": len(entry["chunk_ids"]),
+                        "persist_directory": self.persist_directory
+                    }
+                return result, None
+
         # Initialize the result dictionary to store output information
         result = {
             "original_pdf": pdf_path,
@@ -827,128 +1481,69 @@ class PDFEnhancementPipeline:
             # No enhanced Markdown is generated if conditions are not met
             result["enhanced_markdown_path"] = None
 
-        # Step 3: Optionally index the document for RAG
-        if index_for_rag:
+        if not index_for_rag:
+            return result, None
+
+        # Step 3: Extract and chunk the document for RAG; embedding happens in _commit_index_job
+        try:
+            self.logger.info(f"Indexing PDF for RAG: {pdf_path}")
+            documents = self._extract_documents(pdf_path)
+
+            # Log the extraction results
+            self.logger.info(f"Extracted {len(documents)} document chunks from PDF")
+
+            chunks = []
+            if documents:
+                # Split into smaller chunks for better retrieval
+                text_splitter = TextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+                chunks = text_splitter.split_documents(documents)
+                self.logger.info(f"Split into {len(chunks)} chunks for indexing")
+            else:
+                self.logger.warning("No content could be extracted from the PDF")
+        except Exception as e:
+            self.logger.error(f"Error during RAG indexing: {str(e)}")
+            result["rag_stats"] = {
+                "error": str(e),
+                "persist_directory": self.persist_directory
+            }
+            return result, None
+
+        job = {
+            "doc_key": doc_key,
+            "pdf_path": pdf_path,
+            "content_hash": content_hash,
+            "settings_key": settings_key,
+            "previous_entry": entry,
+            "document_count": len(documents),
+            "chunks": chunks,
+            "chunk_ids": chunk_ids_for(doc_key, settings_key, chunks)
+        }
+        return result, job
+
+    def _commit_index_job(self, result: Dict[str, Any], job: Dict[str, Any]) -> None:
+        """
+        Embed and store the chunks of a prepared PDF, then record it in the manifest
+
+        Holds the retrieval service's index lock, so concurrent indexing of downloads cannot interleave
+        their writes; searches do not take it.
+
+        Args:
+            result (Dict[str, Any]): The process_pdf() result of the PDF; "rag_stats" is filled in here.
+            job (Dict[str, Any]): The index job returned by _prepare_pdf().
+        """
+        with self.retrieval.index_lock:
+            # Other pipelines may have committed since this one was prepared
+            self.manifest.reload()
+            job["previous_entry"] = self.manifest.get(job["doc_key"])
             try:
-                self.logger.info(f"Indexing PDF for RAG: {pdf_path}")
-                
-                # Try multiple extraction methods to ensure we get content
-                documents = []
-                
-                # Method 1: Extract with table of contents if available
-                converter = DocumentConverter()
-                toc = converter.extract_toc(pdf_path)
-                
-                if toc:
-                    self.logger.info("Using TOC-based extraction")
-                    doc = fitz.open(pdf_path)
-                    for level, title, start_page, end_page in toc:
-                        text = ""
-                        for page_num in range(start_page, end_page + 1):
-                            text += doc[page_num].get_text()
-                        
-                        if text.strip():
-                            doc_obj = Document(
-                                page_content=text,
-                                metadata={
-                                    "section": title,
-                                    "level": level,
-                                    "page_range": f"{start_page + 1}-{end_page + 1}",
-                                    "source": pdf_path
-                                }
-                            )
-                            documents.append(doc_obj)
-                    doc.close()
-                
-                # Method 2: Extract page by page if TOC method didn't yield results
-                if not documents:
-                    self.logger.info("Using page-by-page extraction")
-                    pages = converter.pdf_to_text(pdf_path)
-                    for page_num, text in pages:
-                        if text.strip():
-                            doc_obj = Document(
-                                page_content=text,
-                                metadata={
-                                    "page": page_num,
-                                    "source": pdf_path
-                                }
-                            )
-                            documents.append(doc_obj)
-                
-                # Method 3: Use PyMuPDF directly if other methods failed
-                if not documents:
-                    self.logger.info("Using direct PyMuPDF extraction")
-                    doc = fitz.open(pdf_path)
-                    for page_num, page in enumerate(doc):
-                        text = page.get_text()
-                        if text.strip():
-                            doc_obj = Document(
-                                page_content=text,
-                                metadata={
-                                    "page": page_num + 1,
-                                    "source": pdf_path
-                                }
-                            )
-                            documents.append(doc_obj)
-                    doc.close()
-                
-                # If we still don't have documents, try a last resort method
-                if not documents:
-                    self.logger.warning("All extraction methods failed, trying last resort extraction")
-                    try:
-                        import pdfplumber
-                        with pdfplumber.open(pdf_path) as pdf:
-                            for page_num, page in enumerate(pdf.pages, 1):
-                                text = page.extract_text() or ""
-                                if text.strip():
-                                    doc_obj = Document(
-                                        page_content=text,
-                                        metadata={
-                                            "page": page_num,
-                                            "source": pdf_path
-                                        }
-                                    )
-                                    documents.append(doc_obj)
-                    except Exception as e:
-                        self.logger.error(f"Last resort extraction failed: {str(e)}")
-                
-                # Log the extraction results
-                self.logger.info(f"Extracted {len(documents)} document chunks from PDF")
-                
-                # Add documents to vectorstore if any were extracted
-                if documents:
-                    # Split into smaller chunks for better retrieval
-                    text_splitter = TextSplitter(chunk_size=1000, chunk_overlap=200)
-                    chunks = text_splitter.split_documents(documents)
-                    
-                    self.logger.info(f"Split into {len(chunks)} chunks for indexing")
-                    
-                    # Delete the initial dummy document if it exists
-                    try:
-                        self.vectordb._collection.delete(
-                            where={"source": "initialization"}
-                        )
-                    except Exception as e:
-                        self.logger.debug(f"Error deleting initialization document: {str(e)}")
-                    
-                    # Add the new documents - don't call persist() as it may not be available in this version
-                    self.vectordb.add_documents(chunks)
-                    
-                    # Try to persist if the method exists
-                    try:
-                        if hasattr(self.vectordb, 'persist'):
-                            self.vectordb.persist()
-                    except Exception as e:
-                        self.logger.warning(f"Could not persist the vector database: {str(e)}")
-                    
+                self._upsert_chunks(job)
+                if job["chunks"]:
                     self.logger.info("Successfully indexed PDF content")
-                else:
-                    self.logger.warning("No content could be extracted from the PDF")
-                
+
                 # Get stats
                 result["rag_stats"] = {
-                    "total_documents": len(documents),
-                    "total_chunks": len(chunks) if documents else 0,
+                    "total_documents": job["document_count"],
+                    "total_chunks": len(job["chunks"]),
                     "persist_directory": self.persist_directory
                 }
             except Exception as e:
@@ -957,9 +1552,205 @@ class PDFEnhancementPipeline:
                     "error": str(e),
                     "persist_directory": self.persist_directory
                 }
+                # Do not record this version as indexed
+                return
+
+            # Only a freshly indexed document is recorded, so it can be skipped next time
+            outputs = [path for path in (result["markdown_path"], result["enhanced_markdown_path"]) if path]
+            self.manifest.update(job["doc_key"], {
+                "content_hash": job["content_hash"],
+                "settings_key": job["settings_key"],
+                "output_directory": result["output_directory"],
+                "outputs": outputs,
+                "chunk_ids": job["chunk_ids"],
+                "result": {key: value for key, value in result.items() if key != "rag_stats"}
+            })
+
+    def _index_settings_key(self) -> str:
+        """Hash of every setting that changes the stored chunks or their vectors"""
+        settings = {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "embedding_model": self.retrieval.embedding_model_name
+        }
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
 
-        # Return the result dictionary with all generated information
-        return result
+    def _extract_documents(self, pdf_path: str) -> List[Document]:
+        """
+        Extract the text of a PDF as documents, trying several extraction methods in turn
+
+        Args:
+            pdf_path (str): Path to the PDF file.
+
+        Returns:
+            List[Document]: One document per TOC section or per page.
+        """
+        # Try multiple extraction methods to ensure we get content
+        documents = []
+        
+        # Method 1: Extract with table of contents if available
+        converter = DocumentConverter()
+        toc = converter.extract_toc(pdf_path)
+        
+        if toc:
+            self.logger.info("Using TOC-based extraction")
+            doc = fitz.open(pdf_path)
+            for level, title, start_page, end_page in toc:
+                text = ""
+                for page_num in range(start_page, end_page + 1):
+                    text += doc[page_num].get_text()
+                
+                if text.strip():
+                    doc_obj = Document(
+                        page_content=text,
+                        metadata={
+                            "section": title,
+                            "level": level,
+                            "page_range": f"{start_page + 1}-{end_page + 1}",
+                            "source": pdf_path
+                        }
+                    )
+                    documents.append(doc_obj)
+            doc.close()
+        
+        # Method 2: Extract page by page if TOC method didn't yield results
+        if not documents:
+            self.logger.info("Using page-by-page extraction")
+            pages = converter.pdf_to_text(pdf_path)
+            for page_num, text in pages:
+                if text.strip():
+                    doc_obj = Document(
+                        page_content=text,
+                        metadata={
+                            "page": page_num,
+                            "source": pdf_path
+                        }
+                    )
+                    documents.append(doc_obj)
+        
+        # Method 3: Use PyMuPDF directly if other methods failed
+        if not documents:
+            self.logger.info("Using direct PyMuPDF extraction")
+            doc = fitz.open(pdf_path)
+            for page_num, page in enumerate(doc):
+                text = page.get_text()
+                if text.strip():
+                    doc_obj = Document(
+                        page_content=text,
+                        metadata={
+                            "page": page_num + 1,
+                            "source": pdf_path
+                        }
+                    )
+                    documents.append(doc_obj)
+            doc.close()
+        
+        # If we still don't have documents, try a last resort method
+        if not documents:
+            self.logger.warning("All extraction methods failed, trying last resort extraction")
+            try:
+                import pdfplumber
+                with pdfplumber.open(pdf_path) as pdf:
+                    for page_num, page in enumerate(pdf.pages, 1):
+                        text = page.extract_text() or ""
+                        if text.strip():
+                            doc_obj = Document(
+                                page_content=text,
+                                metadata={
+                                    "page": page_num,
+                                    "source": pdf_path
+                                }
+                            )
+                            documents.append(doc_obj)
+            except Exception as e:
+                self.logger.error(f"Last resort extraction failed: {str(e)}")
+
+        return documents
+
+    def _upsert_chunks(self, job: Dict[str, Any]) -> None:
+        """
+        Bring the vector store in line with the current chunks of one document
+
+        Chunks keep stable IDs derived from their content, so only new or modified chunks are embedded
+        and upserted, and chunks that disappeared are deleted. A document indexed before the manifest
+        existed has all of its old vectors replaced.
+
+        Args:
+            job (Dict[str, Any]): The index job returned by _prepare_pdf().
+        """
+        chunks, chunk_ids, entry = job["chunks"], job["chunk_ids"], job["previous_entry"]
+
+        # Delete the initial dummy document if it exists
+        try:
+            self._delete_where({"source": "initialization"})
+        except Exception as e:
+            self.logger.debug(f"Error deleting initialization document: {str(e)}")
+
+        if entry is None:
+            # Unknown to the manifest: drop whatever earlier runs appended for this file
+            self._delete_where({"source": job["pdf_path"]})
+            stale_ids = []
+            known_ids = set()
+        else:
+            known_ids = set(entry["chunk_ids"])
+            current_ids = set(chunk_ids)
+            stale_ids = [chunk_id for chunk_id in entry["chunk_ids"] if chunk_id not in current_ids]
+
+        if stale_ids:
+            self.vectordb.delete(ids=stale_ids)
+
+        new_chunks = [(chunk_id, chunk) for chunk_id, chunk in zip(chunk_ids, chunks) if chunk_id not in known_ids]
+        self.logger.info(
+            f"{len(new_chunks)} new or changed chunks to embed, {len(chunks) - len(new_chunks)} unchanged, "
+            f"{len(stale_ids)} removed"
+        )
+        if not new_chunks:
+            return
+
+        # Adding an ID that is already stored is ignored, so replace leftovers of an interrupted run
+        new_ids = [chunk_id for chunk_id, _ in new_chunks]
+        leftover_ids = self.vectordb.get(ids=new_ids, include=[])["ids"]
+        if leftover_ids:
+            self.vectordb.delete(ids=leftover_ids)
+
+        texts = [chunk.page_content for _, chunk in new_chunks]
+        metadatas = [chunk.metadata for _, chunk in new_chunks]
+        # Add batch by batch, so a long document is stored progressively
+        add_embeddings = getattr(self.vectordb, "add_embeddings", None)
+        if add_embeddings is None:
+            # This Chroma version cannot take precomputed vectors, so it embeds the chunks itself
+            batch_size = self.embedding_stage.batch_size
+            for start in range(0, len(texts), batch_size):
+                self.vectordb.add_texts(
+                    texts[start:start + batch_size],
+                    metadatas=metadatas[start:start + batch_size],
+                    ids=new_ids[start:start + batch_size]
+                )
+        else:
+            for indices, vectors in self.embedding_stage.embed_batches(self.embeddings, texts):
+                add_embeddings(
+                    text_embeddings=[(texts[i], vectors[j]) for j, i in enumerate(indices)],
+                    metadatas=[metadatas[i] for i in indices],
+                    ids=[new_ids[i] for i in indices]
+                )
+
+        # Try to persist if the method exists
+        try:
+            if hasattr(self.vectordb, 'persist'):
+                self.vectordb.persist()
+        except Exception as e:
+            self.logger.warning(f"Could not persist the vector database: {str(e)}")
+
+    def _delete_where(self, where: Dict[str, Any]) -> None:
+        """
+        Delete every stored chunk whose metadata matches a filter
+
+        Args:
+            where (Dict[str, Any]): Metadata filter, e.g. {"source": pdf_path}.
+        """
+        ids = self.vectordb.get(where=where, include=[])["ids"]
+        if ids:
+            self.vectordb.delete(ids=ids)
 
     def search(self, query: str, k: int = 3, filter_dict: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
@@ -973,38 +1764,7 @@ class PDFEnhancementPipeline:
         Returns:
             List[Dict[str, Any]]: Search results
         """
-        try:
-            results = self.vectordb.similarity_search(query, k=k, filter=filter_dict)
-            
-            # Format the results to ensure consistency
-            formatted_results = []
-            for doc in results:
-                formatted_results.append({
-                    "content": doc.page_content,
-                    "source": doc.metadata.get("source", "Unknown"),
-                    "page": doc.metadata.get("page", "N/A"),
-                    "section": doc.metadata.get("section", "N/A")
-                })
-            
-            # If no results found, return a default entry
-            if not formatted_results:
-                formatted_results = [{
-                    "content": "No content found matching the query.",
-                    "source": "None",
-                    "page": "N/A",
-                    "section": "N/A"
-                }]
-                
-            return formatted_results
-        except Exception as e:
-            self.logger.error(f"Error during search: {str(e)}")
-            # Return a default result in case of error
-            return [{
-                "content": f"Error searching content: {str(e)}",
-                "source": "Error",
-                "page": "N/A",
-                "section": "N/A"
-            }]
+        return self.retrieval.search(query=query, k=k, filter_dict=filter_dict)
 
 
 def main() -> None:
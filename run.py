@@ -7,6 +7,14 @@ import os
 import shutil
 import logging
 import base64
+import copy
+import hashlib
+import multiprocessing
+import multiprocessing.util
+import threading
+from multiprocessing.managers import BaseManager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -16,10 +24,13 @@ from selenium.webdriver.common.action_chains import ActionChains
 from prompts import SYSTEM_PROMPT, SYSTEM_PROMPT_TEXT_ONLY  # Keep your existing prompts
 from google import genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
-from utils import get_web_element_rect, encode_image, extract_information, print_message, \
-    get_webarena_accessibility_tree, get_pdf_retrieval_ans_from_assistant, clip_message_and_obs, \
-    clip_message_and_obs_text_only
-from pdf_rag import PDFEnhancementPipeline
+from utils import Observation, remove_som_overlays, extract_information, print_message, \
+    get_pdf_retrieval_ans_from_assistant, ObservationCache, element_entries, \
+    accessibility_tree_entries
+from gemini_session import ConversationHistory, GeminiSession
+from llm_transport import TRANSPORT_MODES, create_client
+from cdp_client import CDPChannel
+from pdf_rag import PDFEnhancementPipeline, RetrievalService, get_retrieval_service
 from instruction_manual_generator import InstructionManualGenerator
 from typing import List, Dict, Optional, Any, Literal
 from datetime import datetime
@@ -63,11 +74,374 @@ def driver_config(args):
     )
 
     options.add_argument("disable-blink-features=AutomationControlled")
+    # Network events for page-settle detection, Page events for the download watcher
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": True})
     return options
 
 
-def format_msg_for_gemini(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text):
-    """Format messages for Gemini API"""
+# Ad, tracker and analytics hosts blocked by the "fast" load profile
+BLOCKED_DOMAINS = (
+    "doubleclick.net",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googletagservices.com",
+    "adservice.google.com",
+    "amazon-adsystem.com",
+    "adnxs.com",
+    "criteo.com",
+    "criteo.net",
+    "taboola.com",
+    "outbrain.com",
+    "scorecardresearch.com",
+    "quantserve.com",
+    "hotjar.com",
+    "segment.io",
+    "mixpanel.com",
+    "connect.facebook.net",
+    "analytics.tiktok.com",
+    "bat.bing.com",
+    "clarity.ms",
+)
+
+# Network.setBlockedURLs only matches URL patterns, so without the DevTools websocket resource types are blocked by
+# file extension, with or without a query string
+RESOURCE_TYPE_EXTENSIONS = {
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+    "media": ("mp4", "webm", "ogg", "ogv", "mp3", "m4a", "wav", "m3u8", "mpd"),
+    "image": ("png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico", "bmp"),
+}
+RESOURCE_TYPE_URL_PATTERNS = {
+    resource_type: tuple(pattern for extension in extensions for pattern in (f"*.{extension}", f"*.{extension}?*"))
+    for resource_type, extensions in RESOURCE_TYPE_EXTENSIONS.items()
+}
+# With the websocket, requests are intercepted by their actual type (Fetch domain)
+CDP_RESOURCE_TYPES = {"font": "Font", "media": "Media", "image": "Image"}
+
+
+def blocked_resource_types(args):
+    """Resource types blocked by the configured load profile"""
+    if args.load_profile == 'none':
+        return []
+    if args.block_resource_types is not None:
+        return list(args.block_resource_types)
+    # Images are never looked at when only the accessibility tree is sent
+    return ['font', 'media'] + (['image'] if args.text_only else [])
+
+
+def blocked_url_patterns(args, include_resource_types=True):
+    """
+    URL patterns blocked by the configured load profile
+
+    Args:
+        args: Parsed arguments (load_profile, block_domains_file, block_resource_types, text_only).
+        include_resource_types (bool): Add the file extension patterns of the blocked resource types; leave them
+            out when the types are intercepted with intercept_resource_types.
+
+    Returns:
+        List[str]: Patterns for Network.setBlockedURLs; empty when nothing is blocked.
+    """
+    if args.load_profile == 'none':
+        return []
+    domains = list(BLOCKED_DOMAINS)
+    if args.block_domains_file:
+        with open(args.block_domains_file, 'r', encoding='utf-8') as f:
+            domains.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    patterns = [f"*{domain}/*" for domain in domains]
+    if include_resource_types:
+        for resource_type in blocked_resource_types(args):
+            patterns.extend(RESOURCE_TYPE_URL_PATTERNS[resource_type])
+    return patterns
+
+
+def apply_load_profile(driver, patterns):
+    """Block requests matching the patterns in the driver's current tab; an empty list lifts the blocking"""
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+    except Exception as e:
+        logging.warning(f"Failed to apply the load profile, loading everything: {e}")
+
+
+def fetch_patterns(resource_types):
+    """Fetch.enable params pausing the requests of the given resource types"""
+    return {'patterns': [{'resourceType': CDP_RESOURCE_TYPES[resource_type], 'requestStage': 'Request'}
+                         for resource_type in resource_types]}
+
+
+def intercept_resource_types(cdp, resource_types):
+    """
+    Fail the requests of the given resource types whatever their URL, through the Fetch domain of the DevTools
+    websocket. Chrome pauses the matching requests until the channel answers, and releases them when it closes.
+
+    Args:
+        cdp (CDPChannel): DevTools websocket of the page.
+        resource_types (List[str]): Keys of CDP_RESOURCE_TYPES.
+
+    Returns:
+        bool: Whether the interception is active.
+    """
+    def fail(params):
+        cdp.send('Fetch.failRequest', {'requestId': params['requestId'], 'errorReason': 'BlockedByClient'})
+
+    try:
+        cdp.on('Fetch.requestPaused', fail)
+        cdp.execute_cdp_cmd('Fetch.enable', fetch_patterns(resource_types))
+        return True
+    except Exception as e:
+        logging.warning(f"Failed to intercept resource types, blocking them by file extension: {e}")
+        return False
+
+
+def timed_page_load(driver, url, settle, reason):
+    """Load a page and wait until it settled; returns (seconds until settled, loadEventEnd in ms or None)"""
+    driver.get(url)
+    seconds = settle.wait(reason)
+    try:
+        load_event_ms = driver.execute_script(
+            "var nav = performance.getEntriesByType('navigation')[0]; return nav ? nav.loadEventEnd : null;")
+    except Exception:
+        load_event_ms = None
+    return seconds, load_event_ms
+
+
+def document_origins(log_entries):
+    """Origins of the documents and frames requested in performance log entries, redirects included"""
+    origins = set()
+    for entry in log_entries:
+        message = json.loads(entry["message"])["message"]
+        if message.get("method") == "Network.requestWillBeSent" and message["params"].get("type") == "Document":
+            match = re.match(r'https?://[^/]+', message["params"]["request"]["url"])
+            if match:
+                origins.add(match.group(0))
+    return origins
+
+
+class PageSettleDetector:
+    """Page Settle Detector - waits until a page has loaded, its network is idle and its DOM stopped changing"""
+
+    # Installs a MutationObserver (once per document) and reports the ready state, the time since the last mutation
+    # and an id of the document, which changes when a navigation commits
+    POLL_SCRIPT = """
+        if (!window.__settleObserver) {
+            window.__settleDocumentId = Math.random().toString(36).slice(2);
+            window.__settleLastMutation = performance.now();
+            window.__settleObserver = new MutationObserver(function() {
+                window.__settleLastMutation = performance.now();
+            });
+            window.__settleObserver.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+        }
+        return [document.readyState, performance.now() - window.__settleLastMutation, window.__settleDocumentId];
+    """
+
+    def __init__(self, driver, max_wait=10.0, quiet_ms=500, max_inflight=2, poll_interval=0.1):
+        """
+        Initialize the detector
+
+        Args:
+            driver: Chrome driver created with performance logging enabled (see driver_config).
+            max_wait (float): Hard ceiling in seconds for one wait.
+            quiet_ms (int): How long the DOM and the network must stay quiet to count as settled.
+            max_inflight (int): Number of pending requests still considered idle (long polls, analytics beacons).
+            poll_interval (float): Seconds between two checks.
+        """
+        self.driver = driver
+        self.max_wait = max_wait
+        self.quiet = quiet_ms / 1000
+        self.max_inflight = max_inflight
+        self.poll_interval = poll_interval
+        # requestId -> monotonic time the request was seen
+        self.inflight = {}
+        # Pending navigations of the top-level document; busy whatever max_inflight says, because the old document
+        # still reports readyState "complete" until the new one commits
+        self.pending_documents = set()
+        self.document_id = None
+        try:
+            # The top-level frame id is the DevTools target id, which ChromeDriver uses as window handle
+            self.main_frame_id = driver.current_window_handle
+        except Exception:
+            self.main_frame_id = None
+        self.last_busy = 0.0
+        self.network_events = True
+        self.waits = []
+        # Resource type -> number of requests blocked by the load profile
+        self.blocked = {}
+        # Callables receiving (method, params) of every other event of the log, e.g. DownloadWatcher.on_event
+        self.listeners = []
+        # Origins of every document and frame loaded, whose storage is cleared after the task (see DriverPool)
+        self.origins = set()
+
+    def _poll_network(self, now):
+        """Drain the performance log and update the set of pending requests"""
+        if not self.network_events:
+            return
+        try:
+            entries = self.driver.get_log("performance")
+        except Exception as e:
+            logging.info(f"Network events unavailable, settling on DOM and ready state only: {e}")
+            self.network_events = False
+            return
+        self.origins |= document_origins(entries)
+        for entry in entries:
+            message = json.loads(entry["message"])["message"]
+            method = message.get("method", "")
+            if method == "Network.requestWillBeSent":
+                self.inflight[message["params"]["requestId"]] = now
+                if (message["params"].get("type") == "Document"
+                        and self.main_frame_id in (None, message["params"].get("frameId"))):
+                    self.pending_documents.add(message["params"]["requestId"])
+            elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+                self.inflight.pop(message["params"]["requestId"], None)
+                self.pending_documents.discard(message["params"]["requestId"])
+                if method == "Network.loadingFailed" and (
+                        message["params"].get("blockedReason")
+                        or message["params"].get("errorText") == "net::ERR_BLOCKED_BY_CLIENT"):
+                    resource_type = message["params"].get("type", "Other")
+                    self.blocked[resource_type] = self.blocked.get(resource_type, 0) + 1
+            else:
+                for listener in self.listeners:
+                    listener(method, message.get("params", {}))
+        # Requests pending for longer than a whole wait (streams, long polls) never finish; stop tracking them
+        for request_id, started in list(self.inflight.items()):
+            if now - started > self.max_wait:
+                del self.inflight[request_id]
+        self.pending_documents &= self.inflight.keys()
+        if len(self.inflight) > self.max_inflight or self.pending_documents:
+            self.last_busy = now
+
+    def poll(self):
+        """Read the events logged since the last check without waiting"""
+        self._poll_network(time.monotonic())
+
+    def wait(self, reason):
+        """
+        Block until the page settled or the hard ceiling is reached
+
+        Args:
+            reason (str): What triggered the wait, for the log.
+
+        Returns:
+            float: Seconds waited.
+        """
+        start = time.monotonic()
+        self.last_busy = start
+        settled = False
+        while True:
+            time.sleep(self.poll_interval)
+            now = time.monotonic()
+            self._poll_network(now)
+            try:
+                ready_state, dom_quiet_ms, document_id = self.driver.execute_script(self.POLL_SCRIPT)
+            except Exception:
+                # The document is being replaced
+                ready_state, dom_quiet_ms, document_id = "loading", 0, None
+            if document_id != self.document_id:
+                # A new document committed: it must stay quiet on its own before the page counts as settled
+                self.document_id = document_id
+                self.last_busy = now
+            if (ready_state == "complete" and dom_quiet_ms / 1000 >= self.quiet
+                    and now - self.last_busy >= self.quiet):
+                settled = True
+                break
+            if now - start >= self.max_wait:
+                break
+
+        elapsed = time.monotonic() - start
+        self.waits.append(elapsed)
+        if settled:
+            logging.info(f"Page settled after {elapsed:.2f}s ({reason})")
+        else:
+            logging.info(f"Page did not settle within {self.max_wait}s ({reason}, "
+                         f"ready state: {ready_state}, pending requests: {len(self.inflight)})")
+        return elapsed
+
+    def summary(self):
+        """Log the total time spent waiting for pages"""
+        if self.waits:
+            logging.info(f"Settle waits: {len(self.waits)}, total {sum(self.waits):.2f}s, "
+                         f"max {max(self.waits):.2f}s")
+        if self.blocked:
+            counts = ', '.join(f"{resource_type}: {count}" for resource_type, count in sorted(self.blocked.items()))
+            logging.info(f"Blocked requests: {sum(self.blocked.values())} ({counts})")
+
+
+class DownloadWatcher:
+    """Download Watcher - reports downloads as soon as Chrome reports them finished, from the DevTools download
+    events read by a PageSettleDetector"""
+
+    def __init__(self, driver, download_dir, settle):
+        """
+        Initialize the watcher and ask Chrome for download events
+
+        Args:
+            driver: Chrome driver created with performance logging enabled (see driver_config).
+            download_dir (str): Chrome's download directory.
+            settle (PageSettleDetector): Detector draining the driver's performance log; it forwards the events.
+        """
+        self.download_dir = os.path.abspath(download_dir)
+        self.settle = settle
+        # guid -> file name of the downloads that have not finished
+        self._pending = {}
+        self._completed = []
+        try:
+            driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+                "behavior": "allow", "downloadPath": self.download_dir, "eventsEnabled": True})
+        except Exception as e:
+            logging.warning(f"Could not enable download events: {e}")
+        settle.listeners.append(self.on_event)
+
+    def on_event(self, method, params):
+        """Track the downloads of the Browser and Page download events"""
+        domain, _, event = method.partition('.')
+        if domain not in ('Browser', 'Page'):
+            return
+        if event == 'downloadWillBegin':
+            self._pending.setdefault(params['guid'], params.get('suggestedFilename', ''))
+        elif event == 'downloadProgress' and params.get('guid') in self._pending:
+            if params.get('state') == 'completed':
+                name = self._pending.pop(params['guid'])
+                self._completed.append(params.get('filePath') or os.path.join(self.download_dir, name))
+            elif params.get('state') == 'canceled':
+                self._pending.pop(params['guid'])
+
+    def _finished_without_event(self):
+        """Pending downloads whose file is complete, for sessions that receive no progress events"""
+        for guid, name in list(self._pending.items()):
+            path = os.path.join(self.download_dir, name)
+            if name and os.path.isfile(path) and not os.path.exists(path + '.crdownload'):
+                del self._pending[guid]
+                self._completed.append(path)
+
+    def collect(self, timeout=30.0):
+        """
+        Return the downloads completed since the last call, first waiting for running downloads to finish
+
+        Args:
+            timeout (float): Hard ceiling in seconds for running downloads.
+
+        Returns:
+            List[str]: Paths of the completed files.
+        """
+        start = time.monotonic()
+        self.settle.poll()
+        self._finished_without_event()
+        while self._pending and time.monotonic() - start < timeout:
+            time.sleep(self.settle.poll_interval)
+            self.settle.poll()
+            self._finished_without_event()
+        if self._pending:
+            logging.warning(f"{len(self._pending)} download(s) still running after {timeout}s")
+        completed, self._completed = self._completed, []
+        if completed:
+            logging.info(f"Downloaded {len(completed)} file(s), waited {time.monotonic() - start:.2f}s")
+        return completed
+
+
+def format_msg_for_gemini(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text, include_manual=True,
+                          obs_diff=None, image_mime_type='image/png'):
+    """Format messages for Gemini API; with obs_diff, later steps carry only the element changes"""
     if it == 1:
         init_msg += f"I've provided the tag name of each element and the text it contains (if text exists). Note that <textarea> or <input> may be textbox, but not exactly. Please focus more on the screenshot and then refer to the textual information.\n{web_text}"
         
@@ -79,21 +453,30 @@ def format_msg_for_gemini(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text
                 {'role': 'user', 
                  'parts': [
                     {'text': init_msg},
-                    {'inline_data': {'mime_type': 'image/jpeg', 'data': web_img_b64}}
+                    {'inline_data': {'mime_type': image_mime_type, 'data': web_img_b64}}
                  ]
                 }
-            ]
+            ],
+            'keyframe': True
         }
         return gemini_msg
     else:
-        # Extract the manual from init_msg to include in subsequent messages
-        manual_start = init_msg.find("[Manuals and QA pairs]\n")
-        manual_end = init_msg.find("\n\nIMPORTANT:")
+        # Send only the changes of the element list unless this step is a keyframe
+        if obs_diff is not None:
+            web_text = obs_diff
         
-        if manual_start != -1 and manual_end != -1:
-            manual_text = init_msg[manual_start:manual_end]
+        # Extract the manual from init_msg to include in subsequent messages,
+        # unless it is already part of the cached context
+        if not include_manual:
+            manual_text = "[Manuals and QA pairs] (Provided at the start of the conversation)"
         else:
-            manual_text = "[Manuals and QA pairs] (Not found in initial message)"
+            manual_start = init_msg.find("[Manuals and QA pairs]\n")
+            manual_end = init_msg.find("\n\nIMPORTANT:")
+            
+            if manual_start != -1 and manual_end != -1:
+                manual_text = init_msg[manual_start:manual_end]
+            else:
+                manual_text = "[Manuals and QA pairs] (Not found in initial message)"
         
         if not pdf_obs:
             msg_text = f"Observation:{warn_obs} please analyze the attached screenshot and give the Thought and Action. I've provided the tag name of each element and the text it contains (if text exists). Note that <textarea> or <input> may be textbox, but not exactly. Please focus more on the screenshot and then refer to the textual information.\n{web_text}"
@@ -119,16 +502,18 @@ def format_msg_for_gemini(it, init_msg, pdf_obs, warn_obs, web_img_b64, web_text
                 {'role': 'user',
                  'parts': [
                     {'text': msg_text},
-                    {'inline_data': {'mime_type': 'image/jpeg', 'data': web_img_b64}}
+                    {'inline_data': {'mime_type': image_mime_type, 'data': web_img_b64}}
                  ]
                 }
-            ]
+            ],
+            'keyframe': obs_diff is None
         }
         return gemini_msg
 
 
-def format_msg_text_only_for_gemini(it, init_msg, pdf_obs, warn_obs, ac_tree):
-    """Format text-only messages for Gemini API"""
+def format_msg_text_only_for_gemini(it, init_msg, pdf_obs, warn_obs, ac_tree, include_manual=True,
+                                    obs_diff=None):
+    """Format text-only messages for Gemini API; with obs_diff, later steps carry only the tree changes"""
     if it == 1:
         # Add reminder about following instructions
         init_msg += "\n\nREMINDER: Follow the step-by-step instructions in the manual above. Indicate which step you are following with each action."
@@ -140,18 +525,27 @@ def format_msg_text_only_for_gemini(it, init_msg, pdf_obs, warn_obs, ac_tree):
                     {'text': init_msg + '\n' + ac_tree}
                  ]
                 }
-            ]
+            ],
+            'keyframe': True
         }
         return gemini_msg
     else:
-        # Extract the manual from init_msg to include in subsequent messages
-        manual_start = init_msg.find("[Manuals and QA pairs]\n")
-        manual_end = init_msg.find("\n\nIMPORTANT:")
+        # Send only the changes of the accessibility tree unless this step is a keyframe
+        if obs_diff is not None:
+            ac_tree = obs_diff
         
-        if manual_start != -1 and manual_end != -1:
-            manual_text = init_msg[manual_start:manual_end]
+        # Extract the manual from init_msg to include in subsequent messages,
+        # unless it is already part of the cached context
+        if not include_manual:
+            manual_text = "[Manuals and QA pairs] (Provided at the start of the conversation)"
         else:
-            manual_text = "[Manuals and QA pairs] (Not found in initial message)"
+            manual_start = init_msg.find("[Manuals and QA pairs]\n")
+            manual_end = init_msg.find("\n\nIMPORTANT:")
+            
+            if manual_start != -1 and manual_end != -1:
+                manual_text = init_msg[manual_start:manual_end]
+            else:
+                manual_text = "[Manuals and QA pairs] (Not found in initial message)"
         
         if not pdf_obs:
             msg_text = f"Observation:{warn_obs} please analyze the accessibility tree and give the Thought and Action.\n{ac_tree}"
@@ -179,11 +573,49 @@ def format_msg_text_only_for_gemini(it, init_msg, pdf_obs, warn_obs, ac_tree):
                     {'text': msg_text}
                  ]
                 }
-            ]
+            ],
+            'keyframe': obs_diff is None
         }
         return gemini_msg
 
 
+def find_observation_start(text):
+    """
+    Locate the page observation in a user message so that it can be collapsed once it gets old
+
+    Args:
+        text (str): Text of the user message.
+
+    Returns:
+        Optional[int]: Index of the observation, or None if the message has no observation.
+    """
+    index = text.find("Observation:")
+    return None if index == -1 else index
+
+
+def create_gemini_session(args, gemini_client):
+    """Create the Gemini session of one task, holding the system instructions and the trimmed history"""
+    # Add system prompt if needed
+    system_instructions = SYSTEM_PROMPT if not args.text_only else SYSTEM_PROMPT_TEXT_ONLY
+    
+    # Add emphasis to the manual following part of the system instructions
+    system_instructions = system_instructions.replace(
+        "* Manual Following Guidelines *",
+        "*** CRITICAL: MANUAL FOLLOWING GUIDELINES ***"
+    )
+    
+    return GeminiSession(
+        gemini_client,
+        model="gemini-2.5-pro-preview-03-25",
+        system_instruction=system_instructions,
+        history=ConversationHistory(
+            max_images=args.max_attached_imgs,
+            token_budget=args.max_context_tokens,
+            text_only=args.text_only
+        )
+    )
+
+
 def call_gemini_api(args, gemini_client, messages, conversation_history=None):
     """Call the Gemini API with proper error handling"""
     retry_times = 0
@@ -194,78 +626,34 @@ def call_gemini_api(args, gemini_client, messages, conversation_history=None):
             # Extract parts from the message format
             user_message = messages['contents'][0]
             
-            # Add system prompt if needed
-            system_instructions = SYSTEM_PROMPT if not args.text_only else SYSTEM_PROMPT_TEXT_ONLY
-            
-            # Add emphasis to the manual following part of the system instructions
-            system_instructions = system_instructions.replace(
-                "* Manual Following Guidelines *",
-                "*** CRITICAL: MANUAL FOLLOWING GUIDELINES ***"
-            )
-            
-            # Initialize or continue conversation
-            if conversation_history is None:
-                # Create a new conversation with system instructions as part of the first user message
-                first_message = {
-                    "role": "user",
-                    "parts": []
-                }
-                
-                # Add system instructions and user text
-                first_message["parts"].append({
-                    "text": f"{system_instructions}\n\n{user_message['parts'][0]['text']}"
-                })
-                
-                # Add image if present
-                if len(user_message['parts']) > 1 and 'inline_data' in user_message['parts'][1]:
-                    image_data = user_message['parts'][1]['inline_data']
-                    first_message["parts"].append({
-                        "inline_data": {
-                            "mime_type": image_data['mime_type'],
-                            "data": image_data['data']
-                        }
-                    })
-                
-                # Create a chat session
-                response = gemini_client.models.generate_content(
-                    model="gemini-2.5-pro-preview-03-25",
-                    contents=[first_message]
-                )
-                conversation = {"history": [first_message, {"role": "model", "parts": [{"text": response.text}]}]}
-            else:
-                conversation = conversation_history
+            # Initialize or continue conversation; the system instructions go in the request config
+            conversation = conversation_history or create_gemini_session(args, gemini_client)
             
             # Format the current message for sending
-            current_message = {
-                "role": "user",
-                "parts": []
-            }
-            
+            current_parts = []
             for part in user_message['parts']:
                 if 'text' in part:
                     # a simple text part
-                    current_message["parts"].append({"text": part['text']})
+                    current_parts.append({"text": part['text']})
                 elif 'inline_data' in part:
                     # a valid PartDict
-                    current_message["parts"].append({
+                    current_parts.append({
                         "inline_data": {
                             "mime_type": part['inline_data']['mime_type'],
                             "data": part['inline_data']['data']
                         }
                     })
             
-            # Add the current message to the conversation history
-            conversation["history"].append(current_message)
-            
-            # Send the message to the model
-            response = gemini_client.models.generate_content(
-                model="gemini-2.5-pro-preview-03-25",
-                contents=conversation["history"]
+            # Send the trimmed history plus the current message to the model (one call per step)
+            response = conversation.send(current_parts, find_observation_start(user_message['parts'][0]['text']),
+                                         keyframe=messages.get('keyframe', False))
+            context_stats = conversation.history.last_stats
+            logging.info(
+                f"Context: {context_stats['turns']} turns, {context_stats['images']} images, "
+                f"~{context_stats['estimated_tokens']} tokens "
+                f"({context_stats['dropped_turns']} turns dropped for the token budget)"
             )
             
-            # Add the model's response to the conversation history
-            conversation["history"].append({"role": "model", "parts": [{"text": response.text}]})
-            
             # Estimate token usage (since Gemini doesn't provide this directly)
             # This is a rough estimate based on word count - adjust as needed
             message_text = ' '.join([part.get('text', '') for part in user_message['parts'] if 'text' in part])
@@ -288,7 +676,7 @@ def call_gemini_api(args, gemini_client, messages, conversation_history=None):
                 time.sleep(15)
             elif "invalid request" in str(e).lower():
                 gpt_call_error = True
-                return None, None, gpt_call_error, None, None
+                return None, None, gpt_call_error, None, conversation_history
             else:
                 time.sleep(5)
                 
@@ -298,13 +686,106 @@ def call_gemini_api(args, gemini_client, messages, conversation_history=None):
                 return None, None, True, None, None
 
 
-def exec_action_click(info, web_ele, driver_task):
+class DriverPool:
+    """Driver Pool - reuses a warm Chrome session across tasks, resetting its state in between"""
+
+    def __init__(self, options, max_tasks_per_driver=10):
+        """
+        Initialize the pool
+
+        Args:
+            options: Chrome options used to start a driver.
+            max_tasks_per_driver (int): Tasks run on one Chrome before it is recycled; 1 starts a fresh Chrome per task.
+        """
+        self.options = options
+        self.max_tasks_per_driver = max(1, max_tasks_per_driver)
+        self.driver = None
+        self.tasks_on_driver = 0
+
+    def acquire(self):
+        """Return a clean driver, starting a new Chrome if the current one is used up or unresponsive"""
+        if self.driver is not None and (self.tasks_on_driver >= self.max_tasks_per_driver or not self._is_alive()):
+            self._discard()
+        if self.driver is None:
+            start = time.time()
+            self.driver = webdriver.Chrome(options=self.options)
+            self.tasks_on_driver = 0
+            logging.info(f"Started Chrome in {time.time() - start:.2f}s")
+        self.tasks_on_driver += 1
+        return self.driver
+
+    def release(self, driver, discard=False, origins=()):
+        """
+        Give the driver back after a task
+
+        Args:
+            driver: Driver returned by acquire.
+            discard (bool): Quit the driver instead of reusing it (e.g. after a crash).
+            origins (Iterable[str]): Origins the task visited (PageSettleDetector.origins); their storage is
+                cleared, as well as that of the origins still open and of the requests not read yet.
+        """
+        if driver is not self.driver:
+            driver.quit()
+            return
+        if discard or self.tasks_on_driver >= self.max_tasks_per_driver:
+            self._discard()
+            return
+        try:
+            self._reset(driver, origins)
+        except Exception as e:
+            logging.warning(f"Failed to reset Chrome, starting a new one for the next task: {e}")
+            self._discard()
+
+    def close(self):
+        """Quit the pooled driver"""
+        if self.driver is not None:
+            self._discard()
+
+    def _is_alive(self):
+        try:
+            self.driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, driver, origins=()):
+        """Clear cookies and storage and close extra windows, keeping the HTTP cache warm"""
+        origins = set(origins) | document_origins(driver.get_log('performance'))
+        handles = driver.window_handles
+        for handle in reversed(handles):
+            driver.switch_to.window(handle)
+            match = re.match(r'https?://[^/]+', driver.current_url)
+            if match:
+                origins.add(match.group(0))
+            if handle != handles[0]:
+                driver.close()
+        driver.switch_to.window(handles[0])
+        driver.get('about:blank')
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        for origin in sorted(origins):
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                'origin': origin,
+                'storageTypes': 'local_storage,session_storage,indexeddb,websql,service_workers,cache_storage'
+            })
+        # Drop the network events of the previous task
+        driver.get_log('performance')
+
+    def _discard(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logging.warning(f"Failed to quit Chrome: {e}")
+        self.driver = None
+        self.tasks_on_driver = 0
+
+
+def exec_action_click(info, web_ele, driver_task, settle):
     driver_task.execute_script("arguments[0].setAttribute('target', '_self')", web_ele)
     web_ele.click()
-    time.sleep(3)
+    settle.wait('click')
 
 
-def exec_action_type(info, web_ele, driver_task):
+def exec_action_type(info, web_ele, driver_task, settle):
     warn_obs = ""
     type_content = info['content']
 
@@ -342,11 +823,11 @@ def exec_action_type(info, web_ele, driver_task):
 
     actions.send_keys(Keys.ENTER)
     actions.perform()
-    time.sleep(10)
+    settle.wait('type')
     return warn_obs
 
 
-def exec_action_scroll(info, web_eles, driver_task, args, obs_info):
+def exec_action_scroll(info, web_eles, driver_task, args, obs_info, settle):
     scroll_ele_number = info['number']
     scroll_content = info['content']
     if scroll_ele_number == "WINDOW":
@@ -369,7 +850,99 @@ def exec_action_scroll(info, web_eles, driver_task, args, obs_info):
             actions.key_down(Keys.ALT).send_keys(Keys.ARROW_DOWN).key_up(Keys.ALT).perform()
         else:
             actions.key_down(Keys.ALT).send_keys(Keys.ARROW_UP).key_up(Keys.ALT).perform()
-    time.sleep(3)
+    settle.wait('scroll')
+
+
+class PDFAnswerCache:
+    """PDF Answer Cache - on-disk LRU cache of PDF answers keyed by PDF content, query, model and answer mode"""
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 ** 2, read_only=False):
+        """
+        Initialize the cache
+
+        Args:
+            cache_dir (str): Directory holding one JSON file per answer; safe to share between processes.
+            max_bytes (int): Total size above which the least recently used answers are evicted.
+            read_only (bool): Replay mode: never write, and never call Gemini on a miss.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(pdf_path, query, model, mode):
+        """Cache key of an answer"""
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        normalized_query = ' '.join(query.split()).casefold()
+        return hashlib.sha256(f'{digest.hexdigest()}\n{normalized_query}\n{model}\n{mode}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key):
+        """Cached answer or None; a hit marks the entry as recently used"""
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                answer = json.load(f)['answer']
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            logging.info(f'PDF answer cache miss ({self.hits} hits, {self.misses} misses)')
+            return None
+        if not self.read_only:
+            os.utime(self._path(key))
+        self.hits += 1
+        logging.info(f'PDF answer cache hit ({self.hits} hits, {self.misses} misses)')
+        return answer
+
+    def put(self, key, answer):
+        """Store an answer and evict the least recently used ones beyond max_bytes"""
+        if self.read_only:
+            return
+        tmp_path = f'{self._path(key)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'answer': answer}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+def answer_downloaded_pdf(args, gemini_client, download_service, pdf_path, query, output_dir, cache):
+    """Answer the query about a downloaded PDF according to args.pdf_answer_mode, through the answer cache"""
+    key = cache.key(pdf_path, query, 'gemini-2.5-pro-preview-03-25', args.pdf_answer_mode)
+    answer = cache.get(key)
+    if answer is not None:
+        return answer
+    if cache.read_only:
+        return "No recorded answer for this PDF and query."
+
+    if args.pdf_answer_mode == 'rag':
+        answer = get_pdf_retrieval_ans_from_rag(gemini_client, download_service, pdf_path, query, output_dir)
+    else:
+        answer = get_pdf_retrieval_ans_from_gemini(gemini_client, pdf_path, query)
+    if not answer.startswith('Error analyzing PDF:'):
+        cache.put(key, answer)
+    return answer
 
 
 def get_pdf_retrieval_ans_from_gemini(gemini_client, pdf_path, query):
@@ -403,63 +976,117 @@ def get_pdf_retrieval_ans_from_gemini(gemini_client, pdf_path, query):
         return f"Error analyzing PDF: {str(e)}"
 
 
+def get_pdf_retrieval_ans_from_rag(gemini_client, download_service, pdf_path, query, output_dir, k=8):
+    """
+    Answer the query from the chunks of a downloaded PDF most relevant to it, instead of uploading the whole file
+
+    Falls back to get_pdf_retrieval_ans_from_gemini if the PDF cannot be indexed or searched.
+    """
+    try:
+        download_service.index_pdf(pdf_path, output_dir)
+        results = download_service.search(query, k=k, filter_dict={"source": pdf_path})
+    except Exception as e:
+        logging.error(f"Error indexing downloaded PDF, sending the whole file instead: {str(e)}")
+        return get_pdf_retrieval_ans_from_gemini(gemini_client, pdf_path, query)
+    if results[0]['source'] in ('None', 'Error'):
+        logging.error(f"No chunks found for downloaded PDF, sending the whole file instead: {results[0]['content']}")
+        return get_pdf_retrieval_ans_from_gemini(gemini_client, pdf_path, query)
+
+    excerpts = "\n\n".join(f"[Page {result['page']}, {result['section']}]\n{result['content']}" for result in results)
+    logging.info(f"Answering from {len(results)} PDF chunks ({len(excerpts)} characters)")
+    prompt = f"""Please analyze these excerpts of a PDF and answer the following query:
+        
+        {query}
+        
+        Provide a detailed and accurate answer based solely on the PDF content.
+
+        Excerpts:
+        {excerpts}"""
+    try:
+        response = gemini_client.models.generate_content(
+            model='gemini-2.5-pro-preview-03-25',
+            contents=[{"role": "user", "parts": [{"text": prompt}]}]
+        )
+        return response.text
+    except Exception as e:
+        logging.error(f"Error in PDF analysis: {str(e)}")
+        return f"Error analyzing PDF: {str(e)}"
+
+
 def index_pdf(
         pdf_path: str,
         output_dir: str,
         api_key: str,
         logger: logging.Logger,
         persist_directory: str = "./chroma_db",
-        org_id: Optional[str] = None
+        org_id: Optional[str] = None,
+        retrieval_service: Optional[RetrievalService] = None
 ) -> Dict[str, Any]:
     """
     Indexes a PDF and converts it to Markdown.
     """
-    # Initialize the pipeline
+    return index_pdfs([pdf_path], output_dir, api_key, logger, persist_directory, org_id, retrieval_service)[0]
+
+
+def index_pdfs(
+        pdf_paths: List[str],
+        output_dir: str,
+        api_key: str,
+        logger: logging.Logger,
+        persist_directory: str = "./chroma_db",
+        org_id: Optional[str] = None,
+        retrieval_service: Optional[RetrievalService] = None,
+        embedding_batch_size: int = 32,
+        embedding_threads: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Indexes PDFs and converts them to Markdown, extracting the next PDFs while the current one is embedded.
+    """
+    # Initialize the pipeline on top of the shared retrieval service
     pipeline = PDFEnhancementPipeline(
         gemini_api_key=api_key,
         logger=logger,
-        persist_directory=persist_directory
+        persist_directory=persist_directory,
+        retrieval_service=retrieval_service,
+        embedding_batch_size=embedding_batch_size,
+        embedding_threads=embedding_threads
     )
 
-    logger.info(f"Starting to process {pdf_path}...")
-    result = pipeline.process_pdf(
-        pdf_path=pdf_path,
+    logger.info(f"Starting to process {', '.join(pdf_paths)}...")
+    results = pipeline.process_pdfs(
+        pdf_paths=pdf_paths,
         output_dir=output_dir,
         add_image_descriptions=True,
         index_for_rag=True,
         overwrite_enhanced_md=False
     )
 
-    logger.info("Processing completed:")
-    logger.info(f"- Original PDF: {result['original_pdf']}")
-    logger.info(f"- Markdown file: {result['markdown_path']}")
-    logger.info(f"- Number of processed images: {result['image_count']}")
-    if 'enhanced_markdown_path' in result:
-        logger.info(f"- Enhanced Markdown: {result['enhanced_markdown_path']}")
+    for result in results:
+        logger.info("Processing completed:")
+        logger.info(f"- Original PDF: {result['original_pdf']}")
+        if 'error' in result:
+            logger.info(f"- Error: {result['error']}")
+            continue
+        logger.info(f"- Markdown file: {result['markdown_path']}")
+        logger.info(f"- Number of processed images: {result['image_count']}")
+        if 'enhanced_markdown_path' in result:
+            logger.info(f"- Enhanced Markdown: {result['enhanced_markdown_path']}")
 
-    return result
+    return results
 
 
 def search_rag(
         query: str,
-        api_key: str,
+        retrieval_service,
         logger: logging.Logger,
-        persist_directory: str = "./chroma_db",
-        k: int = 20,
-        org_id: Optional[str] = None
+        k: int = 20
 ) -> List[Dict]:
     """
-    Performs a search on the indexed data.
+    Performs a search on the indexed data through the shared retrieval service
+    (a RetrievalService, or a proxy to the parent's one inside a worker process).
     """
-    # Initialize the pipeline
-    pipeline = PDFEnhancementPipeline(
-        gemini_api_key=api_key,
-        logger=logger,
-        persist_directory=persist_directory
-    )
-
     logger.info(f"Searching for: {query}")
-    results = pipeline.search(query=query, k=k)
+    results = retrieval_service.search(query=query, k=k)
     
     # Process the results to ensure they have consistent keys
     filtered_results = []
@@ -545,77 +1172,53 @@ Your instruction manual should be so clear that anyone could follow it without a
         return f"Error generating manual: {str(e)}"
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--test_file', type=str, default='data/test.json')
-    parser.add_argument('--max_iter', type=int, default=25)
-    parser.add_argument("--api_key", default="key", type=str, help="YOUR_GOOGLE_API_KEY")
-    parser.add_argument("--openai_api_key", default=None, type=str, help="YOUR_OPENAI_API_KEY (for PDF indexing)")
-    parser.add_argument("--api_organization_id", default=None, type=str, help="YOUR_OPENAI_ORGANIZATION_ID")
-    parser.add_argument("--api_model", default="gemini-1.5-pro-latest", type=str, help="Gemini model name")
-    parser.add_argument("--output_dir", type=str, default='results')
-    parser.add_argument("--seed", type=int, default=None)
-    parser.add_argument("--max_attached_imgs", type=int, default=1)
-    parser.add_argument("--temperature", type=float, default=1.0)
-    parser.add_argument("--download_dir", type=str, default="downloads")
-    parser.add_argument("--text_only", action='store_true')
-    # for web browser
-    parser.add_argument("--headless", action='store_true', help='The window of selenium')
-    parser.add_argument("--save_accessibility_tree", action='store_true')
-    parser.add_argument("--force_device_scale", action='store_true')
-    parser.add_argument("--window_width", type=int, default=1024)
-    parser.add_argument("--window_height", type=int, default=768)  # for headless mode, there is no address bar
-    parser.add_argument("--fix_box_color", action='store_true')
-
-    parser.add_argument("--pdf_path", type=str, default='data/arXiv.pdf')
-    args = parser.parse_args()
-
-    # Configure Google Generative AI
-    genai_client = genai.Client(api_key=args.api_key)
-
-    options = driver_config(args)
-
-    # Save Result file
-    current_time = time.strftime("%Y%m%d_%H_%M_%S", time.localtime())
-    result_dir = os.path.join(args.output_dir, current_time)
-    os.makedirs(result_dir, exist_ok=True)
-
-    # Load tasks
-    tasks = []
-    with open(args.test_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            tasks.append(json.loads(line))
-
-    init_dir = os.path.join(result_dir, 'init')
-    os.makedirs(init_dir, exist_ok=True)
-    init_logger = setup_logger(init_dir)
-    markdown_output_dir = "output"
-    
-    # For PDF indexing, we might still need OpenAI temporarily
-    # (or adapt PDFEnhancementPipeline to use Gemini)
-    if args.openai_api_key:
-        openai_key = args.openai_api_key
-    else:
-        # Fallback to using the same key for everything
-        openai_key = args.api_key
-    
-    index_pdf(pdf_path=args.pdf_path, output_dir=markdown_output_dir, api_key=openai_key,
-              logger=init_logger, org_id=args.api_organization_id)
-
-    for task_id in range(len(tasks)):
-        task = tasks[task_id]
-        task_dir = os.path.join(result_dir, 'task{}'.format(task["id"]))
-        os.makedirs(task_dir, exist_ok=True)
-        task_logger = setup_logger(task_dir)
-        logging.info(f'########## TASK{task["id"]} ##########')
-
-        driver_task = webdriver.Chrome(options=options)
-
+def run_task(task, args, genai_client, driver_pool, result_dir, retrieval_service, download_service):
+    """Run a single task in a browser session from driver_pool, logging to result_dir/task<id>."""
+    task_dir = os.path.join(result_dir, 'task{}'.format(task["id"]))
+    os.makedirs(task_dir, exist_ok=True)
+    task_logger = setup_logger(task_dir)
+    logging.info(f'########## TASK{task["id"]} ##########')
+
+    driver_task = driver_pool.acquire()
+    driver_failed = False
+    settle = PageSettleDetector(driver_task, max_wait=args.settle_timeout, quiet_ms=args.settle_quiet_ms)
+    # Transport clients count their calls; the client is shared by the tasks of a process
+    llm_stats_start = dict(getattr(genai_client, 'stats', {}))
+    # No need to maintain messages list in the OpenAI format
+    # Instead, we'll use Gemini's conversation
+    conversation = None
+    observation_cache = None
+    pdf_answer_cache = None
+    cdp_channel = None
+    # Archival screenshots are written in the background
+    screenshot_writer = ThreadPoolExecutor(max_workers=1)
+    try:
         # About window size, 765 tokens
         # You can resize to height = 512 by yourself (255 tokens, Maybe bad performance)
         driver_task.set_window_size(args.window_width,
                                     args.window_height)  # larger height may contain more web information
-        driver_task.get(task['web'])
+        if args.cdp_websocket:
+            cdp_channel = CDPChannel.connect(driver_task)
+        # Applied on every task: pooled drivers may have been replaced or have run with another profile
+        resource_types = blocked_resource_types(args)
+        intercepted = bool(resource_types) and cdp_channel is not None and intercept_resource_types(cdp_channel,
+                                                                                                   resource_types)
+        patterns = blocked_url_patterns(args, include_resource_types=not intercepted)
+
+        reference = None
+        if args.load_profile_compare and args.load_profile != 'none':
+            # Both measured loads start from a cold cache; the reference is loaded without blocking
+            driver_task.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': True})
+            apply_load_profile(driver_task, [])
+            if intercepted:
+                cdp_channel.execute_cdp_cmd('Fetch.disable', {})
+            reference = timed_page_load(driver_task, task['web'], settle, 'unblocked reference load')
+            if intercepted:
+                cdp_channel.execute_cdp_cmd('Fetch.enable', fetch_patterns(resource_types))
+        apply_load_profile(driver_task, patterns)
+        load_seconds, load_event_ms = timed_page_load(driver_task, task['web'], settle, 'load')
+        if reference is not None:
+            driver_task.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': False})
         try:
             driver_task.find_element(By.TAG_NAME, 'body').click()
         except:
@@ -623,7 +1226,16 @@ def main():
         # sometimes enter SPACE, the page will sroll down
         driver_task.execute_script(
             """window.onkeydown = function(e) {if(e.keyCode == 32 && e.target.type != 'text' && e.target.type != 'textarea') {e.preventDefault();}};""")
-        time.sleep(5)
+        logging.info(f"Initial page load ({args.load_profile} load profile): settled after {load_seconds:.2f}s, "
+                     f"load event at {load_event_ms} ms, {sum(settle.blocked.values())} requests blocked"
+                     + (", resource types intercepted by type" if intercepted else ""))
+        if reference is not None:
+            reference_seconds, reference_event_ms = reference
+            event_delta = (f"{load_event_ms - reference_event_ms:+.0f} ms"
+                           if load_event_ms is not None and reference_event_ms is not None else "unknown")
+            logging.info(f"Load profile delta against the unblocked reference: settled "
+                         f"{load_seconds - reference_seconds:+.2f}s ({reference_seconds:.2f}s unblocked), "
+                         f"load event {event_delta} ({reference_event_ms} ms unblocked)")
 
         # We only deal with PDF file
         for filename in os.listdir(args.download_dir):
@@ -631,24 +1243,22 @@ def main():
             if os.path.isfile(file_path):
                 os.remove(file_path)
 
-        download_files = []  # sorted(os.listdir(args.download_dir))
+        download_watcher = DownloadWatcher(driver_task, args.download_dir, settle)
+        pdf_answer_cache = PDFAnswerCache(args.pdf_cache_dir, max_bytes=args.pdf_cache_max_mb * 1024 ** 2,
+                                          read_only=args.pdf_cache_replay)
 
         fail_obs = ""  # When error execute the action
         pdf_obs = ""  # When download PDF file
         warn_obs = ""  # Type warning
         pattern = r'Thought:|Action:|Observation:'
-
-        # No need to maintain messages list in the OpenAI format
-        # Instead, we'll use Gemini's conversation
-        conversation = None
         
         obs_prompt = "Observation: please analyze the attached screenshot and give the Thought and Action. "
         if args.text_only:
             obs_prompt = "Observation: please analyze the accessibility tree and give the Thought and Action."
 
         # Search RAG and generate manual using either OpenAI (temporary) or Gemini
-        rag_results = search_rag(query=task['ques'], api_key=openai_key,
-                               logger=task_logger, org_id=args.api_organization_id)
+        rag_results = search_rag(query=task['ques'], retrieval_service=retrieval_service,
+                               logger=task_logger)
         
         # Use Gemini for manual generation
         manual = generate_instruction_manual_with_gemini(
@@ -701,22 +1311,49 @@ def main():
         - Always check if the expected result occurred after each action before proceeding
         """
         
-        init_msg = init_msg + obs_prompt
+        # Optionally cache the system prompt and the static task prefix (task, manual, guidelines) once,
+        # so that every step only sends its own observation
+        manual_cached = False
+        if args.context_cache:
+            conversation = create_gemini_session(args, genai_client)
+            manual_cached = conversation.cache_prefix(init_msg, ttl_seconds=args.context_cache_ttl)
+
+        init_msg = obs_prompt if manual_cached else init_msg + obs_prompt
+
+        # Optionally send only the observation changes between keyframes
+        if args.observation_diff:
+            observation_cache = ObservationCache(keyframe_interval=args.observation_keyframe_interval)
 
         it = 0
+        num_overlays = 0
+        observation = None
         accumulate_prompt_token = 0
         accumulate_completion_token = 0
 
+        step_start = None
+        model_seconds = 0.0
         while it < args.max_iter:
+            if step_start is not None:
+                step_seconds = time.time() - step_start
+                logging.info(f"Step {it} took {step_seconds:.2f}s: {model_seconds:.2f}s in the model call, "
+                             f"{step_seconds - model_seconds:.2f}s in the agent")
+            step_start = time.time()
             logging.info(f'Iter: {it}')
             it += 1
             if not fail_obs:
+                observation_start = time.time()
+                # Each artifact is only computed when something below asks for it
+                observation = Observation(driver_task, screenshot_writer, som_render=args.som_render,
+                                          fix_color=args.fix_box_color, screenshot_format=args.screenshot_format,
+                                          screenshot_max_side=args.screenshot_max_side,
+                                          screenshot_quality=args.screenshot_quality, cdp=cdp_channel,
+                                          needs_screenshot=not args.text_only or args.text_only_screenshots)
                 try:
                     if not args.text_only:
-                        rects, web_eles, web_eles_text = get_web_element_rect(driver_task, fix_color=args.fix_box_color)
+                        web_eles, web_eles_text = observation.elements
+                        num_overlays = observation.num_overlays
                     else:
-                        accessibility_tree_path = os.path.join(task_dir, 'accessibility_tree{}'.format(it))
-                        ac_tree, obs_info = get_webarena_accessibility_tree(driver_task, accessibility_tree_path)
+                        ac_tree, obs_info = observation.accessibility_tree
 
                 except Exception as e:
                     if not args.text_only:
@@ -726,22 +1363,36 @@ def main():
                     logging.error(e)
                     break
 
-                img_path = os.path.join(task_dir, 'screenshot{}.png'.format(it))
-                driver_task.save_screenshot(img_path)
-
-                # accessibility tree
-                if (not args.text_only) and args.save_accessibility_tree:
-                    accessibility_tree_path = os.path.join(task_dir, 'accessibility_tree{}'.format(it))
-                    get_webarena_accessibility_tree(driver_task, accessibility_tree_path)
-
                 # encode image
-                b64_img = encode_image(img_path)
+                if not args.text_only:
+                    b64_img, image_mime_type = observation.encoded_image
+
+                # Archival copies are written in the background while the model is called. Text-only runs only
+                # capture screenshots when asked to, e.g. for evaluation/auto_eval.py
+                if not args.text_only or args.text_only_screenshots:
+                    observation.archive_screenshot(os.path.join(task_dir, 'screenshot{}.png'.format(it)))
+                accessibility_tree_path = os.path.join(task_dir, 'accessibility_tree{}'.format(it))
+                if args.text_only or args.save_accessibility_tree:
+                    observation.archive_accessibility_tree(accessibility_tree_path)
+                logging.info(f"Observation built in {time.time() - observation_start:.2f}s")
+
+                obs_diff = None
+                if observation_cache is not None:
+                    if not args.text_only:
+                        obs_entries = element_entries(web_eles_text, web_eles)
+                        obs_diff = observation_cache.update(driver_task.current_url, obs_entries, web_eles_text)
+                    else:
+                        obs_entries = accessibility_tree_entries(ac_tree)
+                        obs_diff = observation_cache.update(driver_task.current_url, obs_entries, ac_tree)
 
                 # format msg for Gemini
                 if not args.text_only:
-                    curr_msg = format_msg_for_gemini(it, init_msg, pdf_obs, warn_obs, b64_img, web_eles_text)
+                    curr_msg = format_msg_for_gemini(it, init_msg, pdf_obs, warn_obs, b64_img, web_eles_text,
+                                                     include_manual=not manual_cached, obs_diff=obs_diff,
+                                                     image_mime_type=image_mime_type)
                 else:
-                    curr_msg = format_msg_text_only_for_gemini(it, init_msg, pdf_obs, warn_obs, ac_tree)
+                    curr_msg = format_msg_text_only_for_gemini(it, init_msg, pdf_obs, warn_obs, ac_tree,
+                                                               include_manual=not manual_cached, obs_diff=obs_diff)
             else:
                 curr_msg = {
                     'contents': [
@@ -754,9 +1405,11 @@ def main():
                 }
 
             # Call Gemini API
+            model_start = time.time()
             prompt_tokens, completion_tokens, api_call_error, response, conversation = call_gemini_api(
                 args, genai_client, curr_msg, conversation
             )
+            model_seconds = time.time() - model_start
 
             if api_call_error:
                 break
@@ -770,12 +1423,14 @@ def main():
             gemini_response = response.text
             logging.info(f"Gemini response: {gemini_response}")
             
+            if observation is not None:
+                observation.wait()
+
             # remove the rects on the website
-            if (not args.text_only) and rects:
-                logging.info(f"Num of interactive elements: {len(rects)}")
-                for rect_ele in rects:
-                    driver_task.execute_script("arguments[0].remove()", rect_ele)
-                rects = []
+            if (not args.text_only) and num_overlays:
+                logging.info(f"Num of interactive elements: {num_overlays}")
+                remove_som_overlays(driver_task)
+                num_overlays = 0
 
             # extract action info
             try:
@@ -811,27 +1466,23 @@ def main():
                     ele_tag_name = web_ele.tag_name.lower()
                     ele_type = web_ele.get_attribute("type")
 
-                    exec_action_click(info, web_ele, driver_task)
+                    exec_action_click(info, web_ele, driver_task, settle)
 
                     # deal with PDF file
-                    current_files = sorted(os.listdir(args.download_dir))
-                    if current_files != download_files:
-                        # wait for download finish
-                        time.sleep(10)
-                        current_files = sorted(os.listdir(args.download_dir))
-
-                        current_download_file = [pdf_file for pdf_file in current_files if pdf_file not in download_files and pdf_file.endswith('.pdf')]
-                        if current_download_file:
-                            pdf_file = current_download_file[0]
-                            pdf_obs = get_pdf_retrieval_ans_from_gemini(genai_client, os.path.join(args.download_dir, pdf_file), task['ques'])
-                            shutil.copy(os.path.join(args.download_dir, pdf_file), task_dir)
-                            pdf_obs = "You downloaded a PDF file, I ask the Assistant API to answer the task based on the PDF file and get the following response: " + pdf_obs
-                        download_files = current_files
+                    current_download_file = [path for path in download_watcher.collect(timeout=args.download_timeout)
+                                             if path.endswith('.pdf')]
+                    if current_download_file:
+                        pdf_path = current_download_file[0]
+                        pdf_obs = answer_downloaded_pdf(args, genai_client, download_service, pdf_path, task['ques'],
+                                                        os.path.join(task_dir, 'pdf_markdown'), pdf_answer_cache)
+                        shutil.copy(pdf_path, task_dir)
+                        pdf_obs = "You downloaded a PDF file, I ask the Assistant API to answer the task based on the PDF file and get the following response: " + pdf_obs
 
                     if ele_tag_name == 'button' and ele_type == 'submit':
-                        time.sleep(10)
+                        settle.wait('submit')
 
                 elif action_key == 'wait':
+                    # Explicitly asked for by the model, the only fixed delay of the loop
                     time.sleep(5)
 
                 elif action_key == 'type':
@@ -845,23 +1496,24 @@ def main():
                                             element_box[1] + element_box[3] // 2)
                         web_ele = driver_task.execute_script("return document.elementFromPoint(arguments[0], arguments[1]);", element_box_center[0], element_box_center[1])
 
-                    warn_obs = exec_action_type(info, web_ele, driver_task)
+                    warn_obs = exec_action_type(info, web_ele, driver_task, settle)
                     if 'wolfram' in task['web']:
-                        time.sleep(5)
+                        # Wolfram|Alpha computes the results after the query page settled; wait for them too
+                        settle.wait('wolfram results')
 
                 elif action_key == 'scroll':
                     if not args.text_only:
-                        exec_action_scroll(info, web_eles, driver_task, args, None)
+                        exec_action_scroll(info, web_eles, driver_task, args, None, settle)
                     else:
-                        exec_action_scroll(info, None, driver_task, args, obs_info)
+                        exec_action_scroll(info, None, driver_task, args, obs_info, settle)
 
                 elif action_key == 'goback':
                     driver_task.back()
-                    time.sleep(2)
+                    settle.wait('goback')
 
                 elif action_key == 'google':
                     driver_task.get('https://www.google.com/')
-                    time.sleep(2)
+                    settle.wait('google')
 
                 # This represents the end
                 elif action_key == 'answer':
@@ -879,11 +1531,309 @@ def main():
                     fail_obs = "The action you have chosen cannot be executed. Please double-check if you have selected the wrong Numerical Label or Action or Action format. Then provide the revised Thought and Action."
                 else:
                     fail_obs = ""
-                time.sleep(2)
+                # The failed action may still have started a navigation
+                settle.wait('action error')
+    except Exception:
+        driver_failed = True
+        raise
+    finally:
+        screenshot_writer.shutdown(wait=True)
+        settle.summary()
+        if observation_cache is not None:
+            logging.info(f"Observation diffs: {observation_cache.stats['keyframes']} keyframes, "
+                         f"{observation_cache.stats['diffs']} diffs, {observation_cache.stats['sent_chars']} of "
+                         f"{observation_cache.stats['full_chars']} observation characters sent")
+        if pdf_answer_cache is not None and pdf_answer_cache.hits + pdf_answer_cache.misses:
+            logging.info(f"PDF answer cache: {pdf_answer_cache.hits} hits, {pdf_answer_cache.misses} misses")
+        if conversation is not None:
+            conversation.close()
+        if llm_stats_start:
+            llm_stats = {key: value - llm_stats_start[key] for key, value in genai_client.stats.items()}
+            logging.info(f"LLM transport {args.llm_transport}: {llm_stats.pop('calls')} calls in "
+                         f"{llm_stats.pop('seconds'):.2f}s" + "".join(f", {v} {k}" for k, v in llm_stats.items()))
+        if cdp_channel is not None:
+            cdp_channel.close()
+        driver_pool.release(driver_task, discard=driver_failed, origins=settle.origins)
+    # Since Gemini might not provide token usage in the same format as OpenAI
+    logging.info(f'Task {task["id"]} completed')
+
+
+class TaskTracker:
+    """Task Tracker - records which tasks a worker process has started, so a crashed pool only charges those"""
+
+    def __init__(self):
+        self._started = set()
+        self._lock = threading.Lock()
+
+    def start(self, task_id):
+        """Called by a worker right before it runs the task"""
+        with self._lock:
+            self._started.add(task_id)
+
+    def started(self, task_id):
+        with self._lock:
+            return task_id in self._started
+
+    def reset(self):
+        with self._lock:
+            self._started.clear()
+
+
+class RetrievalManager(BaseManager):
+    """Serves the parent's RetrievalService to worker processes, so the embedding model is loaded once per run"""
+
+
+RetrievalManager.register('get_retrieval_service', exposed=('search', 'get_stats'))
+RetrievalManager.register('get_download_service', exposed=('search', 'get_stats', 'index_pdf'))
+RetrievalManager.register('get_task_tracker', exposed=('start',))
+
+# State of a worker process, filled in once by _init_worker
+_worker_state = {}
+
+
+def create_llm_client(args):
+    """Gemini client of the configured transport: live, recording to / replaying from a cassette, or a stub server."""
+    return create_client(args.api_key, mode=args.llm_transport, cassette_path=args.llm_cassette,
+                         stub_url=args.llm_stub_url, strict=not args.llm_replay_fallback)
+
+
+def _init_worker(args, retrieval_address, retrieval_authkey):
+    """Set up a worker process: its own download directory, Gemini client and Chrome driver pool."""
+    args = copy.copy(args)
+    args.download_dir = os.path.abspath(os.path.join(args.download_dir, f'worker_{os.getpid()}'))
+    os.makedirs(args.download_dir, exist_ok=True)
+
+    manager = RetrievalManager(address=retrieval_address, authkey=retrieval_authkey)
+    manager.connect()
+
+    _worker_state['args'] = args
+    _worker_state['retrieval_service'] = manager.get_retrieval_service()
+    _worker_state['download_service'] = manager.get_download_service()
+    _worker_state['task_tracker'] = manager.get_task_tracker()
+    _worker_state['genai_client'] = create_llm_client(args)
+    _worker_state['driver_pool'] = DriverPool(driver_config(args), max_tasks_per_driver=args.driver_max_tasks)
+    # Worker processes exit without running atexit handlers
+    multiprocessing.util.Finalize(None, _worker_state['driver_pool'].close, exitpriority=10)
+
+
+def _run_task_in_worker(task, result_dir):
+    """Run one task inside a worker process and report (task id, error message or None)."""
+    try:
+        _worker_state['task_tracker'].start(task['id'])
+        run_task(task, _worker_state['args'], _worker_state['genai_client'], _worker_state['driver_pool'],
+                 result_dir, _worker_state['retrieval_service'], _worker_state['download_service'])
+        return task['id'], None
+    except Exception as e:
+        logging.exception(f'Task {task["id"]} crashed')
+        return task['id'], f'{type(e).__name__}: {e}'
+
+
+def serve_retrieval_service(retrieval_service, download_service, task_tracker):
+    """Serve both retrieval services and the task tracker from a background thread of this process;
+    returns (address, authkey)."""
+    authkey = os.urandom(16)
+    RetrievalManager.register('get_retrieval_service', callable=lambda: retrieval_service,
+                              exposed=('search', 'get_stats'))
+    RetrievalManager.register('get_download_service', callable=lambda: download_service,
+                              exposed=('search', 'get_stats', 'index_pdf'))
+    RetrievalManager.register('get_task_tracker', callable=lambda: task_tracker, exposed=('start',))
+    manager = RetrievalManager(address=('127.0.0.1', 0), authkey=authkey)
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.address, authkey
+
+
+def run_tasks_in_workers(tasks, args, result_dir, retrieval_service, download_service, max_task_retries=1):
+    """
+    Run tasks concurrently across `args.workers` isolated worker processes.
+
+    Every worker owns its Chrome driver, download directory and per-task logger, and searches
+    through the parent's retrieval_service. An exception
+    inside a task is reported and the worker moves on; if a worker process dies, the pool is
+    rebuilt and the tasks that were still pending are resubmitted. Only tasks a worker had
+    started are charged an attempt (at most max_task_retries retries each); queued tasks are
+    resubmitted for free, unless no task had started, i.e. the workers failed to start.
+    """
+    mp_context = multiprocessing.get_context('spawn')
+    task_tracker = TaskTracker()
+    retrieval_address, retrieval_authkey = serve_retrieval_service(retrieval_service, download_service,
+                                                                   task_tracker)
+    attempts = {}
+    pending = list(tasks)
+    while pending:
+        retry = []
+        crashed = []
+        task_tracker.reset()
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=mp_context,
+                                 initializer=_init_worker,
+                                 initargs=(args, retrieval_address, retrieval_authkey)) as executor:
+            futures = {executor.submit(_run_task_in_worker, task, result_dir): task for task in pending}
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    task_id, error = future.result()
+                except BrokenProcessPool:
+                    crashed.append(task)
+                    continue
+
+                if error:
+                    logging.error(f'Task {task_id} failed: {error}')
+                else:
+                    logging.info(f'Task {task_id} finished')
+
+        started = [task for task in crashed if task_tracker.started(task['id'])]
+        for task in crashed:
+            if started and task not in started:
+                logging.warning(f'Task {task["id"]} had not started when a worker died, resubmitting')
+                retry.append(task)
+                continue
+            attempts[task['id']] = attempts.get(task['id'], 0) + 1
+            if attempts[task['id']] <= max_task_retries:
+                logging.error(f'Worker died while running task {task["id"]}, resubmitting')
+                retry.append(task)
+            else:
+                logging.error(f'Task {task["id"]} abandoned after {attempts[task["id"]]} worker crashes')
+        pending = retry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--test_file', type=str, default='data/test.json')
+    parser.add_argument('--max_iter', type=int, default=25)
+    parser.add_argument("--api_key", default="key", type=str, help="YOUR_GOOGLE_API_KEY")
+    parser.add_argument("--openai_api_key", default=None, type=str, help="YOUR_OPENAI_API_KEY (for PDF indexing)")
+    parser.add_argument("--api_organization_id", default=None, type=str, help="YOUR_OPENAI_ORGANIZATION_ID")
+    parser.add_argument("--api_model", default="gemini-1.5-pro-latest", type=str, help="Gemini model name")
+    parser.add_argument("--output_dir", type=str, default='results')
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max_attached_imgs", type=int, default=1)
+    parser.add_argument("--max_context_tokens", type=int, default=None,
+                        help="Estimated prompt token budget per call; the oldest steps are dropped to fit")
+    parser.add_argument("--context_cache", action='store_true',
+                        help="Cache the system prompt and task manual once per task instead of resending them")
+    parser.add_argument("--context_cache_ttl", type=int, default=3600)
+    parser.add_argument("--screenshot_format", type=str, default='png', choices=['png', 'jpeg', 'webp'],
+                        help="Image format sent to Gemini; archived screenshots are always PNG")
+    parser.add_argument("--screenshot_max_side", type=int, default=None,
+                        help="Downscale uploaded screenshots so that the longer side is at most this many pixels")
+    parser.add_argument("--screenshot_quality", type=int, default=85)
+    parser.add_argument("--observation_diff", action='store_true',
+                        help="Between keyframes, send only the elements added, removed or changed since the last step")
+    parser.add_argument("--observation_keyframe_interval", type=int, default=5)
+    parser.add_argument("--settle_timeout", type=float, default=10.0,
+                        help="Hard ceiling in seconds when waiting for a page to settle after an action")
+    parser.add_argument("--settle_quiet_ms", type=int, default=500,
+                        help="How long the DOM and network must stay quiet for a page to count as settled")
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--download_dir", type=str, default="downloads")
+    parser.add_argument("--text_only", action='store_true')
+    parser.add_argument("--text_only_screenshots", action='store_true',
+                        help='Still archive a screenshot per step with --text_only, e.g. for evaluation')
+    parser.add_argument("--workers", type=int, default=1, help='Number of tasks to run concurrently, each in its own process')
+    # for web browser
+    parser.add_argument("--headless", action='store_true', help='The window of selenium')
+    parser.add_argument("--save_accessibility_tree", action='store_true')
+    parser.add_argument("--force_device_scale", action='store_true')
+    parser.add_argument("--window_width", type=int, default=1024)
+    parser.add_argument("--window_height", type=int, default=768)  # for headless mode, there is no address bar
+    parser.add_argument("--fix_box_color", action='store_true')
+    parser.add_argument("--cdp_websocket", action='store_true',
+                        help='Fetch screenshots and accessibility trees over the DevTools websocket (needs websocket-client)')
+    parser.add_argument("--load_profile", type=str, default='none', choices=['none', 'fast'],
+                        help='fast: block ads, trackers, fonts and media (and images with --text_only)')
+    parser.add_argument("--block_domains_file", type=str, default=None,
+                        help='Extra domains blocked by the load profile, one per line')
+    parser.add_argument("--load_profile_compare", action='store_true',
+                        help='Also load each start page unblocked (both from a cold cache) and log the difference')
+    parser.add_argument("--block_resource_types", nargs='*', default=None, choices=list(RESOURCE_TYPE_URL_PATTERNS),
+                        help='Resource types blocked by the load profile, overriding its defaults')
+    parser.add_argument("--som_render", type=str, default='page', choices=['page', 'screenshot'],
+                        help='Draw the set-of-mark labels into the page DOM, or onto the screenshot with Pillow')
+    parser.add_argument("--driver_max_tasks", type=int, default=10,
+                        help='Tasks run on one Chrome (reset in between) before it is restarted; 1 = fresh Chrome per task')
+    parser.add_argument("--group_by_site", action='store_true',
+                        help='Run tasks of the same web_name back to back for browser cache locality')
+
+    parser.add_argument("--pdf_path", type=str, nargs='+', default=['data/arXiv.pdf'], help='One or more PDF manuals to index')
+    parser.add_argument("--embedding_batch_size", type=int, default=32, help='Chunks encoded per batch when indexing')
+    parser.add_argument("--embedding_threads", type=int, default=None, help='Torch CPU threads used when indexing')
+    parser.add_argument("--pdf_answer_mode", type=str, default='rag', choices=['rag', 'inline'],
+                        help='Answer from the relevant chunks of a downloaded PDF (rag) or upload the whole file (inline)')
+    parser.add_argument("--download_index_dir", type=str, default='./chroma_db_downloads',
+                        help='Vector store for PDFs downloaded during tasks')
+    parser.add_argument("--pdf_cache_dir", type=str, default='./pdf_answer_cache',
+                        help='On-disk cache of answers about downloaded PDFs')
+    parser.add_argument("--pdf_cache_max_mb", type=int, default=200)
+    parser.add_argument("--pdf_cache_replay", action='store_true',
+                        help='Only use recorded PDF answers, never call Gemini for them (offline reproduction)')
+    parser.add_argument("--llm_transport", type=str, default='live', choices=TRANSPORT_MODES,
+                        help='live Gemini, record responses to --llm_cassette, replay them, or ask --llm_stub_url')
+    parser.add_argument("--llm_cassette", type=str, default=None, help='JSONL cassette of recorded Gemini responses')
+    parser.add_argument("--llm_replay_fallback", action='store_true',
+                        help='Answer unrecorded requests with the next unused recording instead of failing')
+    parser.add_argument("--llm_stub_url", type=str, default='http://127.0.0.1:8765')
+    parser.add_argument("--download_timeout", type=float, default=30.0,
+                        help='Hard ceiling in seconds when waiting for a download to finish')
+    args = parser.parse_args()
+    if args.llm_transport in ('record', 'replay') and not args.llm_cassette:
+        parser.error(f"--llm_transport {args.llm_transport} requires --llm_cassette")
+
+    # Configure Google Generative AI
+    genai_client = create_llm_client(args)
+
+    options = driver_config(args)
 
-        driver_task.quit()
-        # Since Gemini might not provide token usage in the same format as OpenAI
-        logging.info(f'Task {task["id"]} completed')
+    # Save Result file
+    current_time = time.strftime("%Y%m%d_%H_%M_%S", time.localtime())
+    result_dir = os.path.join(args.output_dir, current_time)
+    os.makedirs(result_dir, exist_ok=True)
+
+    # Load tasks
+    tasks = []
+    with open(args.test_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            tasks.append(json.loads(line))
+    if args.group_by_site:
+        # Stable: tasks keep their order within a site, sites are ordered by first appearance
+        site_order = {}
+        for task in tasks:
+            site_order.setdefault(task.get('web_name', task['web']), len(site_order))
+        tasks.sort(key=lambda task: site_order[task.get('web_name', task['web'])])
+
+    init_dir = os.path.join(result_dir, 'init')
+    os.makedirs(init_dir, exist_ok=True)
+    init_logger = setup_logger(init_dir)
+    markdown_output_dir = "output"
+    
+    # For PDF indexing, we might still need OpenAI temporarily
+    # (or adapt PDFEnhancementPipeline to use Gemini)
+    if args.openai_api_key:
+        openai_key = args.openai_api_key
+    else:
+        # Fallback to using the same key for everything
+        openai_key = args.api_key
+    
+    # One retrieval service (embedding model, vector store, Gemini client) for the whole run
+    retrieval_service = get_retrieval_service(gemini_api_key=openai_key, logger=init_logger,
+                                              gemini_client=genai_client)
+    index_pdfs(pdf_paths=args.pdf_path, output_dir=markdown_output_dir, api_key=openai_key,
+               logger=init_logger, org_id=args.api_organization_id, retrieval_service=retrieval_service,
+               embedding_batch_size=args.embedding_batch_size, embedding_threads=args.embedding_threads)
+    init_logger.info(f"Retrieval service stats: {retrieval_service.get_stats()}")
+    # PDFs downloaded during tasks are indexed into their own vector store, with the same embedding model
+    download_service = get_retrieval_service(gemini_api_key=openai_key, logger=init_logger,
+                                             persist_directory=args.download_index_dir, gemini_client=genai_client,
+                                             embeddings_service=retrieval_service)
+
+    if args.workers > 1:
+        run_tasks_in_workers(tasks, args, result_dir, retrieval_service, download_service)
+    else:
+        driver_pool = DriverPool(options, max_tasks_per_driver=args.driver_max_tasks)
+        try:
+            for task in tasks:
+                run_task(task, args, genai_client, driver_pool, result_dir, retrieval_service, download_service)
+        finally:
+            driver_pool.close()
 
 
 if __name__ == '__main__':
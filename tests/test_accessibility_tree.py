@@ -0,0 +1,215 @@
+"""Golden-output tests: the iterative serializer must match the original recursive implementation"""
+import copy
+import random
+import re
+import sys
+
+import pytest
+
+from utils_webarena import IGNORED_ACTREE_PROPERTIES, parse_accessibility_tree, serialize_accessibility_tree, \
+    clean_accesibility_tree
+
+
+def reference_parse_accessibility_tree(accessibility_tree):
+    """parse_accessibility_tree as it was before the iterative rewrite"""
+    node_id_to_idx = {}
+    for idx, node in enumerate(accessibility_tree):
+        node_id_to_idx[node["nodeId"]] = idx
+
+    obs_nodes_info = {}
+
+    def dfs(idx, obs_node_id, depth):
+        tree_str = ""
+        node = accessibility_tree[idx]
+        indent = "\t" * depth
+        valid_node = True
+        try:
+            role = node["role"]["value"]
+            name = node["name"]["value"]
+            node_str = f"[{obs_node_id}] {role} {repr(name)}"
+            properties = []
+            for property in node.get("properties", []):
+                try:
+                    if property["name"] in IGNORED_ACTREE_PROPERTIES:
+                        continue
+                    properties.append(
+                        f'{property["name"]}: {property["value"]["value"]}'
+                    )
+                except KeyError:
+                    pass
+
+            if properties:
+                node_str += " " + " ".join(properties)
+
+            if not node_str.strip():
+                valid_node = False
+
+            if not name.strip():
+                if not properties:
+                    if role in ["generic", "img", "list", "strong", "paragraph", "banner", "navigation", "Section",
+                                "LabelText", "Legend", "listitem"]:
+                        valid_node = False
+                elif role in ["listitem"]:
+                    valid_node = False
+
+            if valid_node:
+                tree_str += f"{indent}{node_str}"
+                obs_nodes_info[obs_node_id] = {
+                    "backend_id": node["backendDOMNodeId"],
+                    "union_bound": node["union_bound"],
+                    "text": node_str,
+                }
+
+        except:
+            valid_node = False
+
+        for _, child_node_id in enumerate(node["childIds"]):
+            if child_node_id not in node_id_to_idx:
+                continue
+            child_depth = depth + 1 if valid_node else depth
+            child_str = dfs(node_id_to_idx[child_node_id], child_node_id, child_depth)
+            if child_str.strip():
+                if tree_str.strip():
+                    tree_str += "\n"
+                tree_str += child_str
+
+        return tree_str
+
+    tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+    return tree_str, obs_nodes_info
+
+
+def reference_clean_accesibility_tree(tree_str):
+    """clean_accesibility_tree as it was before the single-pass rewrite"""
+    clean_lines = []
+    for line in tree_str.split("\n"):
+        if "statictext" in line.lower():
+            prev_lines = clean_lines[-3:]
+            pattern = r"\[\d+\] StaticText '([^']+)'"
+
+            match = re.search(pattern, line)
+            if match:
+                static_text = match.group(1)
+                if all(static_text not in prev_line for prev_line in prev_lines):
+                    clean_lines.append(line)
+        else:
+            clean_lines.append(line)
+
+    return "\n".join(clean_lines)
+
+
+def node(node_id, role, name=None, children=(), backend_id=True, properties=None):
+    result = {"nodeId": str(node_id), "role": {"value": role}, "childIds": [str(c) for c in children],
+              "union_bound": [0.0, 0.0, 10.0, 10.0]}
+    if name is not None:
+        result["name"] = {"value": name}
+    if backend_id:
+        result["backendDOMNodeId"] = int(node_id) + 100
+    if properties is not None:
+        result["properties"] = properties
+    return result
+
+
+QUOTES_TREE = [
+    node(0, "RootWebArea", "Quotes", [1, 2, 3, 4]),
+    node(1, "heading", "It's \"quoted\"", [5]),
+    node(5, "StaticText", "It's \"quoted\""),
+    node(2, "link", 'say "hi"', [6]),
+    node(6, "StaticText", 'say "hi"'),
+    node(3, "StaticText", "don't"),
+    node(4, "StaticText", "don't"),
+]
+
+NEWLINES_TREE = [
+    node(0, "RootWebArea", "Newlines", [1, 2, 3]),
+    node(1, "textbox", "line one\nline two", [4],
+         properties=[{"name": "valuetext", "value": {"value": "a\n[9] StaticText 'a'"}},
+                     {"name": "focusable", "value": {"value": True}}]),
+    node(4, "StaticText", "line one\nline two"),
+    node(2, "StaticText", "a"),
+    node(3, "button", "ok\n", [7]),
+    node(7, "StaticText", "ok"),
+]
+
+MISSING_BACKEND_IDS_TREE = [
+    node(0, "RootWebArea", "Missing ids", [1, 2, 3, "absent"]),
+    node(1, "link", "no backend id", [4], backend_id=False),
+    node(4, "StaticText", "no backend id", backend_id=False),
+    node(2, "generic", "", [5]),
+    node(5, "button", "Buy"),
+    node(3, "listitem", "", [6], properties=[{"name": "level", "value": {"value": 1}}, {"name": "broken"}]),
+    node(6, "StaticText", "item", backend_id=False),
+]
+
+
+def deep_chain(depth=5000):
+    nodes = [node(0, "RootWebArea", "Deep", [1])]
+    for i in range(1, depth):
+        role = ["generic", "link", "StaticText", "group"][i % 4]
+        nodes.append(node(i, role, "" if role == "generic" else f"level {i % 7}", [i + 1] if i + 1 < depth else []))
+    return nodes
+
+
+def random_tree(size, seed):
+    rnd = random.Random(seed)
+    nodes = [node(0, "RootWebArea", "root")]
+    for i in range(1, size):
+        nodes[rnd.randrange(i)]["childIds"].append(str(i))
+        properties = None
+        if rnd.random() < 0.3:
+            properties = [{"name": rnd.choice(["focusable", "url", "valuetext"]),
+                           "value": {"value": rnd.choice(["a", "b\n[3] StaticText 'abc'", "abc"])}},
+                          {"name": "bad"}]
+        name = rnd.choice(["", "abc", "abc def", "it's", "x\ny", "StaticText 'abc'"]) if rnd.random() < 0.95 else None
+        nodes.append(node(i, rnd.choice(["generic", "link", "StaticText", "button", "listitem", "statictextish"]),
+                          name, backend_id=rnd.random() < 0.9, properties=properties))
+        if rnd.random() < 0.05:
+            nodes[-1]["childIds"].append("missing")
+    if seed % 2:
+        nodes = [nodes[0]] + rnd.sample(nodes[1:], size - 1)
+    return nodes
+
+
+def reference(tree):
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 3 * len(tree) + 1000))
+    try:
+        content, obs_nodes_info = reference_parse_accessibility_tree(copy.deepcopy(tree))
+    finally:
+        sys.setrecursionlimit(limit)
+    return content, obs_nodes_info, reference_clean_accesibility_tree(content)
+
+
+FIXTURES = {
+    "quotes": QUOTES_TREE,
+    "newlines": NEWLINES_TREE,
+    "missing_backend_ids": MISSING_BACKEND_IDS_TREE,
+    "deep_chain": deep_chain(),
+}
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_matches_reference_on_fixtures(name):
+    tree = FIXTURES[name]
+    content, obs_nodes_info, cleaned = reference(tree)
+
+    assert parse_accessibility_tree(copy.deepcopy(tree)) == (content, obs_nodes_info)
+    assert clean_accesibility_tree(content) == cleaned
+    serialized, serialized_info = serialize_accessibility_tree(copy.deepcopy(tree))
+    assert serialized == cleaned
+    assert serialized_info == obs_nodes_info
+    assert list(serialized_info) == list(obs_nodes_info)
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_matches_reference_on_random_trees(seed):
+    tree = random_tree(200, seed)
+    content, obs_nodes_info, cleaned = reference(tree)
+
+    assert serialize_accessibility_tree(copy.deepcopy(tree)) == (cleaned, obs_nodes_info)
+
+
+def test_deep_chain_does_not_hit_the_recursion_limit():
+    tree = deep_chain(3 * sys.getrecursionlimit())
+    content, _ = serialize_accessibility_tree(tree)
+    assert content.count("\n") > sys.getrecursionlimit()
@@ -0,0 +1,79 @@
+import json
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+import cdp_client
+from cdp_client import CDPChannel, CDPError
+
+
+class FakeWebSocket:
+    """Answers every command through recv(); close() or drop() ends the connection"""
+
+    def __init__(self):
+        self.sent = []
+        self.incoming = queue.Queue()
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, payload):
+        command = json.loads(payload)
+        self.sent.append(command)
+        if command["method"] == "Broken.command":
+            self.incoming.put({"id": command["id"], "error": {"message": "not found"}})
+        elif command["method"] != "Never.answered":
+            self.incoming.put({"id": command["id"], "result": {"method": command["method"]}})
+
+    def recv(self):
+        message = self.incoming.get()
+        if isinstance(message, Exception):
+            raise message
+        return json.dumps(message)
+
+    def drop(self):
+        self.incoming.put(ConnectionError("connection reset"))
+
+    def close(self):
+        self.drop()
+
+
+@pytest.fixture
+def channel(monkeypatch):
+    ws = FakeWebSocket()
+    monkeypatch.setattr(cdp_client, "websocket", SimpleNamespace(create_connection=lambda *args, **kwargs: ws))
+    channel = CDPChannel(driver=None, websocket_url="ws://fake", timeout=5)
+    yield channel, ws
+    channel.close()
+
+
+def test_results_come_back_in_command_order(channel):
+    channel, _ = channel
+    results = channel.execute_many([("A.one", {}), ("B.two", {})])
+    assert [result["method"] for result in results] == ["A.one", "B.two"]
+
+    with pytest.raises(CDPError):
+        channel.execute_cdp_cmd("Broken.command")
+
+
+def test_connection_loss_fails_pending_and_later_commands_at_once(channel):
+    channel, ws = channel
+    pending = channel.send("Never.answered")
+    ws.drop()
+
+    with pytest.raises(ConnectionError):
+        pending.result(timeout=1)
+    # Registered after the reader failed: must not wait for the command timeout
+    later = channel.send("A.one")
+    assert later.done()
+    with pytest.raises(ConnectionError):
+        later.result(timeout=0)
+
+
+def test_events_reach_their_handlers(channel):
+    channel, ws = channel
+    events = queue.Queue()
+    channel.on("Fetch.requestPaused", events.put)
+    ws.incoming.put({"method": "Fetch.requestPaused", "params": {"requestId": "r1"}})
+    assert events.get(timeout=1) == {"requestId": "r1"}
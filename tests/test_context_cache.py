@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+from gemini_session import CHARS_PER_TOKEN, ConversationHistory, GeminiSession
+
+SYSTEM_PROMPT = "You are a web agent. " * 200
+MANUAL = "[Manuals and QA pairs]\n" + "Step 1: open the menu. Step 2: pick the option. " * 100
+INIT_MSG = f"Now given a task: find the price.\n{MANUAL}\n\nIMPORTANT: follow the manual.\n"
+CACHED_MANUAL = "[Manuals and QA pairs] (Provided at the start of the conversation)"
+
+
+def tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+
+class StubCaches:
+    """Fake caches.create that remembers the cached prefix"""
+
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+
+    def create(self, model, config):
+        prefix = config.contents[0].parts[0].text
+        self.created.append({"system_instruction": config.system_instruction, "prefix": prefix})
+        total = tokens(config.system_instruction) + tokens(prefix)
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}",
+                               usage_metadata=SimpleNamespace(total_token_count=total))
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+class StubModels:
+    """Fake generate_content reporting token usage like the API: cached tokens count toward the prompt"""
+
+    def __init__(self, caches):
+        self.caches = caches
+        self.requests = []
+
+    def generate_content(self, model, contents, config=None):
+        texts = [part["text"] for turn in contents for part in turn["parts"] if "text" in part]
+        self.requests.append({"texts": texts, "config": config})
+        sent = sum(tokens(text) for text in texts)
+        cached = 0
+        if config.cached_content is not None:
+            cache = self.caches.created[int(config.cached_content.split("/")[1]) - 1]
+            cached = tokens(cache["system_instruction"]) + tokens(cache["prefix"])
+        else:
+            sent += tokens(config.system_instruction)
+        usage = SimpleNamespace(prompt_token_count=sent + cached, cached_content_token_count=cached,
+                                candidates_token_count=10)
+        return SimpleNamespace(text="Thought: ok\nAction: Wait", usage_metadata=usage)
+
+
+def step_text(step, manual_text):
+    """User message of a step, laid out like format_msg_text_only_for_gemini"""
+    return (f"Observation: please analyze the accessibility tree and give the Thought and Action.\n"
+            f"[{step}] link 'Result {step}'\n\n{manual_text}\n\nREMINDER: Continue following the manual.")
+
+
+def run_task(context_cache, steps=6):
+    caches = StubCaches()
+    models = StubModels(caches)
+    session = GeminiSession(SimpleNamespace(models=models, caches=caches), "stub-model", SYSTEM_PROMPT,
+                            ConversationHistory(max_images=1, text_only=True))
+    manual_cached = context_cache and session.cache_prefix(INIT_MSG)
+    first = "Observation: please analyze the accessibility tree.\n[1] link 'Home'"
+    if not manual_cached:
+        first = INIT_MSG + first
+    session.send([{"text": first}], observation_start=first.find("Observation:"), keyframe=True)
+    for step in range(2, steps + 1):
+        text = step_text(step, CACHED_MANUAL if manual_cached else MANUAL)
+        session.send([{"text": text}], observation_start=0, keyframe=True)
+    session.close()
+    return session, models, caches
+
+
+def test_manual_is_sent_once_with_context_cache():
+    session, models, caches = run_task(context_cache=True)
+
+    assert len(caches.created) == 1
+    assert MANUAL in caches.created[0]["prefix"]
+    assert caches.created[0]["system_instruction"] == SYSTEM_PROMPT
+    for request in models.requests:
+        assert request["config"].cached_content == "cachedContents/1"
+        assert request["config"].system_instruction is None
+        assert not any(MANUAL in text for text in request["texts"])
+    assert caches.deleted == ["cachedContents/1"]
+
+
+def test_context_cache_token_savings():
+    cached_session, _, _ = run_task(context_cache=True)
+    plain_session, _, _ = run_task(context_cache=False)
+
+    uncached_with_cache = cached_session.usage["prompt_tokens"] - cached_session.usage["cached_tokens"]
+    uncached_without_cache = plain_session.usage["prompt_tokens"]
+    assert cached_session.usage["cached_tokens"] > 0
+    # The manual dominates the prompt, so caching it cuts the uncached prompt tokens at least fivefold
+    assert uncached_with_cache < uncached_without_cache / 5
+
+
+def test_falls_back_when_the_cache_cannot_be_created():
+    class FailingCaches(StubCaches):
+        def create(self, model, config):
+            raise RuntimeError("content below the minimum cache size")
+
+    caches = FailingCaches()
+    models = StubModels(caches)
+    session = GeminiSession(SimpleNamespace(models=models, caches=caches), "stub-model", SYSTEM_PROMPT,
+                            ConversationHistory(max_images=1, text_only=True))
+
+    assert session.cache_prefix(INIT_MSG) is False
+    session.send([{"text": INIT_MSG + "Observation: [1] link 'Home'"}], observation_start=len(INIT_MSG))
+    assert models.requests[0]["config"].system_instruction == SYSTEM_PROMPT
+    assert models.requests[0]["config"].cached_content is None
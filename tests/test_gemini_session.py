@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pytest
+
+from gemini_session import ConversationHistory, GeminiSession
+
+
+class StubModels:
+    """Counts generate_content calls and records their arguments"""
+
+    def __init__(self, fail_first=False):
+        self.calls = []
+        self.fail_first = fail_first
+
+    def generate_content(self, model, contents, config=None):
+        self.calls.append({"model": model, "contents": contents, "config": config})
+        if self.fail_first and len(self.calls) == 1:
+            raise RuntimeError("server error")
+        return SimpleNamespace(text=f"Thought: step {len(self.calls)}\nAction: Wait", usage_metadata=None)
+
+
+def make_session(models, max_images=1):
+    client = SimpleNamespace(models=models)
+    return GeminiSession(client, "stub-model", "SYSTEM PROMPT", ConversationHistory(max_images=max_images))
+
+
+def user_parts(text, image=b"png"):
+    return [{"text": text}, {"inline_data": {"mime_type": "image/png", "data": image}}]
+
+
+def test_first_step_makes_exactly_one_call():
+    models = StubModels()
+    session = make_session(models)
+
+    session.send(user_parts("Task... Observation: first page"), observation_start=8, keyframe=True)
+
+    assert len(models.calls) == 1
+    assert session.num_calls == 1
+    # The system instruction travels in the config, not as a conversation turn
+    assert models.calls[0]["config"].system_instruction == "SYSTEM PROMPT"
+    assert [turn["role"] for turn in models.calls[0]["contents"]] == ["user"]
+
+
+def test_one_call_per_step():
+    models = StubModels()
+    session = make_session(models)
+
+    session.send(user_parts("Task: find the price. Observation: page 0"), observation_start=21, keyframe=True)
+    for step in range(1, 5):
+        session.send(user_parts(f"Observation: page {step}"), observation_start=0, keyframe=True)
+        assert len(models.calls) == step + 1
+
+    # Each request carries the whole exchange so far, with the first user message sent only once
+    last_contents = models.calls[-1]["contents"]
+    assert [turn["role"] for turn in last_contents] == ["user", "model"] * 4 + ["user"]
+    texts = [part["text"] for turn in last_contents for part in turn["parts"] if "text" in part]
+    assert sum("Task: find the price." in text for text in texts) == 1
+
+
+def test_old_screenshots_are_dropped():
+    models = StubModels()
+    session = make_session(models, max_images=1)
+
+    for step in range(3):
+        session.send(user_parts(f"Observation: page {step}"), observation_start=0, keyframe=True)
+
+    images = [part for turn in models.calls[-1]["contents"] for part in turn["parts"] if "inline_data" in part]
+    assert len(images) == 1
+
+
+def test_failed_call_is_not_recorded():
+    models = StubModels(fail_first=True)
+    session = make_session(models)
+
+    with pytest.raises(RuntimeError):
+        session.send(user_parts("Observation: first page"), observation_start=0, keyframe=True)
+    assert session.history.turns == []
+
+    # The retried step is sent once, not duplicated in the history
+    session.send(user_parts("Observation: first page"), observation_start=0, keyframe=True)
+    assert len(models.calls) == 2
+    assert [turn["role"] for turn in models.calls[-1]["contents"]] == ["user"]
@@ -0,0 +1,49 @@
+"""The layout index must give the same viewport boxes as getBoundingClientRect"""
+import copy
+
+from utils_webarena import build_layout_index, fetch_page_accessibility_tree, make_browser_info
+
+# A 1024px wide window with a 15px scrollbar: documentElement is 1009px wide, so the
+# calibration factor documentElement width / outerWidth is not 1
+METRICS = {"pageXOffset": 0, "pageYOffset": 800, "screenWidth": 1024, "screenHeight": 768, "outerWidth": 1024,
+           "devicePixelRatio": 1.0}
+
+# Document coordinates of each backend node, and what getBoundingClientRect returns for it at pageYOffset 800
+DOCUMENT_BOUNDS = {1: [0, 0, 1009, 5000], 2: [100, 900, 50, 20], 3: [900, 1500, 100, 30], 4: [10, 1590, 200, 40]}
+CLIENT_RECTS = {2: [100, 100, 50, 20], 3: [900, 700, 100, 30], 4: [10, 790, 200, 40]}
+
+
+def snapshot():
+    backend_node_ids = [1, 2, 3, 4, 5]  # 5 has no layout
+    return {"documents": [{"nodes": {"backendNodeId": backend_node_ids},
+                           "layout": {"nodeIndex": [0, 1, 2, 3],
+                                      "bounds": [DOCUMENT_BOUNDS[i] for i in (1, 2, 3, 4)]}}],
+            "strings": []}
+
+
+def test_layout_index_matches_client_rects_when_calibration_is_not_one():
+    info = make_browser_info(snapshot(), METRICS)
+    assert info["DOMTree"]["documents"][0]["layout"]["bounds"][0][2] != 1009  # calibrated
+
+    layout_index, snapshot_node_ids = build_layout_index(info)
+
+    for backend_node_id, rect in CLIENT_RECTS.items():
+        assert layout_index[backend_node_id] == rect
+    assert 5 in snapshot_node_ids and 5 not in layout_index
+
+
+def test_viewport_pruning_uses_client_rects():
+    nodes = [{"nodeId": "1", "role": {"value": "RootWebArea"}, "childIds": ["2", "3", "4", "5"],
+              "backendDOMNodeId": 1}]
+    for i in (2, 3, 4, 5):
+        nodes.append({"nodeId": str(i), "parentId": "1", "role": {"value": "link"}, "childIds": [],
+                      "backendDOMNodeId": i})
+    info = make_browser_info(snapshot(), METRICS)
+
+    bounded = fetch_page_accessibility_tree(info, None, current_viewport_only=False, nodes=copy.deepcopy(nodes))
+    assert [node["union_bound"] for node in bounded[1:]] == [CLIENT_RECTS[2], CLIENT_RECTS[3], CLIENT_RECTS[4],
+                                                             [0.0, 0.0, 0.0, 0.0]]
+
+    # node 4 starts below the 768px viewport
+    pruned = fetch_page_accessibility_tree(info, None, current_viewport_only=True, nodes=copy.deepcopy(nodes))
+    assert [node["nodeId"] for node in pruned] == ["1", "2", "3"]
@@ -0,0 +1,93 @@
+import logging
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from llm_transport import CassetteMiss, DEFAULT_STUB_REPLY, RecordingClient, ReplayClient, StubClient, \
+    make_response, make_stub_server, request_key
+
+
+class LiveModels:
+    """Stands in for the live Gemini API: numbered replies with token counts"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        return make_response(f"Thought: reply {self.calls}\nAction: Wait",
+                             {"prompt_token_count": 100 * self.calls, "candidates_token_count": 10})
+
+
+def step(text, screenshot=b"\x89PNG first run", date="2026-10-18"):
+    return [{"role": "user", "parts": [{"text": f"Today is {date}. {text}"},
+                                       {"inline_data": {"mime_type": "image/png", "data": screenshot}}]}]
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    live = SimpleNamespace(models=LiveModels(), caches=None)
+    recorder = RecordingClient(live, str(tmp_path / "cassette.jsonl"))
+    replies = [recorder.models.generate_content(model="m", contents=step(f"Observation {i}")).text
+               for i in range(3)]
+    # The same request twice, answered differently
+    replies.append(recorder.models.generate_content(model="m", contents=step("Observation 0")).text)
+    assert recorder.stats["calls"] == 4
+    return str(tmp_path / "cassette.jsonl"), replies
+
+
+def test_replay_round_trip_ignores_screenshots_and_dates(cassette):
+    path, replies = cassette
+    replay = ReplayClient(path)
+
+    # A later run: other screenshot bytes and another date, same prompts
+    replayed = [replay.models.generate_content(model="m", contents=step(f"Observation {i}", b"other", "2027-01-01"))
+                for i in (0, 1, 2, 0)]
+
+    assert [response.text for response in replayed] == replies
+    assert replayed[0].usage_metadata.prompt_token_count == 100
+    assert replay.stats["hits"] == 4 and replay.stats["misses"] == 0 and replay.stats["calls"] == 4
+
+
+def test_replay_is_strict_by_default(cassette):
+    path, _ = cassette
+    replay = ReplayClient(path)
+
+    with pytest.raises(CassetteMiss):
+        replay.models.generate_content(model="m", contents=step("An observation that was never recorded"))
+    assert replay.stats["misses"] == 1
+
+
+def test_replay_fallback_is_logged(cassette, caplog):
+    path, replies = cassette
+    replay = ReplayClient(path, strict=False)
+
+    with caplog.at_level(logging.WARNING):
+        response = replay.models.generate_content(model="m", contents=step("An observation that was never recorded"))
+
+    assert response.text == replies[0]
+    assert replay.stats["fallbacks"] == 1
+    assert "was not recorded" in caplog.text
+
+
+def test_stub_server_answers_from_the_cassette(cassette):
+    path, replies = cassette
+    server = make_stub_server(0, cassette_path=path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        stub = StubClient(f"http://127.0.0.1:{server.server_address[1]}")
+        recorded = stub.models.generate_content(model="m", contents=step("Observation 2", b"other"))
+        unrecorded = stub.models.generate_content(model="m", contents=step("Something else"))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert recorded.text == replies[2]
+    assert unrecorded.text == DEFAULT_STUB_REPLY
+    assert stub.stats["calls"] == 2
+
+
+def test_request_key_keeps_the_prompt():
+    assert request_key("m", step("Observation 0")) != request_key("m", step("Observation 1"))
+    assert request_key("m", step("Observation 0")) != request_key("other", step("Observation 0"))
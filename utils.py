@@ -1,13 +1,16 @@
 import base64
+import io
 import re
 import os
 import json
 import time
+import random
 import logging
 import numpy as np
-from PIL import Image
-from utils_webarena import fetch_browser_info, fetch_page_accessibility_tree,\
-                    parse_accessibility_tree, clean_accesibility_tree
+from functools import cached_property
+from PIL import Image, ImageDraw, ImageFont
+from utils_webarena import fetch_browser_info, fetch_observation_data, fetch_page_accessibility_tree,\
+                    serialize_accessibility_tree
 
 
 def resize_image(image_path):
@@ -35,8 +38,107 @@ def encode_image(image_path):
         return base64.b64encode(image_file.read()).decode('utf-8')
 
 
+def encode_screenshot(png_bytes, image_format="png", max_side=None, quality=85):
+    """
+    Downscale and re-encode a screenshot in memory for upload
+
+    Args:
+        png_bytes (bytes): Screenshot as returned by get_screenshot_as_png.
+        image_format (str): Upload format: png, jpeg or webp.
+        max_side (Optional[int]): Downscale so that the longer side is at most this many pixels.
+        quality (int): JPEG/WebP quality.
+
+    Returns:
+        Tuple[str, str]: Base64-encoded image and its mime type.
+    """
+    if image_format == "png" and not max_side:
+        return base64.b64encode(png_bytes).decode('utf-8'), "image/png"
+
+    image = Image.open(io.BytesIO(png_bytes))
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    save_kwargs = {}
+    if image_format == "jpeg":
+        image = image.convert("RGB")
+        save_kwargs["quality"] = quality
+    elif image_format == "webp":
+        save_kwargs["quality"] = quality
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper(), **save_kwargs)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8'), f"image/{image_format}"
+
+
+def write_screenshot(path, png_bytes):
+    """Archive a screenshot; run on a background thread so that the agent step does not wait for the disk"""
+    try:
+        with open(path, "wb") as f:
+            f.write(png_bytes)
+    except OSError as e:
+        logging.error(f"Failed to save screenshot {path}: {e}")
+
+
+# Attribute shared by every injected set-of-mark overlay, so that all of them can be found and removed at once
+SOM_OVERLAY_ATTRIBUTE = "data-webvoyager-som"
+
+REMOVE_OVERLAYS_SCRIPT = """
+    var overlays = document.querySelectorAll("[SOM_OVERLAY_ATTRIBUTE]");
+    overlays.forEach(overlay => overlay.remove());
+    return overlays.length;
+""".replace("SOM_OVERLAY_ATTRIBUTE", SOM_OVERLAY_ATTRIBUTE)
+
+
+def remove_som_overlays(browser):
+    """
+    Remove all set-of-mark overlays from the page in one WebDriver call
+
+    Args:
+        browser: Selenium driver.
+
+    Returns:
+        int: Number of overlays removed.
+    """
+    start = time.time()
+    removed = browser.execute_script(REMOVE_OVERLAYS_SCRIPT)
+    logging.info(f"Removed {removed} overlays in {time.time() - start:.2f}s")
+    return removed
+
+
 # interact with webpage and add rectangles on elements
 def get_web_element_rect(browser, fix_color=True):
+    """
+    Mark the interactive elements of the viewport with numbered overlays. Overlays of a previous call are
+    replaced, so marking twice leaves a single set; remove them with remove_som_overlays.
+
+    Args:
+        browser: Selenium driver.
+        fix_color (bool): Black overlays instead of random colors.
+
+    Returns:
+        Tuple[int, list, str]: Number of overlays injected, marked WebElements and their text descriptions.
+    """
+    num_overlays, items_raw, _ = _mark_page(browser, fix_color, inject_overlays=True)
+    return num_overlays, [web_ele['element'] for web_ele in items_raw], format_element_text(items_raw)
+
+
+def get_web_element_boxes(browser):
+    """
+    Find the interactive elements of the viewport without touching the page; label them on the screenshot
+    with draw_set_of_mark
+
+    Args:
+        browser: Selenium driver.
+
+    Returns:
+        Tuple[list, float, list, str]: Visible rects (CSS pixels) of each element, device pixel ratio,
+            WebElements and their text descriptions.
+    """
+    _, items_raw, device_pixel_ratio = _mark_page(browser, inject_overlays=False)
+    return ([web_ele['rects'] for web_ele in items_raw], device_pixel_ratio,
+            [web_ele['element'] for web_ele in items_raw], format_element_text(items_raw))
+
+
+def _mark_page(browser, fix_color=True, inject_overlays=True):
+    """Run the marking script; returns (number of overlays, items, device pixel ratio)"""
     if fix_color:
         selected_function = "getFixedColor"
         # color_you_like = '#5210da'
@@ -44,68 +146,94 @@ def get_web_element_rect(browser, fix_color=True):
         selected_function = "getRandomColor"
 
     js_script = """
-        let labels = [];
-
         function markPage() {
-            var bodyRect = document.body.getBoundingClientRect();
+            // Replace the overlays of a previous call
+            document.querySelectorAll("[SOM_OVERLAY_ATTRIBUTE]").forEach(overlay => overlay.remove());
 
-            var items = Array.prototype.slice.call(
-                document.querySelectorAll('*')
-            ).map(function(element) {
-                var vw = Math.max(document.documentElement.clientWidth || 0, window.innerWidth || 0);
-                var vh = Math.max(document.documentElement.clientHeight || 0, window.innerHeight || 0);
-                
-                var rects = [...element.getClientRects()].filter(bb => {
-                var center_x = bb.left + bb.width / 2;
-                var center_y = bb.top + bb.height / 2;
-                var elAtCenter = document.elementFromPoint(center_x, center_y);
-
-                return elAtCenter === element || element.contains(elAtCenter) 
-                }).map(bb => {
-                const rect = {
-                    left: Math.max(0, bb.left),
-                    top: Math.max(0, bb.top),
-                    right: Math.min(vw, bb.right),
-                    bottom: Math.min(vh, bb.bottom)
-                };
-                return {
-                    ...rect,
-                    width: rect.right - rect.left,
-                    height: rect.bottom - rect.top
+
+            var vw = Math.max(document.documentElement.clientWidth || 0, window.innerWidth || 0);
+            var vh = Math.max(document.documentElement.clientHeight || 0, window.innerHeight || 0);
+
+            function isCandidate(element) {
+                var tag = element.tagName;
+                return (tag === "INPUT" || tag === "TEXTAREA" || tag === "SELECT") ||
+                    (tag === "BUTTON" || tag === "A" || (element.onclick != null)) ||
+                    (tag === "IFRAME" || tag === "VIDEO" || tag === "LI" || tag === "TD" || tag === "OPTION");
+            }
+
+            // Visible parts of the element, i.e. client rects whose center hits the element, clipped to the viewport.
+            // Centers outside the viewport never hit anything, so elementFromPoint is skipped for them.
+            function visibleRects(element) {
+                var rects = [];
+                for (const bb of element.getClientRects()) {
+                    var center_x = bb.left + bb.width / 2;
+                    var center_y = bb.top + bb.height / 2;
+                    if (center_x < 0 || center_y < 0 || center_x > vw || center_y > vh) continue;
+                    var elAtCenter = document.elementFromPoint(center_x, center_y);
+                    if (!(elAtCenter === element || element.contains(elAtCenter))) continue;
+                    const rect = {
+                        left: Math.max(0, bb.left),
+                        top: Math.max(0, bb.top),
+                        right: Math.min(vw, bb.right),
+                        bottom: Math.min(vh, bb.bottom)
+                    };
+                    rects.push({
+                        ...rect,
+                        width: rect.right - rect.left,
+                        height: rect.bottom - rect.top
+                    });
                 }
-                });
+                return rects;
+            }
 
+            // Single pass in document order; display:none subtrees have no boxes and are skipped entirely
+            var items = [];
+            var walker = document.createTreeWalker(document.documentElement, NodeFilter.SHOW_ELEMENT, {
+                acceptNode: function(element) {
+                    return window.getComputedStyle(element).display === "none" ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT;
+                }
+            });
+            for (var element = document.documentElement; element; element = walker.nextNode()) {
+                if (!isCandidate(element) && window.getComputedStyle(element).cursor != "pointer") continue;
+                var rects = visibleRects(element);
                 var area = rects.reduce((acc, rect) => acc + rect.width * rect.height, 0);
-
-                return {
-                element: element,
-                include: 
-                    (element.tagName === "INPUT" || element.tagName === "TEXTAREA" || element.tagName === "SELECT") ||
-                    (element.tagName === "BUTTON" || element.tagName === "A" || (element.onclick != null) || window.getComputedStyle(element).cursor == "pointer") ||
-                    (element.tagName === "IFRAME" || element.tagName === "VIDEO" || element.tagName === "LI" || element.tagName === "TD" || element.tagName === "OPTION")
-                ,
-                area,
-                rects,
-                text: element.textContent.trim().replace(/\s{2,}/g, ' ')
-                };
-            }).filter(item =>
-                item.include && (item.area >= 20)
-            );
+                if (area < 20) continue;
+                items.push({
+                    element: element,
+                    area,
+                    rects,
+                    text: element.textContent.trim().replace(/\s{2,}/g, ' ')
+                });
+            }
 
             // Only keep inner clickable items
             // first delete button inner clickable items
-            const buttons = Array.from(document.querySelectorAll('button, a, input[type="button"], div[role="button"]'));
+            var isButton = element => element.matches('button, a, input[type="button"], div[role="button"]');
+            var buttonItems = new Set(items.filter(x => isButton(x.element)).map(x => x.element));
+            function hasAncestorIn(element, set) {
+                for (var node = element.parentNode; node; node = node.parentNode) {
+                    if (set.has(node)) return true;
+                }
+                return false;
+            }
+            items = items.filter(x => !hasAncestorIn(x.element, buttonItems));
 
-            //items = items.filter(x => !buttons.some(y => y.contains(x.element) && !(x.element === y) ));
-            items = items.filter(x => !buttons.some(y => items.some(z => z.element === y) && y.contains(x.element) && !(x.element === y) ));
+            var itemElements = new Set(items.map(x => x.element));
             items = items.filter(x => 
                 !(x.element.parentNode && 
                 x.element.parentNode.tagName === 'SPAN' && 
                 x.element.parentNode.children.length === 1 && 
                 x.element.parentNode.getAttribute('role') &&
-                items.some(y => y.element === x.element.parentNode)));
+                itemElements.has(x.element.parentNode)));
 
-            items = items.filter(x => !items.some(y => x.element.contains(y.element) && !(x == y)))
+            // Drop items that contain another item
+            var containers = new Set();
+            items.forEach(x => {
+                for (var node = x.element.parentNode; node && !containers.has(node); node = node.parentNode) {
+                    containers.add(node);
+                }
+            });
+            items = items.filter(x => !containers.has(x.element));
 
             // Function to generate random colors
             function getRandomColor(index) {
@@ -127,10 +255,14 @@ def get_web_element_rect(browser, fix_color=True):
             //}
             
 
-            // Lets create a floating border on top of these elements that will always be visible
-            items.forEach(function(item, index) {
+            // Lets create a floating border on top of these elements that will always be visible.
+            // The overlays are built off-document and inserted at once to avoid a layout per element.
+            var fragment = document.createDocumentFragment();
+            var numOverlays = 0;
+            if (INJECT_OVERLAYS) items.forEach(function(item, index) {
                 item.rects.forEach((bbox) => {
-                newElement = document.createElement("div");
+                var newElement = document.createElement("div");
+                newElement.setAttribute("SOM_OVERLAY_ATTRIBUTE", "");
                 var borderColor = COLOR_FUNCTION(index);
                 newElement.style.outline = `2px dashed ${borderColor}`;
                 newElement.style.position = "fixed";
@@ -158,11 +290,12 @@ def get_web_element_rect(browser, fix_color=True):
                 label.style.borderRadius = "2px";
                 newElement.appendChild(label);
                 
-                document.body.appendChild(newElement);
-                labels.push(newElement);
+                fragment.appendChild(newElement);
+                numOverlays++;
                 // item.element.setAttribute("-ai-label", label.textContent);
                 });
             })
+            document.body.appendChild(fragment);
 
             // For the first way
             // return [labels, items.map(item => ({
@@ -170,22 +303,93 @@ def get_web_element_rect(browser, fix_color=True):
             // }))];
 
             // For the second way
-            return [labels, items]
+            // Element metadata is serialized here so that Python needs no WebDriver call per element
+            return [numOverlays, items.map(item => ({
+                element: item.element,
+                rects: item.rects,
+                text: item.text,
+                tag: item.element.tagName.toLowerCase(),
+                type: attributeValue(item.element, "type"),
+                aria_label: attributeValue(item.element, "aria-label")
+            })), window.devicePixelRatio || 1]
         }
-        return markPage();""".replace("COLOR_FUNCTION", selected_function)
-    rects, items_raw = browser.execute_script(js_script)
 
+        // Same lookup as WebDriver's getAttribute: the DOM property if it is a primitive, else the attribute
+        function attributeValue(element, name) {
+            var value = element[name];
+            if (value === undefined || value === null || typeof value === "object" || typeof value === "function") {
+                return element.getAttribute(name);
+            }
+            return String(value);
+        }
+        return markPage();""".replace("COLOR_FUNCTION", selected_function)
+    js_script = js_script.replace("SOM_OVERLAY_ATTRIBUTE", SOM_OVERLAY_ATTRIBUTE)
+    js_script = js_script.replace("INJECT_OVERLAYS", "true" if inject_overlays else "false")
+    start = time.time()
+    num_overlays, items_raw, device_pixel_ratio = browser.execute_script(js_script)
+    logging.info(f"Marked {len(items_raw)} elements in {time.time() - start:.2f}s")
+    return num_overlays, items_raw, device_pixel_ratio
+
+
+def draw_set_of_mark(png_bytes, boxes, device_pixel_ratio=1, fix_color=True):
+    """
+    Draw numbered boxes onto a copy of a screenshot, like the overlays injected by get_web_element_rect
+
+    Args:
+        png_bytes (bytes): Screenshot as returned by get_screenshot_as_png.
+        boxes (list): Visible rects (CSS pixels) of each element, as returned by get_web_element_boxes.
+        device_pixel_ratio (float): Screenshot pixels per CSS pixel.
+        fix_color (bool): Black boxes instead of random colors.
+
+    Returns:
+        bytes: Labelled screenshot as PNG.
+    """
+    image = Image.open(io.BytesIO(png_bytes)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    scale = device_pixel_ratio
+    font = ImageFont.load_default(size=12 * scale)
+    line_width = max(1, round(2 * scale))
+    for index, rects in enumerate(boxes):
+        color = "#000000" if fix_color else "#%06X" % random.randint(0, 0xFFFFFF)
+        for rect in rects:
+            left, top = rect['left'] * scale, rect['top'] * scale
+            right, bottom = rect['right'] * scale, rect['bottom'] * scale
+            draw.rectangle([left, top, right - 1, bottom - 1], outline=color, width=line_width)
+            # Label above the top left corner, kept inside the image
+            text_left, text_top, text_right, text_bottom = draw.textbbox((0, 0), str(index), font=font)
+            label_width = text_right - text_left + 8 * scale
+            label_height = text_bottom - text_top + 4 * scale
+            label_left = left + min(rect['width'] // 5, 2) * scale
+            label_top = max(0, top - 19 * scale)
+            draw.rectangle([label_left, label_top, label_left + label_width, label_top + label_height], fill=color)
+            draw.text((label_left + 4 * scale - text_left, label_top + 2 * scale - text_top), str(index),
+                      fill="white", font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def format_element_text(items_raw):
+    """
+    Describe the marked elements for the prompt
+
+    Args:
+        items_raw (list): Items returned by the marking script, with text, tag, type and aria_label.
+
+    Returns:
+        str: Tab-separated element descriptions.
+    """
     # format_ele_text = [f"[{web_ele_id}]: \"{items_raw[web_ele_id]['text']}\";" for web_ele_id in range(len(items_raw)) if items_raw[web_ele_id]['text'] ]
     format_ele_text = []
+    input_attr_types = ['text', 'search', 'password', 'email', 'tel']
     for web_ele_id in range(len(items_raw)):
         label_text = items_raw[web_ele_id]['text']
-        ele_tag_name = items_raw[web_ele_id]['element'].tag_name
-        ele_type = items_raw[web_ele_id]['element'].get_attribute("type")
-        ele_aria_label = items_raw[web_ele_id]['element'].get_attribute("aria-label")
-        input_attr_types = ['text', 'search', 'password', 'email', 'tel']
+        ele_tag_name = items_raw[web_ele_id]['tag']
+        ele_type = items_raw[web_ele_id]['type']
+        ele_aria_label = items_raw[web_ele_id]['aria_label']
 
         if not label_text:
-            if (ele_tag_name.lower() == 'input' and ele_type in input_attr_types) or ele_tag_name.lower() == 'textarea' or (ele_tag_name.lower() == 'button' and ele_type in ['submit', 'button']):
+            if (ele_tag_name == 'input' and ele_type in input_attr_types) or ele_tag_name == 'textarea' or (ele_tag_name == 'button' and ele_type in ['submit', 'button']):
                 if ele_aria_label:
                     format_ele_text.append(f"[{web_ele_id}]: <{ele_tag_name}> \"{ele_aria_label}\";")
                 else:
@@ -204,10 +408,222 @@ def get_web_element_rect(browser, fix_color=True):
                     else:
                         format_ele_text.append(f"[{web_ele_id}]: \"{label_text}\";")
 
+    return '\t'.join(format_ele_text)
+
 
+ELEMENT_TEXT_SEPARATOR = re.compile(r"\t(?=\[\d+\]: )")
+ACCESSIBILITY_TREE_NODE = re.compile(r"^\t*\[([^\]]+)\]")
 
-    format_ele_text = '\t'.join(format_ele_text)
-    return rects, [web_ele['element'] for web_ele in items_raw], format_ele_text
+
+def element_entries(format_ele_text, web_eles):
+    """
+    Split the set-of-mark element text into one entry per element, keyed by the element's WebDriver id,
+    which stays the same for a DOM node across steps
+
+    Args:
+        format_ele_text (str): Text returned by get_web_element_rect.
+        web_eles (list): Marked web elements, indexed by label.
+
+    Returns:
+        dict: Element id -> description line, in label order.
+    """
+    entries = {}
+    for line in ELEMENT_TEXT_SEPARATOR.split(format_ele_text):
+        if not line:
+            continue
+        label = int(re.match(r"\[(\d+)\]", line).group(1))
+        entries[web_eles[label].id] = line
+    return entries
+
+
+def accessibility_tree_entries(ac_tree):
+    """
+    Split the accessibility tree text into one entry per node, keyed by the node id
+
+    Args:
+        ac_tree (str): Text returned by get_webarena_accessibility_tree.
+
+    Returns:
+        dict: Node id -> line (without indentation), in tree order.
+    """
+    entries = {}
+    key = None
+    for line in ac_tree.split("\n"):
+        match = ACCESSIBILITY_TREE_NODE.match(line)
+        if match:
+            key = match.group(1)
+            entries[key] = line.strip()
+        elif key is not None:
+            # continuation of a property value containing a line break
+            entries[key] += "\n" + line
+    return entries
+
+
+class Observation:
+    """Observation - the artifacts of one agent step, each computed on first use and memoized, so that a step
+    only produces what its mode consumes"""
+
+    def __init__(self, browser, executor, som_render="page", fix_color=True, screenshot_format="png",
+                 screenshot_max_side=None, screenshot_quality=85, cdp=None, needs_screenshot=True):
+        """
+        Initialize the observation
+
+        Args:
+            browser: Selenium driver.
+            executor: Single-thread executor writing the archived files off the critical path. It never touches
+                the driver, which is not safe to share between threads.
+            som_render (str): "page" injects the set-of-mark overlays into the page, "screenshot" draws them
+                onto the screenshot.
+            fix_color (bool): Black set-of-mark boxes instead of random colors.
+            screenshot_format (str): Upload format of the screenshot, see encode_screenshot.
+            screenshot_max_side (Optional[int]): Downscaling of the uploaded screenshot, see encode_screenshot.
+            screenshot_quality (int): JPEG/WebP quality of the uploaded screenshot.
+            cdp (Optional[CDPChannel]): DevTools websocket of the page; screenshots and accessibility trees are
+                then fetched with pipelined commands instead of through Selenium.
+            needs_screenshot (bool): Whether the step will use or archive the screenshot; if so it is fetched in
+                the same round trip as the accessibility tree.
+        """
+        self.browser = browser
+        self.cdp = cdp
+        self.executor = executor
+        self.som_render = som_render
+        self.fix_color = fix_color
+        self.screenshot_format = screenshot_format
+        self.screenshot_max_side = screenshot_max_side
+        self.screenshot_quality = screenshot_quality
+        self.needs_screenshot = needs_screenshot
+        self.num_overlays = 0
+        self._pending = []
+
+    @cached_property
+    def elements(self):
+        """Set-of-mark elements: (WebElements, their text descriptions)"""
+        if self.som_render == "screenshot":
+            self._som_boxes, self._device_pixel_ratio, web_eles, web_eles_text = get_web_element_boxes(self.browser)
+        else:
+            self.num_overlays, web_eles, web_eles_text = get_web_element_rect(self.browser, fix_color=self.fix_color)
+        return web_eles, web_eles_text
+
+    @cached_property
+    def screenshot(self):
+        """Screenshot PNG bytes, with the set-of-mark labels once the elements were marked"""
+        png_bytes = self.cdp.capture_screenshot() if self.cdp is not None else self.browser.get_screenshot_as_png()
+        if "elements" in self.__dict__ and self.som_render == "screenshot":
+            start = time.time()
+            png_bytes = draw_set_of_mark(png_bytes, self._som_boxes, self._device_pixel_ratio, fix_color=self.fix_color)
+            logging.info(f"Drew {len(self._som_boxes)} labels onto the screenshot in {time.time() - start:.2f}s")
+        return png_bytes
+
+    @cached_property
+    def encoded_image(self):
+        """Screenshot encoded for upload: (base64 data, mime type)"""
+        start = time.time()
+        b64_img, mime_type = encode_screenshot(self.screenshot, self.screenshot_format, self.screenshot_max_side,
+                                               self.screenshot_quality)
+        logging.info(f"Screenshot upload: {len(b64_img)} bytes ({mime_type}), encoded in {time.time() - start:.2f}s")
+        return b64_img, mime_type
+
+    @cached_property
+    def accessibility_tree(self):
+        """Serialized accessibility tree of the viewport: (text, node info)"""
+        if self.cdp is None:
+            return get_webarena_accessibility_tree(self.browser)
+        # Fetch the screenshot in the same round trip if it is needed and nothing needed it yet
+        fetch_screenshot = (self.needs_screenshot and "screenshot" not in self.__dict__
+                            and "elements" not in self.__dict__)
+        browser_info, nodes, png_bytes = fetch_observation_data(self.cdp, screenshot=fetch_screenshot)
+        if png_bytes is not None:
+            self.__dict__["screenshot"] = png_bytes
+        return get_webarena_accessibility_tree(self.browser, prefetched=(browser_info, nodes))
+
+    def archive_screenshot(self, path):
+        """Write the screenshot in the background, capturing it first if no consumer needed it yet"""
+        self._pending.append(self.executor.submit(write_screenshot, path, self.screenshot))
+
+    def archive_accessibility_tree(self, save_file):
+        """Write the accessibility tree in the background, fetching it first if no consumer needed it yet"""
+        content, obs_nodes_info = self.accessibility_tree
+        self._pending.append(self.executor.submit(write_accessibility_tree, save_file, content, obs_nodes_info))
+
+    def wait(self):
+        """Wait for the archived files of the step to be written"""
+        for future in self._pending:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Failed to archive observation: {e}")
+        self._pending = []
+
+
+class ObservationCache:
+    """Observation Cache - keeps the previous step's elements so that the next observation can be sent as a diff"""
+
+    def __init__(self, keyframe_interval=5, max_change_ratio=0.5):
+        """
+        Initialize the observation cache
+
+        Args:
+            keyframe_interval (int): Send the full observation at least every N steps.
+            max_change_ratio (float): Send the full observation when more than this share of the elements changed.
+        """
+        self.keyframe_interval = keyframe_interval
+        self.max_change_ratio = max_change_ratio
+        self.page_key = None
+        self.entries = {}
+        self.steps_since_keyframe = 0
+        self.stats = {"keyframes": 0, "diffs": 0, "full_chars": 0, "sent_chars": 0}
+
+    def update(self, page_key, entries, full_text):
+        """
+        Record the current observation and describe it relative to the previous one
+
+        Args:
+            page_key (str): Identifies the document (e.g. the URL); a new document always gets a full observation.
+            entries (dict): Element key -> description line, in page order.
+            full_text (str): The full observation text.
+
+        Returns:
+            Optional[str]: The diff text, or None if the full observation should be sent.
+        """
+        previous = self.entries
+        added = [line for key, line in entries.items() if key not in previous]
+        changed = [(previous[key], line) for key, line in entries.items() if key in previous and previous[key] != line]
+        removed = [line for key, line in previous.items() if key not in entries]
+        unchanged = len(entries) - len(added) - len(changed)
+
+        keyframe = (
+            page_key != self.page_key
+            or self.steps_since_keyframe + 1 >= self.keyframe_interval
+            or len(added) + len(changed) + len(removed) > self.max_change_ratio * max(len(entries), 1)
+        )
+        self.page_key = page_key
+        self.entries = entries
+        self.stats["full_chars"] += len(full_text)
+
+        if keyframe:
+            self.steps_since_keyframe = 0
+            self.stats["keyframes"] += 1
+            self.stats["sent_chars"] += len(full_text)
+            return None
+
+        self.steps_since_keyframe += 1
+        lines = [f"Only the changes since the previous observation are listed; {unchanged} elements are unchanged "
+                 f"and keep their descriptions from the earlier observations."]
+        if added:
+            lines.append("Added:")
+            lines.extend(added)
+        if changed:
+            lines.append("Changed:")
+            lines.extend(f"{line} (was: {old_line})" for old_line, line in changed)
+        if removed:
+            lines.append("Removed:")
+            lines.extend(removed)
+        if not (added or changed or removed):
+            lines.append("No element changed.")
+        diff_text = "\n".join(lines)
+        self.stats["diffs"] += 1
+        self.stats["sent_chars"] += len(diff_text)
+        return diff_text
 
 
 def extract_information(text):
@@ -330,21 +746,43 @@ def print_message(json_object, save_dir=None):
     # return remove_b64code_obj
 
 
-def get_webarena_accessibility_tree(browser, save_file=None):
-    browser_info = fetch_browser_info(browser)
-    accessibility_tree = fetch_page_accessibility_tree(browser_info, browser, current_viewport_only=True)
-    content, obs_nodes_info = parse_accessibility_tree(accessibility_tree)
-    content = clean_accesibility_tree(content)
+def get_webarena_accessibility_tree(browser, save_file=None, cdp=None, prefetched=None):
+    """
+    Serialize the accessibility tree of the viewport
+
+    Args:
+        browser: Selenium driver.
+        save_file (Optional[str]): Archive the tree as <save_file>.json and <save_file>.txt.
+        cdp (Optional[CDPChannel]): DevTools websocket of the page; the snapshot, viewport metrics and tree
+            are then fetched with pipelined commands.
+        prefetched (Optional[tuple]): Browser info and tree nodes already returned by fetch_observation_data.
+
+    Returns:
+        Tuple[str, dict]: The tree text and node info.
+    """
+    if prefetched is None and cdp is not None:
+        prefetched = fetch_observation_data(cdp)[:2]
+    if prefetched is not None:
+        browser_info, nodes = prefetched
+    else:
+        browser_info, nodes = fetch_browser_info(browser), None
+    accessibility_tree = fetch_page_accessibility_tree(browser_info, browser, current_viewport_only=True,
+                                                       nodes=nodes)
+    content, obs_nodes_info = serialize_accessibility_tree(accessibility_tree)
     if save_file:
-        with open(save_file + '.json', 'w', encoding='utf-8') as fw:
-            json.dump(obs_nodes_info, fw, indent=2)
-        with open(save_file + '.txt', 'w', encoding='utf-8') as fw:
-            fw.write(content)
-
+        write_accessibility_tree(save_file, content, obs_nodes_info)
 
     return content, obs_nodes_info
 
 
+def write_accessibility_tree(save_file, content, obs_nodes_info):
+    """Archive a serialized accessibility tree as <save_file>.json (node info) and <save_file>.txt"""
+    with open(save_file + '.json', 'w', encoding='utf-8') as fw:
+        json.dump(obs_nodes_info, fw, indent=2)
+    with open(save_file + '.txt', 'w', encoding='utf-8') as fw:
+        fw.write(content)
+
+
 def compare_images(img1_path, img2_path):
     img1 = Image.open(img1_path)
     img2 = Image.open(img2_path)
@@ -1,4 +1,5 @@
-from typing import Any, TypedDict
+from typing import Any, Iterator, TypedDict
+import base64
 import re
 
 
@@ -31,6 +32,8 @@ class BrowserConfig(TypedDict):
 class BrowserInfo(TypedDict):
     DOMTree: dict[str, Any]
     config: BrowserConfig
+    # layout bounds of the main document as captured, before the calibration below
+    snapshot_bounds: list[list[float]]
 
 IGNORED_ACTREE_PROPERTIES = (
     "focusable",
@@ -46,6 +49,25 @@ AccessibilityTree = list[AccessibilityTreeNode]
 
 IN_VIEWPORT_RATIO_THRESHOLD = 0.6
 
+STATIC_TEXT_PATTERN = re.compile(r"\[\d+\] StaticText '([^']+)'")
+
+
+
+DOM_SNAPSHOT_PARAMS = {
+    "computedStyles": [],
+    "includeDOMRects": True,
+    "includePaintOrder": True,
+}
+
+# Everything fetch_browser_info reads from the page, in one expression
+VIEWPORT_METRICS_EXPRESSION = """({
+    pageYOffset: window.pageYOffset,
+    pageXOffset: window.pageXOffset,
+    screenWidth: window.screen.width,
+    screenHeight: window.screen.height,
+    devicePixelRatio: window.devicePixelRatio,
+    outerWidth: window.outerWidth
+})"""
 
 
 def fetch_browser_info(
@@ -53,35 +75,67 @@ def fetch_browser_info(
     browser,
 ) -> BrowserInfo:
     # extract domtree
-    tree = browser.execute_cdp_cmd(
-        "DOMSnapshot.captureSnapshot",
-        {
-            "computedStyles": [],
-            "includeDOMRects": True,
-            "includePaintOrder": True,
-        },
-    )
-
-    # calibrate the bounds, in some cases, the bounds are scaled somehow
-    bounds = tree["documents"][0]["layout"]["bounds"]
-    b = bounds[0]
-    n = b[2] / browser.get_window_size()["width"]
-    bounds = [[x / n for x in bound] for bound in bounds]
-    tree["documents"][0]["layout"]["bounds"] = bounds
+    tree = browser.execute_cdp_cmd("DOMSnapshot.captureSnapshot", DOM_SNAPSHOT_PARAMS)
 
     # extract browser info
     # win_top_bound = page.evaluate("window.pageYOffset")
     # win_left_bound = page.evaluate("window.pageXOffset")
     # win_width = page.evaluate("window.screen.width")
     # win_height = page.evaluate("window.screen.height")
+    metrics = {
+        "pageYOffset": browser.execute_script("return window.pageYOffset;"),
+        "pageXOffset": browser.execute_script("return window.pageXOffset;"),
+        "screenWidth": browser.execute_script("return window.screen.width;"),
+        "screenHeight": browser.execute_script("return window.screen.height;"),
+        "devicePixelRatio": browser.execute_script("return window.devicePixelRatio;"),
+        "outerWidth": browser.get_window_size()["width"],
+    }
+    return make_browser_info(tree, metrics)
+
+
+def fetch_observation_data(cdp, screenshot: bool = False) -> tuple[BrowserInfo, AccessibilityTree, bytes | None]:
+    """
+    Fetch the DOM snapshot, viewport metrics, accessibility tree and optionally a screenshot with pipelined
+    DevTools commands
+
+    Args:
+        cdp: cdp_client.CDPChannel of the page.
+        screenshot (bool): Also capture a PNG screenshot.
+
+    Returns:
+        Tuple of the browser info, the raw accessibility tree nodes (for fetch_page_accessibility_tree) and the
+        screenshot bytes or None.
+    """
+    commands = [
+        ("DOMSnapshot.captureSnapshot", DOM_SNAPSHOT_PARAMS),
+        ("Runtime.evaluate", {"expression": VIEWPORT_METRICS_EXPRESSION, "returnByValue": True}),
+        ("Accessibility.getFullAXTree", {}),
+    ]
+    if screenshot:
+        commands.append(("Page.captureScreenshot", {"format": "png"}))
+    results = cdp.execute_many(commands)
+    info = make_browser_info(results[0], results[1]["result"]["value"])
+    png_bytes = base64.b64decode(results[3]["data"]) if screenshot else None
+    return info, results[2]["nodes"], png_bytes
+
+
+def make_browser_info(tree: dict[str, Any], metrics: dict[str, Any]) -> BrowserInfo:
+    """Browser info from a DOM snapshot and the values of VIEWPORT_METRICS_EXPRESSION"""
+    # calibrate the bounds, in some cases, the bounds are scaled somehow
+    bounds = tree["documents"][0]["layout"]["bounds"]
+    snapshot_bounds = bounds
+    b = bounds[0]
+    n = b[2] / metrics["outerWidth"]
+    bounds = [[x / n for x in bound] for bound in bounds]
+    tree["documents"][0]["layout"]["bounds"] = bounds
 
-    win_top_bound = browser.execute_script("return window.pageYOffset;")
-    win_left_bound = browser.execute_script("return window.pageXOffset;")
-    win_width = browser.execute_script("return window.screen.width;")
-    win_height = browser.execute_script("return window.screen.height;")
+    win_top_bound = metrics["pageYOffset"]
+    win_left_bound = metrics["pageXOffset"]
+    win_width = metrics["screenWidth"]
+    win_height = metrics["screenHeight"]
     win_right_bound = win_left_bound + win_width
     win_lower_bound = win_top_bound + win_height
-    device_pixel_ratio = browser.execute_script("return window.devicePixelRatio;")
+    device_pixel_ratio = metrics["devicePixelRatio"]
     assert device_pixel_ratio == 1.0, "devicePixelRatio is not 1.0"
 
     config: BrowserConfig = {
@@ -95,7 +149,7 @@ def fetch_browser_info(
     }
 
     # assert len(tree['documents']) == 1, "More than one document in the DOM tree"
-    info: BrowserInfo = {"DOMTree": tree, "config": config}
+    info: BrowserInfo = {"DOMTree": tree, "config": config, "snapshot_bounds": snapshot_bounds}
 
     return info
 
@@ -136,6 +190,39 @@ def get_element_in_viewport_ratio(
 
 
 
+def build_layout_index(
+    info: BrowserInfo,
+) -> tuple[dict[int, list[float]], set[int]]:
+    """Map backendNodeId to the node's layout bounds in viewport coordinates,
+    using the DOM snapshot of the main document captured by fetch_browser_info.
+
+    Returns the index and the set of backendNodeIds present in the snapshot;
+    a node in the snapshot without layout has no box (e.g. display: none).
+    """
+    document = info["DOMTree"]["documents"][0]
+    backend_node_ids = document["nodes"]["backendNodeId"]
+    layout = document["layout"]
+    config = info["config"]
+
+    layout_index: dict[int, list[float]] = {}
+    # the captured bounds are CSS pixels like getBoundingClientRect; the calibrated
+    # DOMTree bounds are divided by documentElement width / outerWidth, which is
+    # not 1 whenever the window has a scrollbar or a frame, and would drift
+    for node_index, bound in zip(layout["nodeIndex"], info["snapshot_bounds"]):
+        backend_node_id = backend_node_ids[node_index]
+        if backend_node_id in layout_index:
+            continue
+        # snapshot bounds are relative to the document, getBoundingClientRect to the viewport
+        x, y, width, height = bound
+        layout_index[backend_node_id] = [
+            x - config["win_left_bound"],
+            y - config["win_top_bound"],
+            width,
+            height,
+        ]
+    return layout_index, set(backend_node_ids)
+
+
 def get_bounding_client_rect(
     browser, backend_node_id: str
 ) -> dict[str, Any]:
@@ -174,10 +261,12 @@ def fetch_page_accessibility_tree(
     browser,
     # client: CDPSession,
     current_viewport_only: bool,
+    nodes: AccessibilityTree | None = None,
 ) -> AccessibilityTree:
-    accessibility_tree: AccessibilityTree = browser.execute_cdp_cmd(
-        "Accessibility.getFullAXTree", {}
-    )["nodes"]
+    # nodes: already fetched, see fetch_observation_data
+    if nodes is None:
+        nodes = browser.execute_cdp_cmd("Accessibility.getFullAXTree", {})["nodes"]
+    accessibility_tree: AccessibilityTree = nodes
 
     # a few nodes are repeated in the accessibility tree
     seen_ids = set()
@@ -188,9 +277,9 @@ def fetch_page_accessibility_tree(
             seen_ids.add(node["nodeId"])
     accessibility_tree = _accessibility_tree
 
-    nodeid_to_cursor = {}
-    for cursor, node in enumerate(accessibility_tree):
-        nodeid_to_cursor[node["nodeId"]] = cursor
+    layout_index, snapshot_node_ids = build_layout_index(info)
+
+    for node in accessibility_tree:
         # usually because the node is not visible etc
         if "backendDOMNodeId" not in node:
             node["union_bound"] = None
@@ -199,7 +288,13 @@ def fetch_page_accessibility_tree(
         if node["role"]["value"] == "RootWebArea":
             # always inside the viewport
             node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
+        elif int(backend_node_id) in layout_index:
+            node["union_bound"] = layout_index[int(backend_node_id)]
+        elif int(backend_node_id) in snapshot_node_ids:
+            # no layout object, getBoundingClientRect would return an empty rect
+            node["union_bound"] = [0.0, 0.0, 0.0, 0.0]
         else:
+            # not in the main document snapshot, ask the browser
             response = get_bounding_client_rect(
                 browser, backend_node_id
             )
@@ -214,84 +309,91 @@ def fetch_page_accessibility_tree(
 
     # filter nodes that are not in the current viewport
     if current_viewport_only:
+        accessibility_tree = prune_to_viewport(accessibility_tree, info["config"])
 
-        def remove_node_in_graph(node: AccessibilityTreeNode) -> None:
-            # update the node information in the accessibility tree
-            nodeid = node["nodeId"]
-            node_cursor = nodeid_to_cursor[nodeid]
-            parent_nodeid = node["parentId"]
-            children_nodeids = node["childIds"]
-            parent_cursor = nodeid_to_cursor[parent_nodeid]
-            # update the children of the parent node
-            assert (
-                accessibility_tree[parent_cursor].get("parentId", "Root")
-                is not None
-            )
-            # remove the nodeid from parent's childIds
-            index = accessibility_tree[parent_cursor]["childIds"].index(
-                nodeid
-            )
-            accessibility_tree[parent_cursor]["childIds"].pop(index)
-            # Insert children_nodeids in the same location
-            for child_nodeid in children_nodeids:
-                accessibility_tree[parent_cursor]["childIds"].insert(
-                    index, child_nodeid
-                )
-                index += 1
-            # update children node's parent
-            for child_nodeid in children_nodeids:
-                child_cursor = nodeid_to_cursor[child_nodeid]
-                accessibility_tree[child_cursor][
-                    "parentId"
-                ] = parent_nodeid
-            # mark as removed
-            accessibility_tree[node_cursor]["parentId"] = "[REMOVED]"
-
-        config = info["config"]
-        for node in accessibility_tree:
-            if not node["union_bound"]:
-                remove_node_in_graph(node)
-                continue
+    return accessibility_tree
 
-            [x, y, width, height] = node["union_bound"]
 
-            # invisible node
-            if width == 0 or height == 0:
-                remove_node_in_graph(node)
-                continue
+def prune_to_viewport(
+    accessibility_tree: AccessibilityTree,
+    config: BrowserConfig,
+) -> AccessibilityTree:
+    """Remove the nodes without a box mostly inside the viewport, in linear time;
+    the children of a removed node take its place in its parent's childIds"""
+    nodeid_to_cursor = {}
+    for cursor, node in enumerate(accessibility_tree):
+        nodeid_to_cursor[node["nodeId"]] = cursor
 
-            in_viewport_ratio = get_element_in_viewport_ratio(
-                elem_left_bound=float(x),
-                elem_top_bound=float(y),
-                width=float(width),
-                height=float(height),
-                config=config,
-            )
+    removed_nodeids = set()
+    for node in accessibility_tree:
+        if not node["union_bound"]:
+            removed_nodeids.add(node["nodeId"])
+            continue
 
-            if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                remove_node_in_graph(node)
+        [x, y, width, height] = node["union_bound"]
 
-        accessibility_tree = [
-            node
-            for node in accessibility_tree
-            if node.get("parentId", "Root") != "[REMOVED]"
-        ]
+        # invisible node
+        if width == 0 or height == 0:
+            removed_nodeids.add(node["nodeId"])
+            continue
 
-    return accessibility_tree
+        in_viewport_ratio = get_element_in_viewport_ratio(
+            elem_left_bound=float(x),
+            elem_top_bound=float(y),
+            width=float(width),
+            height=float(height),
+            config=config,
+        )
 
+        if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
+            removed_nodeids.add(node["nodeId"])
+
+    # a kept node adopts the children of its removed descendants, in place
+    # and in order, as if each removed node was spliced out of the graph
+    def kept_children(node: AccessibilityTreeNode) -> list[str]:
+        children = []
+        stack = list(reversed(node["childIds"]))
+        while stack:
+            child_nodeid = stack.pop()
+            if (
+                child_nodeid in removed_nodeids
+                and child_nodeid in nodeid_to_cursor
+            ):
+                child = accessibility_tree[nodeid_to_cursor[child_nodeid]]
+                stack.extend(reversed(child["childIds"]))
+            else:
+                children.append(child_nodeid)
+        return children
 
-def parse_accessibility_tree(
+    pruned_tree = []
+    for node in accessibility_tree:
+        if node["nodeId"] in removed_nodeids:
+            node["parentId"] = "[REMOVED]"
+            continue
+        node["childIds"] = kept_children(node)
+        for child_nodeid in node["childIds"]:
+            if child_nodeid in nodeid_to_cursor:
+                accessibility_tree[nodeid_to_cursor[child_nodeid]][
+                    "parentId"
+                ] = node["nodeId"]
+        pruned_tree.append(node)
+    return pruned_tree
+
+
+def _iter_accessibility_tree_lines(
     accessibility_tree: AccessibilityTree,
-) -> tuple[str, dict[str, Any]]:
-    """Parse the accessibility tree into a string text"""
+    obs_nodes_info: dict[str, Any],
+) -> Iterator[str]:
+    """Yield the lines of the accessibility tree text in depth-first order,
+    filling obs_nodes_info on the way"""
     node_id_to_idx = {}
     for idx, node in enumerate(accessibility_tree):
         node_id_to_idx[node["nodeId"]] = idx
 
-    obs_nodes_info = {}
-
-    def dfs(idx: int, obs_node_id: str, depth: int) -> str:
-        tree_str = ""
+    # explicit stack instead of recursion, deeply nested pages exceed the recursion limit
+    stack = [(0, accessibility_tree[0]["nodeId"], 0)]
+    while stack:
+        idx, obs_node_id, depth = stack.pop()
         node = accessibility_tree[idx]
         indent = "\t" * depth
         valid_node = True
@@ -338,7 +440,8 @@ def parse_accessibility_tree(
                     valid_node = False
 
             if valid_node:
-                tree_str += f"{indent}{node_str}"
+                # the line is kept even if the node turns out to have no backend id
+                yield f"{indent}{node_str}"
                 obs_nodes_info[obs_node_id] = {
                     "backend_id": node["backendDOMNodeId"],
                     "union_bound": node["union_bound"],
@@ -348,42 +451,64 @@ def parse_accessibility_tree(
         except:
             valid_node = False
 
-        for _, child_node_id in enumerate(node["childIds"]):
+        # mark this to save some tokens
+        child_depth = depth + 1 if valid_node else depth
+        for child_node_id in reversed(node["childIds"]):
             if child_node_id not in node_id_to_idx:
                 continue
-            # mark this to save some tokens
-            child_depth = depth + 1 if valid_node else depth
-            child_str = dfs(
-                node_id_to_idx[child_node_id], child_node_id, child_depth
+            stack.append(
+                (node_id_to_idx[child_node_id], child_node_id, child_depth)
             )
-            if child_str.strip():
-                if tree_str.strip():
-                    tree_str += "\n"
-                tree_str += child_str
 
-        return tree_str
 
-    tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
-    return tree_str, obs_nodes_info
+def parse_accessibility_tree(
+    accessibility_tree: AccessibilityTree,
+) -> tuple[str, dict[str, Any]]:
+    """Parse the accessibility tree into a string text"""
+    obs_nodes_info: dict[str, Any] = {}
+    lines = list(
+        _iter_accessibility_tree_lines(accessibility_tree, obs_nodes_info)
+    )
+    return "\n".join(lines), obs_nodes_info
+
+
+def serialize_accessibility_tree(
+    accessibility_tree: AccessibilityTree,
+) -> tuple[str, dict[str, Any]]:
+    """Parse the accessibility tree into cleaned text in a single pass,
+    same as clean_accesibility_tree(parse_accessibility_tree(...))"""
+    obs_nodes_info: dict[str, Any] = {}
+    clean_lines: list[str] = []
+    for node_line in _iter_accessibility_tree_lines(
+        accessibility_tree, obs_nodes_info
+    ):
+        # property values may contain line breaks
+        for line in node_line.split("\n"):
+            _append_clean_line(clean_lines, line)
+    return "\n".join(clean_lines), obs_nodes_info
+
+
+def _append_clean_line(clean_lines: list[str], line: str) -> None:
+    """Keep the line unless it is a StaticText repeating one of the last 3 lines"""
+    if "statictext" in line.lower():
+        prev_lines = clean_lines[-3:]
+
+        match = STATIC_TEXT_PATTERN.search(line)
+        if match:
+            static_text = match.group(1)
+            if all(
+                static_text not in prev_line
+                for prev_line in prev_lines
+            ):
+                clean_lines.append(line)
+    else:
+        clean_lines.append(line)
 
 
 def clean_accesibility_tree(tree_str: str) -> str:
     """further clean accesibility tree"""
     clean_lines: list[str] = []
     for line in tree_str.split("\n"):
-        if "statictext" in line.lower():
-            prev_lines = clean_lines[-3:]
-            pattern = r"\[\d+\] StaticText '([^']+)'"
-
-            match = re.search(pattern, line)
-            if match:
-                static_text = match.group(1)
-                if all(
-                    static_text not in prev_line
-                    for prev_line in prev_lines
-                ):
-                    clean_lines.append(line)
-        else:
-            clean_lines.append(line)
+        _append_clean_line(clean_lines, line)
 
     return "\n".join(clean_lines)